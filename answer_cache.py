@@ -0,0 +1,119 @@
+"""Кэш ответов модели на повторяющиеся вопросы"""
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+
+from retrieval import analyze
+
+
+def normalize_question(question):
+    """Нормализует вопрос: отсортированные основы значимых слов без повторов.
+
+    Вопросы, отличающиеся только порядком слов, формой слов или служебными
+    словами, дают одинаковый результат.
+    """
+    return " ".join(sorted(set(analyze(question))))
+
+
+def make_key(question, chunk_ids, version):
+    """Ключ кэша: нормализованный вопрос, найденные фрагменты и версия базы знаний"""
+    payload = "\n".join([version, normalize_question(question), ",".join(sorted(chunk_ids))])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """LRU-кэш ответов с временем жизни и необязательным сохранением на диск"""
+
+    def __init__(self, max_entries=500, ttl=24 * 60 * 60, path=None, save_interval=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # key -> {"answer", "version", "created"}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.last_save = time.monotonic()
+        if path:
+            self._load()
+
+    def get(self, key):
+        """Возвращает сохраненный ответ или None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry["created"] > self.ttl:
+                if entry is not None:
+                    del self.entries[key]
+                    self.dirty = True
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry["answer"]
+
+    def put(self, key, answer, version):
+        """Сохраняет ответ, вытесняя самые давно использованные записи"""
+        with self.lock:
+            self.entries[key] = {"answer": answer, "version": version, "created": time.time()}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+            need_save = self.path and time.monotonic() - self.last_save >= self.save_interval
+        if need_save:
+            self.save()
+
+    def retain_version(self, version):
+        """Удаляет ответы, полученные на других версиях базы знаний"""
+        with self.lock:
+            stale = [key for key, entry in self.entries.items() if entry["version"] != version]
+            for key in stale:
+                del self.entries[key]
+            if stale:
+                self.dirty = True
+        return len(stale)
+
+    def stats(self):
+        """Статистика попаданий и промахов кэша"""
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    def save(self):
+        """Атомарно сохраняет кэш на диск"""
+        if not self.path:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            payload = json.dumps(list(self.entries.items()), ensure_ascii=False)
+            self.dirty = False
+            self.last_save = time.monotonic()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                items = json.load(f)
+        except Exception as e:
+            print(f"Ошибка чтения кэша ответов {self.path}: {e}")
+            return
+        now = time.time()
+        for key, entry in items[-self.max_entries:]:
+            if now - entry["created"] <= self.ttl:
+                self.entries[key] = entry
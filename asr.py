@@ -0,0 +1,156 @@
+"""Распознавание речи с выбором движка: Google (онлайн), Vosk или Whisper (офлайн, CPU)"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+SAMPLE_WIDTH = 2  # Распознаватели получают 16-битный моно PCM
+
+
+class SpeechBackend:
+    """Базовый движок распознавания: модель загружается один раз и используется всеми"""
+
+    name = "base"
+
+    def __init__(self, language="ru"):
+        self.language = language
+        self._load_lock = threading.Lock()
+        self._loaded = False
+
+    def load(self):
+        """Загружает модель (повторные вызовы ничего не делают)"""
+        with self._load_lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+
+    def transcribe(self, pcm, sample_rate):
+        """Возвращает распознанный текст или None"""
+        self.load()
+        return self._transcribe(pcm, sample_rate)
+
+    def _load(self):
+        pass
+
+    def _transcribe(self, pcm, sample_rate):
+        raise NotImplementedError
+
+
+class GoogleBackend(SpeechBackend):
+    """Онлайн-распознавание через Google Speech API (нужен доступ в интернет)"""
+
+    name = "google"
+
+    def _load(self):
+        import speech_recognition as sr
+        self.sr = sr
+        self.recognizer = sr.Recognizer()
+
+    def _transcribe(self, pcm, sample_rate):
+        audio_data = self.sr.AudioData(pcm, sample_rate, SAMPLE_WIDTH)
+        try:
+            return self.recognizer.recognize_google(audio_data, language=f"{self.language}-{self.language.upper()}")
+        except self.sr.UnknownValueError:
+            return None
+
+
+class VoskBackend(SpeechBackend):
+    """Офлайн-распознавание Vosk (Kaldi), модель из каталога model_path"""
+
+    name = "vosk"
+
+    def __init__(self, model_path, language="ru"):
+        super().__init__(language)
+        self.model_path = model_path
+
+    def _load(self):
+        import vosk
+        vosk.SetLogLevel(-1)
+        self.vosk = vosk
+        self.model = vosk.Model(self.model_path)
+
+    def _transcribe(self, pcm, sample_rate):
+        # Распознаватель легкий, модель в памяти общая для всех запросов
+        recognizer = self.vosk.KaldiRecognizer(self.model, sample_rate)
+        recognizer.AcceptWaveform(pcm)
+        text = json.loads(recognizer.FinalResult()).get("text", "").strip()
+        return text or None
+
+
+class WhisperBackend(SpeechBackend):
+    """Офлайн-распознавание faster-whisper на CPU (int8)"""
+
+    name = "whisper"
+
+    def __init__(self, model_name="small", language="ru", cpu_threads=0):
+        super().__init__(language)
+        self.model_name = model_name
+        self.cpu_threads = cpu_threads
+
+    def _load(self):
+        import numpy
+        from faster_whisper import WhisperModel
+        self.numpy = numpy
+        self.model = WhisperModel(self.model_name, device="cpu", compute_type="int8",
+                                  cpu_threads=self.cpu_threads)
+
+    def _transcribe(self, pcm, sample_rate):
+        # Whisper ожидает float32 в диапазоне [-1, 1] с частотой 16 кГц
+        audio = self.numpy.frombuffer(pcm, dtype=self.numpy.int16).astype(self.numpy.float32) / 32768.0
+        segments, _ = self.model.transcribe(audio, language=self.language, beam_size=1, vad_filter=True)
+        text = " ".join(segment.text.strip() for segment in segments).strip()
+        return text or None
+
+
+def create_backend(engine, **options):
+    """Создает движок распознавания по имени из конфигурации"""
+    if engine == "google":
+        return GoogleBackend(language=options.get("language", "ru"))
+    if engine == "vosk":
+        return VoskBackend(options["vosk_model_path"], language=options.get("language", "ru"))
+    if engine == "whisper":
+        return WhisperBackend(options.get("whisper_model", "small"), language=options.get("language", "ru"),
+                              cpu_threads=options.get("cpu_threads", 0))
+    raise ValueError(f"Неизвестный движок распознавания речи: {engine}")
+
+
+class SpeechService:
+    """Очередь распознавания поверх одного движка.
+
+    Одновременно обрабатывается не больше workers записей, остальные ждут
+    в очереди, поэтому несколько голосовых подряд не загружают модель
+    повторно и не перегружают процессор.
+    """
+
+    def __init__(self, backend, workers=1):
+        self.backend = backend
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="asr")
+        self.lock = threading.Lock()
+        self.last_stats = None
+
+    def warm_up(self):
+        """Фоново загружает модель, чтобы первое голосовое не ждало загрузки"""
+        return self.executor.submit(self.backend.load)
+
+    def transcribe(self, pcm, sample_rate):
+        """Распознает PCM-запись (блокирует до результата)"""
+        return self.executor.submit(self._run, pcm, sample_rate).result()
+
+    def _run(self, pcm, sample_rate):
+        started = time.perf_counter()
+        text = self.backend.transcribe(pcm, sample_rate)
+        elapsed = time.perf_counter() - started
+        metrics.observe("asr", elapsed)
+        duration = len(pcm) / (sample_rate * SAMPLE_WIDTH)
+        stats = {
+            "engine": self.backend.name,
+            "audio_seconds": duration,
+            "seconds": elapsed,
+            "rtf": elapsed / duration if duration else 0.0,
+        }
+        with self.lock:
+            self.last_stats = stats
+        print(f"🎤 {stats['engine']}: {duration:.1f} с аудио за {elapsed:.2f} с (RTF {stats['rtf']:.2f})")
+        return text
@@ -0,0 +1,388 @@
+"""Замер производительности бота без Telegram и без настоящей модели.
+
+Бот работает с заглушкой Telegram и локальным поддельным сервером ollama,
+база знаний - настоящая папка data. Кэши создаются во временной папке,
+рабочие кэши бота не затрагиваются.
+
+Запуск:
+    python benchmark.py
+    python benchmark.py --answers 50 --token-delay 0.01 --compare cache/benchmarks/<прошлый>.json
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import math
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+EMBEDDING_DIM = 256
+
+
+def percentile(values, p):
+    """Перцентиль p (0-100) методом ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(seconds):
+    """p50/p95/max в миллисекундах"""
+    return {
+        "count": len(seconds),
+        "p50_ms": round(percentile(seconds, 50) * 1000, 3) if seconds else None,
+        "p95_ms": round(percentile(seconds, 95) * 1000, 3) if seconds else None,
+        "max_ms": round(max(seconds) * 1000, 3) if seconds else None,
+    }
+
+
+def peak_rss_mb():
+    """Пиковое потребление памяти процессом и его дочерними процессами (разбор PDF)"""
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024  # ru_maxrss: байты на macOS, КБ на Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {"self_mb": round(own / scale, 1), "children_mb": round(children / scale, 1)}
+
+
+def fake_embedding(text):
+    """Детерминированный вектор: слова текста, разложенные хэшем по координатам"""
+    vector = [0.0] * EMBEDDING_DIM
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        vector[digest[0] % EMBEDDING_DIM] += 1.0 if digest[1] & 1 else -1.0
+    return vector
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Поддельный сервер ollama: /api/chat (с потоком) и /api/embeddings"""
+
+    protocol_version = "HTTP/1.1"  # Соединения переиспользуются, как с настоящим сервером
+    tokens = 100
+    token_delay = 0.005
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path == "/api/embeddings":
+            self._send_json({"embedding": fake_embedding(request.get("prompt", ""))})
+            return
+        if self.path != "/api/chat":
+            self.send_error(404)
+            return
+
+        messages = request.get("messages") or []
+        prompt_chars = sum(len(message.get("content", "")) for message in messages)
+        count = (request.get("options") or {}).get("num_predict") or self.tokens
+        words = ["Согласно", "документу", "[Источник:", "файл.pdf]", "требуется"]
+        started = time.perf_counter()
+
+        def final(content):
+            elapsed = int((time.perf_counter() - started) * 1e9)
+            return {"model": request.get("model"), "message": {"role": "assistant", "content": content},
+                    "done": True, "total_duration": elapsed, "load_duration": 0,
+                    "prompt_eval_count": prompt_chars // 3, "prompt_eval_duration": 0,
+                    "eval_count": count, "eval_duration": elapsed}
+
+        if not request.get("stream", True):
+            time.sleep(self.token_delay * count)
+            self._send_json(final(" ".join(words[i % len(words)] for i in range(count))))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(count):
+            time.sleep(self.token_delay)
+            part = {"message": {"role": "assistant", "content": words[i % len(words)] + " "}, "done": False}
+            self._write_chunk(json.dumps(part).encode("utf-8") + b"\n")
+        self._write_chunk(json.dumps(final("")).encode("utf-8") + b"\n")
+        self._write_chunk(b"")
+
+
+class StubBot:
+    """Заглушка Telegram: запоминает отправленные сообщения, ничего не отправляет"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.sent = []  # (время, chat_id, текст)
+
+    def _record(self, chat_id, text):
+        with self.lock:
+            self.sent.append((time.perf_counter(), chat_id, text))
+            message_id = self.next_id
+            self.next_id += 1
+        return SimpleNamespace(message_id=message_id, chat=SimpleNamespace(id=chat_id), document=None)
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._record(chat_id, text)
+
+    def reply_to(self, message, text, **kwargs):
+        return self._record(message.chat.id, text)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return self._record(chat_id, text)
+
+    def first_message_after(self, chat_id, started):
+        with self.lock:
+            for sent_at, sent_chat, _ in self.sent:
+                if sent_chat == chat_id and sent_at >= started:
+                    return sent_at
+        return None
+
+    def __getattr__(self, name):
+        # send_chat_action, answer_callback_query и прочие вызовы ничего не делают
+        return lambda *args, **kwargs: None
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def auto_questions(corpus, count):
+    """Вопросы из начала фрагментов, равномерно по всей базе знаний"""
+    chunks = corpus.index.chunks
+    if not chunks:
+        return []
+    step = max(1, len(chunks) // count)
+    questions = []
+    for chunk in chunks[::step][:count]:
+        words = re.findall(r"\w+", chunk["text"])[:10]
+        if words:
+            questions.append("Что говорится о " + " ".join(words))
+    return questions
+
+
+def bench_ingestion(main, temp_dir):
+    from corpus_store import CorpusStore
+    from retrieval import PAGE_SEPARATOR
+
+    paths = [path for path in sorted(os.listdir(main.DATA_FOLDER))
+             if os.path.isfile(os.path.join(main.DATA_FOLDER, path))]
+    total_bytes = sum(os.path.getsize(os.path.join(main.DATA_FOLDER, path)) for path in paths)
+
+    main.corpus_store = CorpusStore(os.path.join(temp_dir, "corpus"), main.PARSER_VERSION)
+    started = time.perf_counter()
+    corpus = main.load_all_data_with_sources()
+    cold = time.perf_counter() - started
+
+    started = time.perf_counter()
+    main.load_all_data_with_sources()
+    warm = time.perf_counter() - started
+
+    pages = 0
+    for path in paths:
+        text, _ = main.corpus_store.lookup(os.path.join(main.DATA_FOLDER, path))
+        if text:
+            pages += text.count(PAGE_SEPARATOR) + 1
+
+    # Прогрев модели и эмбеддинги идут в фоне после публикации снимка - дожидаемся их
+    started = time.perf_counter()
+    main.reindex_executor.submit(lambda: None).result()
+    background = time.perf_counter() - started
+
+    return corpus, {
+        "files": len(paths),
+        "indexed_files": len(corpus),
+        "duplicates": len(corpus.duplicates),
+        "chunks": len(corpus.index.chunks),
+        "megabytes": round(total_bytes / 1024 / 1024, 3),
+        "pages": pages,
+        "cold_seconds": round(cold, 3),
+        "warm_seconds": round(warm, 3),
+        "pages_per_second": round(pages / cold, 1) if cold else None,
+        "mb_per_second": round(total_bytes / 1024 / 1024 / cold, 3) if cold else None,
+        "background_seconds": round(background, 3),
+    }
+
+
+def bench_relevance(main, corpus, questions):
+    timings = []
+    relevant = 0
+    for question in questions:
+        started = time.perf_counter()
+        passages = main.search_passages(question, corpus)
+        if main.is_question_relevant(question, corpus, passages):
+            relevant += 1
+        timings.append(time.perf_counter() - started)
+    result = latency_summary(timings)
+    result["relevant_ratio"] = round(relevant / len(questions), 3) if questions else None
+    return result
+
+
+def bench_prompt(main, corpus, questions):
+    from chat_context import estimate_tokens
+    from retrieval import build_context_message
+
+    timings = []
+    for _ in range(20):
+        started = time.perf_counter()
+        system_prompt = main.get_system_prompt(corpus)
+        timings.append(time.perf_counter() - started)
+
+    sizes = []
+    for question in questions:
+        passages = main.search_passages(question, corpus)
+        context = build_context_message([chunk for _, chunk, _ in passages], max_chars=main.MAX_CONTEXT_CHARS)
+        sizes.append(sum(estimate_tokens(message["content"]) for message in (system_prompt, context))
+                     + estimate_tokens(question))
+    return {
+        "system_prompt_tokens": estimate_tokens(system_prompt["content"]),
+        "system_prompt_latency": latency_summary(timings),
+        "request_tokens_mean": round(sum(sizes) / len(sizes), 1) if sizes else None,
+        "request_tokens_max": max(sizes) if sizes else None,
+    }
+
+
+def bench_answers(main, corpus, questions, count):
+    stub = main.bot
+    totals = []
+    first = []
+    for i in range(count):
+        chat_id = 10_000 + i
+        main.start_ai_session(chat_id, corpus)
+        question = questions[i % len(questions)]
+        started = time.perf_counter()
+        generation = main.process_ai_question(chat_id, question)
+        if generation is not None:
+            generation.result()
+        totals.append(time.perf_counter() - started)
+        first_sent = stub.first_message_after(chat_id, started)
+        if first_sent is not None:
+            first.append(first_sent - started)
+        main.user_contexts.drop(chat_id)
+    return {"total": latency_summary(totals), "first_message": latency_summary(first)}
+
+
+def compare(current, previous, path=""):
+    """Печатает изменения числовых показателей относительно прошлого запуска"""
+    for key, value in current.items():
+        old = previous.get(key) if isinstance(previous, dict) else None
+        name = f"{path}.{key}" if path else key
+        if isinstance(value, dict):
+            compare(value, old or {}, name)
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old != value:
+            change = f"{(value - old) / old:+.1%}" if old else "new"
+            print(f"  {name}: {old} -> {value} ({change})")
+
+
+def run_benchmarks(main, args, temp_dir, revision):
+    """Все замеры; None, если вопросов нет"""
+    corpus, ingestion = bench_ingestion(main, temp_dir)
+    main.bot_ready.set()
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = auto_questions(corpus, args.relevance_questions)
+    if not questions:
+        print("❌ Нет вопросов: папка data пуста?")
+        return None
+
+    return {
+        "revision": revision,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "ingestion": ingestion,
+        "relevance": bench_relevance(main, corpus, questions),
+        "prompt": bench_prompt(main, corpus, questions),
+        "answers": bench_answers(main, corpus, questions, args.answers),
+        "memory": peak_rss_mb(),
+    }
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", help="Файл с вопросами, по одному в строке")
+    parser.add_argument("--relevance-questions", type=int, default=200, help="Сколько вопросов сгенерировать")
+    parser.add_argument("--answers", type=int, default=20, help="Сколько ответов получить от поддельной модели")
+    parser.add_argument("--tokens", type=int, default=100, help="Токенов в ответе поддельной модели")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="Задержка между токенами, секунд")
+    parser.add_argument("--output", help="Файл результатов JSON (по умолчанию cache/benchmarks/<время>.json)")
+    parser.add_argument("--compare", help="Прошлый файл результатов для сравнения")
+    args = parser.parse_args()
+
+    FakeOllamaHandler.tokens = args.tokens
+    FakeOllamaHandler.token_delay = args.token_delay
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["OLLAMA_HOSTS"] = f"http://127.0.0.1:{server.server_port}"
+
+    work_dir = os.getcwd()
+    for name in ("questions", "output", "compare"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    revision = git_revision()
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as temp_dir:
+        # main при импорте открывает кэши и базу сессий по относительным путям:
+        # бот работает из временной папки, рабочие файлы не затрагиваются
+        os.chdir(temp_dir)
+        try:
+            import main
+            from answer_cache import AnswerCache
+
+            main.DATA_FOLDER = os.path.join(work_dir, main.DATA_FOLDER)
+            main.bot = StubBot()
+            main.answer_cache = AnswerCache(max_entries=0)  # Каждый ответ генерируется заново
+            if main.EMBEDDINGS_ENABLED:
+                main.embedding_index = main.create_embedding_index(os.path.join(temp_dir, "embeddings"))
+
+            results = run_benchmarks(main, args, temp_dir, revision)
+            main.session_store.close()
+        finally:
+            os.chdir(work_dir)
+    server.shutdown()
+    if results is None:
+        return 1
+
+    output = args.output or os.path.join("cache", "benchmarks",
+                                         datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"📄 Результаты сохранены в {output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        print(f"📊 Изменения относительно {args.compare}:")
+        compare(results, previous)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
@@ -0,0 +1,149 @@
+"""Контексты диалогов с ограниченным бюджетом токенов"""
+import threading
+import time
+
+CHARS_PER_TOKEN = 3  # Грубая оценка для русского текста в токенизаторе llama3
+
+
+def estimate_tokens(text):
+    """Приблизительное число токенов в тексте"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class ChatContexts:
+    """Хранит системное сообщение и последние реплики каждого чата.
+
+    История ограничена token_budget токенами: старые пары вопрос-ответ
+    вытесняются и заменяются короткой сводкой из прошлых вопросов.
+    Чаты без активности дольше idle_ttl секунд удаляются целиком,
+    on_evict(chat_id) позволяет очистить связанные данные.
+    on_change(chat_id, запись или None) получает компактную запись
+    истории (без системного сообщения) после каждого изменения.
+    """
+
+    def __init__(self, token_budget=2000, idle_ttl=3600, summary_chars=400, on_evict=None, on_change=None):
+        self.token_budget = token_budget
+        self.idle_ttl = idle_ttl
+        self.summary_chars = summary_chars
+        self.on_evict = on_evict
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.chats = {}
+
+    def __contains__(self, chat_id):
+        self.evict_idle()
+        with self.lock:
+            return chat_id in self.chats
+
+    def __len__(self):
+        with self.lock:
+            return len(self.chats)
+
+    def start(self, chat_id, system_message):
+        """Начинает новый диалог (или сбрасывает существующий)"""
+        self.evict_idle()
+        with self.lock:
+            chat = self.chats[chat_id] = {
+                "system": system_message,
+                "summary": "",
+                "turns": [],
+                "tokens": 0,
+                "last_used": time.monotonic(),
+            }
+            record = self._record(chat)
+        self._changed(chat_id, record)
+
+    def restore(self, chat_id, record, system_message):
+        """Восстанавливает диалог из записи, полученной через on_change"""
+        turns = [({"role": "user", "content": question}, {"role": "assistant", "content": answer})
+                 for question, answer in record["turns"]]
+        with self.lock:
+            self.chats[chat_id] = {
+                "system": system_message,
+                "summary": record["summary"],
+                "turns": turns,
+                "tokens": sum(self._turn_tokens(question, answer) for question, answer in turns),
+                "last_used": time.monotonic() - max(0.0, time.time() - record["updated"]),
+            }
+
+    def set_system(self, chat_id, system_message):
+        """Заменяет системное сообщение, сохраняя историю"""
+        with self.lock:
+            if chat_id in self.chats:
+                self.chats[chat_id]["system"] = system_message
+
+    def drop(self, chat_id):
+        """Удаляет контекст чата"""
+        with self.lock:
+            existed = self.chats.pop(chat_id, None) is not None
+        if existed:
+            self._changed(chat_id, None)
+
+    def messages(self, chat_id):
+        """Сообщения для модели: системное, сводка старой истории и последние реплики"""
+        with self.lock:
+            chat = self.chats[chat_id]
+            chat["last_used"] = time.monotonic()
+            result = [chat["system"]]
+            if chat["summary"]:
+                result.append({"role": "system",
+                               "content": f"Ранее в диалоге пользователь спрашивал: {chat['summary']}"})
+            for question, answer in chat["turns"]:
+                result.append(question)
+                result.append(answer)
+            return result
+
+    def add_turn(self, chat_id, question, answer):
+        """Добавляет пару вопрос-ответ и вытесняет старые реплики сверх бюджета"""
+        with self.lock:
+            chat = self.chats.get(chat_id)
+            if chat is None:
+                return
+            chat["last_used"] = time.monotonic()
+            chat["turns"].append((question, answer))
+            chat["tokens"] += self._turn_tokens(question, answer)
+
+            while chat["tokens"] > self.token_budget and len(chat["turns"]) > 1:
+                old_question, old_answer = chat["turns"].pop(0)
+                chat["tokens"] -= self._turn_tokens(old_question, old_answer)
+                chat["summary"] = self._extend_summary(chat["summary"], old_question["content"])
+            record = self._record(chat)
+        self._changed(chat_id, record)
+
+    def evict_idle(self):
+        """Удаляет чаты, неактивные дольше idle_ttl"""
+        deadline = time.monotonic() - self.idle_ttl
+        with self.lock:
+            expired = [chat_id for chat_id, chat in self.chats.items() if chat["last_used"] < deadline]
+            for chat_id in expired:
+                del self.chats[chat_id]
+        for chat_id in expired:
+            self._changed(chat_id, None)
+            if self.on_evict:
+                self.on_evict(chat_id)
+        return expired
+
+    @staticmethod
+    def _record(chat):
+        """Компактная запись истории: сводка, тексты реплик и время последнего обращения"""
+        return {
+            "summary": chat["summary"],
+            "turns": [[question["content"], answer["content"]] for question, answer in chat["turns"]],
+            "updated": time.time() - (time.monotonic() - chat["last_used"]),
+        }
+
+    def _changed(self, chat_id, record):
+        if self.on_change:
+            self.on_change(chat_id, record)
+
+    @staticmethod
+    def _turn_tokens(question, answer):
+        return estimate_tokens(question["content"]) + estimate_tokens(answer["content"])
+
+    def _extend_summary(self, summary, question_text):
+        """Добавляет вопрос в сводку, оставляя только последние summary_chars символов"""
+        question_text = " ".join(question_text.split())[:150]
+        summary = f"{summary}; {question_text}" if summary else question_text
+        if len(summary) > self.summary_chars:
+            summary = "…" + summary[-self.summary_chars:]
+        return summary
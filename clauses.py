@@ -0,0 +1,233 @@
+"""Указатель пунктов документов: номер приказа -> часть -> раздел -> пункт со смещениями в тексте"""
+import bisect
+import re
+
+from retrieval import CLAUSE_RE, SECTION_RE, tokenize
+
+# Номер приказа в имени файла или в шапке документа: "N 782Н", "N534", "№ 903н"
+ORDER_RE = re.compile(r'(?:\bN|№)\s*(\d{1,5})\s*-?\s*([нНnH])?(?![\w])')
+# Ссылка на пункт в вопросе: "пункт 45", "в пункте 12.3", "п. 7"
+CLAUSE_REF_RE = re.compile(r'(?:\bпункт[а-я]*|\bп\.)\s*(\d{1,4}(?:\.\d{1,3})*)', re.IGNORECASE)
+NUMBER_RE = re.compile(r'\d{1,5}')
+# Пункт после колонтитула в начале страницы PDF: "↓ на сайт  5 30. Устройство..."
+PAGE_CLAUSE_RE = re.compile(r'^.{0,40}?\s(\d{1,4})\.\s+[А-ЯЁA-Z]')
+HEADER_CHARS = 3000  # Где искать номер приказа, если его нет в имени файла
+MAX_CLAUSE_GAP = 5  # Допустимый пропуск номеров (опечатка "662 " без точки в исходном документе)
+MAX_ANSWER_CHARS = 3500  # Длинный пункт обрезается, полный текст есть в документе
+
+# Слова, которые означают просьбу показать текст, а не истолковать его.
+# Если в вопросе кроме ссылки на пункт есть другие значимые слова, отвечает модель.
+LOOKUP_PREFIXES = (
+    "пункт", "подпункт", "правил", "приказ", "фнп", "норм", "документ", "текст", "содерж",
+    "сказ", "говор", "написа", "глас", "указ", "процитир", "цитат", "привед", "приве", "покаж",
+    "покажи", "прочит", "выдай", "дай", "номер", "минтруд", "ростехнадзор",
+)
+LOOKUP_WORDS = frozenset("""
+а в во из о об по от к ко на что какой какая какие каков как там это мне пожалуйста плз
+н n п
+""".split())
+
+
+def order_number(filename, text=""):
+    """Номер приказа документа в виде "782н" или "534"; None, если не найден"""
+    match = ORDER_RE.search(filename) or ORDER_RE.search(text[:HEADER_CHARS])
+    if not match:
+        return None
+    return match.group(1) + ("н" if match.group(2) else "")
+
+
+def _iter_lines(text):
+    """Строки текста со смещением начала, номером страницы и признаком первой строки страницы"""
+    offset = 0
+    page = 1
+    page_start = True
+    for line in text.splitlines(keepends=True):
+        yield line, offset, page, page_start
+        offset += len(line)
+        if line.endswith("\f"):
+            page += 1
+            page_start = True
+        elif line.strip():
+            page_start = False
+
+
+def parse_clauses(text):
+    """Нумерованные пункты документа, разбитые на части.
+
+    Часть - приказ, правила или приложение со своей нумерацией. Новая
+    часть начинается с пункта "1." (или "1.1." при нумерации по разделам)
+    после заголовка раздела или приложения.
+    Вложенные перечни ("1. ... 2. ..." внутри пункта 44) отбрасываются:
+    следующим пунктом части считается только номер чуть больше
+    предыдущего, который не продолжает вложенный перечень.
+    """
+    paged = "\f" in text
+    parts = []
+    clauses = None
+    section = None
+    heading_seen = True
+    last = 0
+    nested = None  # Последний номер вложенного перечня после текущего пункта
+    integers = set()  # Целые номера пунктов текущей части (у "12.3." есть пункт 12)
+    headings = []  # Смещения заголовков разделов и приложений
+
+    for line, offset, page, page_start in _iter_lines(text):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if SECTION_RE.match(line) and len(stripped) < 200:
+            section = stripped
+            headings.append(offset)
+            heading_seen = True
+            continue
+        match = CLAUSE_RE.match(line)
+        if not match and page_start and clauses is not None:
+            # Колонтитул склеен с первой строкой страницы: принимаем только следующий по порядку пункт
+            match = PAGE_CLAUSE_RE.match(line)
+            if match and not last < int(match.group(1)) <= last + MAX_CLAUSE_GAP:
+                match = None
+        if not match:
+            continue
+        number = match.group(1)
+        top = int(number.split(".")[0])
+        start = offset + match.start(1)
+        starts_part = number in ("1", "1.1") and (clauses is None or heading_seen)
+        if starts_part:
+            clauses = []
+            parts.append(clauses)
+            integers = set()
+        elif "." in number:
+            if clauses is None:
+                continue
+            # Подпункт "12.3." пункта 12, следующий пункт раздела "1.4." или первый
+            # пункт следующего раздела "2.1." при нумерации по разделам
+            next_section = number.endswith(".1") and number.count(".") == 1 and last < top <= last + MAX_CLAUSE_GAP
+            if top != last and not next_section:
+                continue
+        elif (clauses is None or not last < top <= last + MAX_CLAUSE_GAP
+              or (nested is not None and top == nested + 1)):
+            # Вложенный перечень: "1." сразу после пункта или его продолжение
+            if clauses is not None and (top == 1 or (nested is not None and top == nested + 1)):
+                nested = top
+            continue
+        if "." not in number:
+            integers.add(top)
+        clauses.append({"number": number, "section": section, "start": start,
+                        "page": page if paged else None, "top": top not in integers or "." not in number})
+        last = top
+        nested = None
+        heading_seen = False
+
+    # Пункт заканчивается там, где начинается следующий пункт того же или верхнего уровня
+    # либо заголовок раздела или приложения (последний пункт части не захватывает следующую часть)
+    result = []
+    for clauses in parts:
+        part = {}
+        for position, clause in enumerate(clauses):
+            heading = bisect.bisect_right(headings, clause["start"])
+            end = headings[heading] if heading < len(headings) else len(text)
+            for following in clauses[position + 1:]:
+                if following["top"] or not clause["top"]:
+                    end = min(end, following["start"])
+                    break
+            part[clause["number"]] = (clause["start"], end, clause["section"], clause["page"])
+        if part:
+            result.append(part)
+    return result
+
+
+class DocumentClauses:
+    """Указатель пунктов одного файла"""
+
+    def __init__(self, filename, text):
+        self.filename = filename
+        self.order = order_number(filename, text)
+        self.parts = parse_clauses(text)
+
+    def find(self, number):
+        """(начало, конец, раздел, страница) пункта; ищется сначала в самой большой части - правилах"""
+        for part in sorted(self.parts, key=len, reverse=True):
+            if number in part:
+                return part[number]
+        return None
+
+
+class ClauseIndex:
+    """Указатель пунктов всех файлов снимка по номерам приказов"""
+
+    def __init__(self, documents):
+        self.documents = {document.filename: document for document in documents}
+        self.by_order = {}  # Номер приказа без буквы "н" -> документы
+        for document in documents:
+            if document.order and document.parts:
+                self.by_order.setdefault(document.order.rstrip("н"), []).append(document)
+
+    def lookup(self, order, number):
+        """(документ, начало, конец, раздел, страница) или None"""
+        for document in self.by_order.get(order.rstrip("н"), ()):
+            found = document.find(number)
+            if found:
+                return (document,) + found
+        return None
+
+
+def build_clause_index(file_contents, previous=None, changed=()):
+    """Указатель пунктов для file_contents: файлы без изменений берутся из previous"""
+    old = previous.documents if previous is not None else {}
+    documents = []
+    for filename, text in file_contents.items():
+        if filename in old and filename not in changed:
+            documents.append(old[filename])
+        else:
+            documents.append(DocumentClauses(filename, text))
+    return ClauseIndex(documents)
+
+
+def parse_question(question, clause_index):
+    """(номер приказа, номер пункта, только_цитата) для вопроса со ссылкой на пункт приказа, иначе None"""
+    clause_match = CLAUSE_REF_RE.search(question)
+    if not clause_match:
+        return None
+    rest = question[:clause_match.start()] + " " + question[clause_match.end():]
+    order = None
+    for match in NUMBER_RE.finditer(rest):
+        if match.group() in clause_index.by_order:
+            order = match.group()
+            rest = rest[:match.start()] + " " + rest[match.end():]
+            break
+    if order is None:
+        return None
+    literal = all(word in LOOKUP_WORDS or word.isdigit() or word.startswith(LOOKUP_PREFIXES)
+                  for word in tokenize(rest))
+    return order, clause_match.group(1), literal
+
+
+def format_clause(document, number, text, section, page):
+    """Текст пункта с точной ссылкой на источник"""
+    if len(text) > MAX_ANSWER_CHARS:
+        text = text[:MAX_ANSWER_CHARS].rstrip() + "…\n(пункт приведен не полностью)"
+    source = [document.filename]
+    if page:
+        source.append(f"стр. {page}")
+    source.append(f"п. {number}")
+    header = f"Пункт {number} приказа N {document.order}"
+    if section:
+        header += f", раздел «{section}»"
+    return f"{header}:\n\n{text}\n\n[Источник: {', '.join(source)}]"
+
+
+def answer_clause_question(question, corpus):
+    """Ответ на вопрос "что сказано в пункте N приказа X" без модели; None, если нужна модель"""
+    clause_index = corpus.clause_index
+    if clause_index is None:
+        return None
+    parsed = parse_question(question, clause_index)
+    if parsed is None or not parsed[2]:
+        return None
+    order, number, _ = parsed
+    found = clause_index.lookup(order, number)
+    if found is None:
+        return None
+    document, start, end, section, page = found
+    text = corpus.file_contents[document.filename][start:end].replace("\f", "\n").strip()
+    return format_clause(document, number, text, section, page)
@@ -0,0 +1,117 @@
+"""Общий для всех чатов неизменяемый снимок базы знаний"""
+import hashlib
+import os
+import re
+import threading
+import zlib
+from types import MappingProxyType
+
+# Один и тот же документ часто лежит в нескольких форматах: индексируем
+# формат с самым точным текстом (PDF - последним, у него хуже извлечение)
+FORMAT_PRIORITY = (".rtf", ".docx", ".txt", ".pdf")
+DUPLICATE_SIMILARITY = 0.35  # Порог сходства отпечатков (переносы слов в PDF снижают сходство)
+SHINGLE_SIZE = 5
+SHINGLE_SAMPLE = 8  # Берем в отпечаток каждый ~8-й шингл (по значению хэша)
+
+
+def corpus_version(file_contents):
+    """Версия снимка - короткий хэш имен и содержимого файлов"""
+    digest = hashlib.sha256()
+    for filename in sorted(file_contents):
+        digest.update(filename.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(file_contents[filename].encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()[:12]
+
+
+def fingerprint(text):
+    """Отпечаток текста: выборка хэшей шинглов из слов, не зависящая от формата файла"""
+    words = re.findall(r'\w+', text.lower().replace("ё", "е"))
+    hashes = set()
+    for i in range(len(words) - SHINGLE_SIZE + 1):
+        shingle_hash = zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode("utf-8"))
+        if shingle_hash % SHINGLE_SAMPLE == 0:
+            hashes.add(shingle_hash)
+    return frozenset(hashes)
+
+
+def _format_rank(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return FORMAT_PRIORITY.index(extension) if extension in FORMAT_PRIORITY else len(FORMAT_PRIORITY)
+
+
+def collapse_duplicates(file_contents, fingerprints=None):
+    """Оставляет по одному файлу на документ, сохраненный в разных форматах.
+
+    Возвращает (уникальные файлы, {имя дубликата: имя оставленного файла}).
+    fingerprints - уже посчитанные отпечатки, чтобы не считать их заново.
+    """
+    if fingerprints is None:
+        fingerprints = {}
+    for filename, text in file_contents.items():
+        if filename not in fingerprints:
+            fingerprints[filename] = fingerprint(text)
+
+    kept = []
+    duplicates = {}
+    for filename in sorted(file_contents, key=lambda name: (_format_rank(name), name)):
+        prints = fingerprints[filename]
+        original = None
+        for kept_name in kept:
+            kept_prints = fingerprints[kept_name]
+            union = len(prints | kept_prints)
+            if union and len(prints & kept_prints) / union >= DUPLICATE_SIMILARITY:
+                original = kept_name
+                break
+        if original:
+            duplicates[filename] = original
+        else:
+            kept.append(filename)
+
+    unique = {filename: file_contents[filename] for filename in file_contents if filename not in duplicates}
+    return unique, duplicates
+
+
+class CorpusSnapshot:
+    """Тексты файлов и поисковый индекс одной версии базы знаний.
+
+    Снимок не изменяется после создания, поэтому чаты ссылаются на него
+    без копирования, а обновление базы - это замена ссылки на новый снимок.
+    """
+
+    def __init__(self, file_contents, index, duplicates=None, fingerprints=None, clause_index=None,
+                 version=None, total_chars=None):
+        # Тексты из файла снимка (corpus_map) уже неизменяемы и не копируются в память
+        if isinstance(file_contents, dict):
+            file_contents = MappingProxyType(dict(file_contents))
+        self.file_contents = file_contents
+        self.index = index
+        self.clause_index = clause_index  # Пункты по номерам приказов для ответов без модели
+        self.duplicates = MappingProxyType(dict(duplicates or {}))
+        # Отпечатки всех файлов (включая дубликаты) для инкрементального обновления
+        self.fingerprints = MappingProxyType(dict(fingerprints or {}))
+        self.version = version or corpus_version(self.file_contents)
+        self.total_chars = total_chars if total_chars is not None else sum(
+            len(text) for text in self.file_contents.values())
+
+    def __len__(self):
+        return len(self.file_contents)
+
+
+class CorpusHolder:
+    """Хранит текущий снимок и атомарно заменяет его"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot = None
+
+    def get(self):
+        with self.lock:
+            return self.snapshot
+
+    def publish(self, snapshot):
+        """Делает снимок текущим, возвращает предыдущий"""
+        with self.lock:
+            previous, self.snapshot = self.snapshot, snapshot
+        return previous
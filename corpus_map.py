@@ -0,0 +1,355 @@
+"""Снимок базы знаний в одном файле, который процессы-обработчики отображают в память (mmap).
+
+Ведущий процесс режима webhook записывает тексты файлов, фрагменты,
+BM25-индекс и указатель пунктов в плоские массивы. Обработчики открывают
+файл только для чтения: страницы файла общие для всех процессов, в памяти
+процесса остаются только заголовок и фрагменты, найденные для вопроса.
+"""
+import heapq
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import Mapping
+from functools import cached_property
+
+from corpus import CorpusSnapshot
+from retrieval import BM25_B, BM25_K1, SearchIndex, analyze, bm25_idf
+
+MAGIC = b"CMAP0001"
+ALIGN = 8
+CURRENT_FILE = "current"  # Имя файла с версией текущего снимка
+CLAUSE_KEY_SEPARATOR = "\x1f"
+CLAUSE_FIELDS = 5  # Запись пункта: файл, начало, конец, страница (0 - нет), раздел + 1 (0 - нет)
+
+
+def _strings(values):
+    """Строки в один блок UTF-8 и смещения (len + 1)"""
+    blob = bytearray()
+    offsets = array("Q", [0])
+    for value in values:
+        blob += value if isinstance(value, bytes) else value.encode("utf-8")
+        offsets.append(len(blob))
+    return bytes(blob), offsets
+
+
+def _clause_table(corpus, file_ids):
+    """Ключи "приказ<разделитель>пункт" и записи пунктов, найденные так же, как ClauseIndex.lookup"""
+    clause_index = corpus.clause_index
+    if clause_index is None:
+        return [], array("Q"), [], {}
+    sections = {}
+    table = {}
+    for order, documents in clause_index.by_order.items():
+        numbers = {number for document in documents for part in document.parts for number in part}
+        for number in numbers:
+            document, start, end, section, page = clause_index.lookup(order, number)
+            section_id = sections.setdefault(section, len(sections)) + 1 if section else 0
+            table[f"{order}{CLAUSE_KEY_SEPARATOR}{number}".encode("utf-8")] = (
+                file_ids[document.filename], start, end, page or 0, section_id)
+    keys = sorted(table)
+    records = array("Q")
+    for key in keys:
+        records.extend(table[key])
+    orders = {document.filename: document.order for document in clause_index.documents.values() if document.order}
+    return keys, records, sorted(sections, key=sections.get), orders
+
+
+def write_snapshot(directory, corpus):
+    """Записывает снимок в directory/<версия>.map и делает его текущим; возвращает путь"""
+    os.makedirs(directory, exist_ok=True)
+    filenames = list(corpus.file_contents)
+    file_ids = {filename: position for position, filename in enumerate(filenames)}
+
+    chunks = [chunk for segment in corpus.index.segments for chunk in segment.chunks]
+    doc_lengths = array("I", [length for segment in corpus.index.segments for length in segment.doc_lengths])
+    postings = {}
+    base = 0
+    for segment in corpus.index.segments:
+        for term, term_postings in segment.postings.items():
+            postings.setdefault(term.encode("utf-8"), []).extend(
+                (base + local_id, tf) for local_id, tf in sorted(term_postings.items()))
+        base += len(segment.chunks)
+    terms = sorted(postings)
+    posting_offsets = array("Q", [0])
+    posting_chunks = array("I")
+    posting_tf = array("I")
+    for term in terms:
+        for chunk_number, tf in postings[term]:
+            posting_chunks.append(chunk_number)
+            posting_tf.append(tf)
+        posting_offsets.append(len(posting_chunks))
+
+    clause_keys, clause_records, sections, orders = _clause_table(corpus, file_ids)
+
+    texts, text_offsets = _strings(corpus.file_contents[filename] for filename in filenames)
+    chunk_texts, chunk_text_offsets = _strings(chunk["text"] for chunk in chunks)
+    chunk_meta, chunk_meta_offsets = _strings(
+        json.dumps([file_ids.get(chunk["file"], -1), chunk.get("page"), chunk.get("section"), chunk.get("clause")],
+                   ensure_ascii=False, separators=(",", ":")) for chunk in chunks)
+    term_blob, term_offsets = _strings(terms)
+    clause_key_blob, clause_key_offsets = _strings(clause_keys)
+    section_blob, section_offsets = _strings(sections)
+    sections_data = {
+        "texts": texts, "text_offsets": text_offsets,
+        "chunk_texts": chunk_texts, "chunk_text_offsets": chunk_text_offsets,
+        "chunk_meta": chunk_meta, "chunk_meta_offsets": chunk_meta_offsets,
+        "chunk_ids": "".join(chunk["id"] for chunk in chunks).encode("ascii"),
+        "doc_lengths": doc_lengths,
+        "terms": term_blob, "term_offsets": term_offsets,
+        "posting_offsets": posting_offsets, "posting_chunks": posting_chunks, "posting_tf": posting_tf,
+        "clause_keys": clause_key_blob, "clause_key_offsets": clause_key_offsets, "clause_records": clause_records,
+        "sections": section_blob, "section_offsets": section_offsets,
+    }
+
+    index = corpus.index
+    header = {
+        "version": corpus.version,
+        "filenames": filenames,
+        "orders": orders,
+        "duplicates": dict(corpus.duplicates),
+        "total_chars": corpus.total_chars,
+        "chunk_count": index.chunk_count,
+        "avg_length": index.avg_length,
+        "id_length": len(chunks[0]["id"]) if chunks else 16,
+        "arrays": {},
+    }
+    position = 0
+    for name, data in sections_data.items():
+        size = len(data) * data.itemsize if isinstance(data, array) else len(data)
+        header["arrays"][name] = [position, size, data.typecode if isinstance(data, array) else "B"]
+        position += -(-size // ALIGN) * ALIGN
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGN) * ALIGN
+
+    path = os.path.join(directory, f"{corpus.version}.map")
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header_bytes)) + header_bytes)
+        f.write(b"\0" * (data_start - f.tell()))
+        for name, data in sections_data.items():
+            offset = header["arrays"][name][0]
+            f.write(b"\0" * (data_start + offset - f.tell()))
+            f.write(data.tobytes() if isinstance(data, array) else data)
+    os.replace(temp_path, path)
+
+    previous = _read_current(directory)
+    current_path = os.path.join(directory, CURRENT_FILE)
+    with open(f"{current_path}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+        f.write(corpus.version)
+    os.replace(f"{current_path}.{os.getpid()}.tmp", current_path)
+
+    # Предыдущий снимок остается до следующей замены: обработчик мог прочитать
+    # старый current и еще не открыть файл. Открытые файлы в Windows удалить нельзя - удалим позже
+    keep = {os.path.basename(path), f"{previous}.map"}
+    for name in os.listdir(directory):
+        if name.endswith(".map") and name not in keep:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    return path
+
+
+class _StringTable:
+    """Строки из блока UTF-8 по смещениям; find() - двоичный поиск в отсортированной таблице"""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def raw(self, position):
+        return bytes(self.blob[self.offsets[position]:self.offsets[position + 1]])
+
+    def __getitem__(self, position):
+        return str(self.blob[self.offsets[position]:self.offsets[position + 1]], "utf-8")
+
+    def find(self, key):
+        """Номер строки key (bytes) или -1"""
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.raw(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self) and self.raw(low) == key:
+            return low
+        return -1
+
+
+class MappedTexts(Mapping):
+    """{имя файла: текст}; текст декодируется из общего файла при обращении"""
+
+    def __init__(self, filenames, texts):
+        self.positions = {filename: position for position, filename in enumerate(filenames)}
+        self.texts = texts
+
+    def __getitem__(self, filename):
+        return self.texts[self.positions[filename]]
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class MappedChunk(Mapping):
+    """Фрагмент снимка: поля читаются из общего файла при обращении"""
+
+    FIELDS = ("file", "page", "section", "clause", "text", "id")
+
+    def __init__(self, index, number):
+        self.index = index
+        self.number = number
+
+    def __getitem__(self, key):
+        index = self.index
+        if key == "text":
+            return index.chunk_texts[self.number]
+        if key == "id":
+            size = index.id_length
+            return str(index.chunk_ids[self.number * size:(self.number + 1) * size], "ascii")
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        file_id, page, section, clause = json.loads(index.chunk_meta.raw(self.number))
+        if key == "file":
+            return index.filenames[file_id] if file_id >= 0 else None
+        return {"page": page, "section": section, "clause": clause}[key]
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+
+class MappedSearchIndex:
+    """BM25-поиск по отображенному в память индексу; оценки совпадают с SearchIndex"""
+
+    def __init__(self, header, arrays):
+        self.filenames = header["filenames"]
+        self.chunk_count = header["chunk_count"]
+        self.avg_length = header["avg_length"]
+        self.id_length = header["id_length"]
+        self.chunk_texts = _StringTable(arrays["chunk_texts"], arrays["chunk_text_offsets"])
+        self.chunk_meta = _StringTable(arrays["chunk_meta"], arrays["chunk_meta_offsets"])
+        self.chunk_ids = arrays["chunk_ids"]
+        self.doc_lengths = arrays["doc_lengths"]
+        self.terms = _StringTable(arrays["terms"], arrays["term_offsets"])
+        self.posting_offsets = arrays["posting_offsets"]
+        self.posting_chunks = arrays["posting_chunks"]
+        self.posting_tf = arrays["posting_tf"]
+
+    @cached_property
+    def chunks(self):
+        return [MappedChunk(self, number) for number in range(self.chunk_count)]
+
+    def _postings(self, term):
+        position = self.terms.find(term.encode("utf-8"))
+        if position < 0:
+            return 0, 0
+        return self.posting_offsets[position], self.posting_offsets[position + 1]
+
+    def idf(self, term):
+        start, end = self._postings(term)
+        return bm25_idf(self.chunk_count, end - start)
+
+    coverage = SearchIndex.coverage
+
+    def search(self, query, k=5):
+        """Возвращает до k пар (оценка BM25, фрагмент) по убыванию оценки"""
+        if not self.chunk_count:
+            return []
+        scores = {}
+        for term in set(analyze(query)):
+            start, end = self._postings(term)
+            if start == end:
+                continue
+            idf = bm25_idf(self.chunk_count, end - start)
+            for position in range(start, end):
+                number = self.posting_chunks[position]
+                tf = self.posting_tf[position]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[number] / self.avg_length)
+                scores[number] = scores.get(number, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, MappedChunk(self, number)) for number, score in top]
+
+
+class MappedDocument:
+    """Документ указателя пунктов: только имя файла и номер приказа"""
+
+    def __init__(self, filename, order):
+        self.filename = filename
+        self.order = order
+
+
+class MappedClauseIndex:
+    """Указатель пунктов из общего файла с тем же lookup(), что у ClauseIndex"""
+
+    def __init__(self, header, arrays):
+        self.filenames = header["filenames"]
+        self.orders = header["orders"]
+        self.keys = _StringTable(arrays["clause_keys"], arrays["clause_key_offsets"])
+        self.records = arrays["clause_records"]
+        self.sections = _StringTable(arrays["sections"], arrays["section_offsets"])
+        self.by_order = frozenset(order.rstrip("н") for order in self.orders.values())
+
+    def lookup(self, order, number):
+        position = self.keys.find(f"{order.rstrip('н')}{CLAUSE_KEY_SEPARATOR}{number}".encode("utf-8"))
+        if position < 0:
+            return None
+        file_id, start, end, page, section_id = self.records[position * CLAUSE_FIELDS:(position + 1) * CLAUSE_FIELDS]
+        filename = self.filenames[file_id]
+        section = self.sections[section_id - 1] if section_id else None
+        return MappedDocument(filename, self.orders.get(filename)), start, end, section, page or None
+
+
+def _read_current(directory):
+    """Версия текущего снимка или None"""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def open_snapshot(directory, attempts=3):
+    """Текущий снимок из directory как CorpusSnapshot или None, если его еще нет.
+
+    Если файл снимка удален между чтением current и открытием (ведущий
+    процесс записал две версии подряд), current читается заново.
+    """
+    for _ in range(attempts):
+        version = _read_current(directory)
+        if version is None:
+            return None
+        try:
+            f = open(os.path.join(directory, f"{version}.map"), "rb")
+            break
+        except FileNotFoundError:
+            continue
+    else:
+        return None
+    with f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{directory}/{version}.map: неизвестный формат")
+    header_length = struct.unpack_from("<Q", mapped, len(MAGIC))[0]
+    header_end = len(MAGIC) + 8 + header_length
+    header = json.loads(str(mapped[len(MAGIC) + 8:header_end], "utf-8"))
+    data_start = -(-header_end // ALIGN) * ALIGN
+    view = memoryview(mapped)
+    arrays = {}
+    for name, (offset, size, typecode) in header["arrays"].items():
+        data = view[data_start + offset:data_start + offset + size]
+        arrays[name] = data.cast(typecode) if typecode != "B" else data
+    texts = _StringTable(arrays["texts"], arrays["text_offsets"])
+    return CorpusSnapshot(MappedTexts(header["filenames"], texts), MappedSearchIndex(header, arrays),
+                          header["duplicates"], clause_index=MappedClauseIndex(header, arrays),
+                          version=header["version"], total_chars=header["total_chars"])
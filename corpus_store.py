@@ -0,0 +1,194 @@
+"""Дисковое хранилище извлеченного текста файлов из папки data"""
+import hashlib
+import json
+import os
+import threading
+
+
+def file_sha256(file_path):
+    """Считает SHA-256 содержимого файла блоками"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CorpusStore:
+    """Кэш текста файлов с ключом (путь, размер, mtime, хэш содержимого).
+
+    Текст каждого файла хранится отдельно под именем своего хэша, индекс
+    лежит в index.json. Файл парсится заново только если он появился,
+    изменился или сменилась версия парсеров.
+
+    С read_only=True кэш только читается (процессы-обработчики режима
+    webhook): записи, сохраненные другим процессом, подхватываются из
+    index.json при промахе.
+    """
+
+    def __init__(self, cache_dir, parser_version=1, read_only=False):
+        self.cache_dir = cache_dir
+        self.parser_version = parser_version
+        self.read_only = read_only
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.index_mtime = None
+        self.disk_entries = {}  # Последнее прочитанное содержимое index.json
+        os.makedirs(cache_dir, exist_ok=True)
+        self.entries = self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            self.index_mtime = os.stat(self.index_path).st_mtime_ns
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Ошибка чтения индекса кэша {self.index_path}: {e}")
+            return {}
+
+    def _text_path(self, sha256):
+        return os.path.join(self.cache_dir, f"{sha256}.txt")
+
+    def _read_text(self, sha256):
+        try:
+            with open(self._text_path(sha256), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_text(self, sha256, text):
+        path = self._text_path(sha256)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def _match(self, file_path, stat, entry, sha256=None):
+        """Текст из записи кэша, если она соответствует файлу: (текст или None, sha256 или None)"""
+        if not entry or entry.get("parser_version") != self.parser_version:
+            return None, sha256
+
+        # Быстрая проверка без чтения файла: размер и время изменения
+        if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            text = self._read_text(entry["sha256"])
+            if text is not None:
+                return text, entry["sha256"]
+
+        if sha256 is None:
+            sha256 = file_sha256(file_path)
+        if entry["sha256"] == sha256:
+            # Файл "потрогали", но содержимое не изменилось
+            text = self._read_text(sha256)
+            if text is not None:
+                with self.lock:
+                    entry["size"] = stat.st_size
+                    entry["mtime"] = stat.st_mtime_ns
+                return text, sha256
+        return None, sha256
+
+    def _disk_entry(self, key):
+        """Запись из index.json, если его с момента чтения сохранил другой процесс"""
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            return None
+        if mtime != self.index_mtime:
+            self.disk_entries = self._load_index()
+        return self.disk_entries.get(key)
+
+    def lookup(self, file_path):
+        """Ищет текст файла в кэше.
+
+        Возвращает (текст или None, sha256); хэш файла считается только
+        если размер или время изменения файла не совпали с записью в кэше.
+        """
+        key = os.path.normpath(file_path)
+        stat = os.stat(file_path)
+
+        with self.lock:
+            entry = self.entries.get(key)
+        text, sha256 = self._match(file_path, stat, entry)
+
+        if text is None:
+            disk_entry = self._disk_entry(key)
+            if disk_entry and disk_entry != entry:
+                text, sha256 = self._match(file_path, stat, disk_entry, sha256)
+                if text is not None:
+                    with self.lock:
+                        self.entries[key] = disk_entry
+
+        if sha256 is None:
+            sha256 = file_sha256(file_path)
+        with self.lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return text, sha256
+
+    def put(self, file_path, sha256, text):
+        """Сохраняет извлеченный текст файла (пустой текст не кэшируется)"""
+        if not text or self.read_only:
+            return
+        stat = os.stat(file_path)
+        self._write_text(sha256, text)
+        with self.lock:
+            self.entries[os.path.normpath(file_path)] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "sha256": sha256,
+                "parser_version": self.parser_version,
+            }
+
+    def get_text(self, file_path, reader):
+        """Возвращает текст файла из кэша или извлекает его через reader"""
+        text, sha256 = self.lookup(file_path)
+        if text is None:
+            text = reader(file_path)
+            self.put(file_path, sha256, text)
+        return text
+
+    def prune(self, existing_paths):
+        """Удаляет из кэша записи о файлах, которых больше нет в data"""
+        if self.read_only:
+            return
+        keep = {os.path.normpath(path) for path in existing_paths}
+        with self.lock:
+            for key in list(self.entries):
+                if key not in keep:
+                    del self.entries[key]
+            used = {entry["sha256"] for entry in self.entries.values()}
+
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".txt") and name[:-4] not in used:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+    def save(self):
+        """Атомарно сохраняет индекс кэша на диск"""
+        if self.read_only:
+            return
+        with self.lock:
+            payload = json.dumps(self.entries, ensure_ascii=False, indent=2)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp_path, self.index_path)
+        self.index_mtime = os.stat(self.index_path).st_mtime_ns
+
+    def stats(self):
+        """Статистика попаданий и промахов кэша"""
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "files": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
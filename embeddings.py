@@ -0,0 +1,223 @@
+"""Векторный индекс фрагментов документов: эмбеддинги ollama в матрице float32 на диске"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class EmbeddingIndex:
+    """Матрица эмбеддингов фрагментов в файле vectors.f32 и таблица строк в meta.json.
+
+    Строка матрицы привязана к id фрагмента (хэш файла и текста), поэтому
+    при переиндексации считаются только новые фрагменты. Векторы дописываются
+    пачками, после каждой пачки сохраняется meta.json: прерванное построение
+    продолжается с места остановки. Векторы нормированы, оценка - косинус.
+
+    С read_only=True индекс только читается (процессы-обработчики режима
+    webhook): матрица открывается через mmap и общая для всех процессов,
+    новые строки от ведущего процесса подхватываются при поиске.
+    """
+
+    def __init__(self, directory, model, embed, batch_size=32, workers=2, read_only=False, embed_query=None):
+        self.directory = directory
+        self.model = model
+        self.embed = embed  # embed(text) -> список чисел
+        self.embed_query = embed_query or embed  # Эмбеддинг вопроса при поиске, с коротким таймаутом
+        self.batch_size = batch_size
+        self.read_only = read_only
+        self.meta_mtime = None
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed")
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.update_lock = threading.Lock()  # Построение индекса идет в одном потоке
+        self.lock = threading.Lock()
+        self.dim = None
+        self.ids = []
+        self.row_of = {}
+        self.state = (None, {}, 0)  # (матрица, строки фрагментов, поколение) для поиска
+        self.rows_cache = None  # (ключ снимка, поколение, строки, фрагменты)
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        try:
+            self.meta_mtime = os.stat(self.meta_path).st_mtime_ns
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except Exception as e:
+            print(f"Ошибка чтения индекса эмбеддингов {self.meta_path}: {e}")
+            return
+        if self.read_only:
+            self._load_shared(meta)
+            return
+        if meta.get("model") != self.model or not meta.get("dim"):
+            # Другая модель - векторы несовместимы, строим заново
+            self._reset_files()
+            return
+
+        self.dim = meta["dim"]
+        self.ids = meta["ids"]
+        # Векторы, записанные после последнего сохранения meta.json, отбрасываем
+        expected = len(self.ids) * self.dim * 4
+        if not os.path.exists(self.vectors_path) or os.path.getsize(self.vectors_path) < expected:
+            print("Файл эмбеддингов поврежден, индекс будет построен заново")
+            self.dim = None
+            self.ids = []
+            self._reset_files()
+            return
+        with open(self.vectors_path, 'r+b') as f:
+            f.truncate(expected)
+        self.row_of = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self._remap()
+
+    def _load_shared(self, meta):
+        """Открывает матрицу, которую пишет другой процесс, не изменяя файлов"""
+        if meta.get("model") != self.model or not meta.get("dim"):
+            return
+        expected = len(meta["ids"]) * meta["dim"] * 4
+        try:
+            size = os.path.getsize(self.vectors_path)
+        except OSError:
+            return
+        if size < expected:
+            # Матрица переписывается (сжатие) - подождем следующего meta.json
+            return
+        self.dim = meta["dim"]
+        self.ids = meta["ids"]
+        self.row_of = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self._remap()
+
+    def refresh(self):
+        """Подхватывает строки, добавленные ведущим процессом (только для read_only)"""
+        try:
+            mtime = os.stat(self.meta_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self.meta_mtime:
+            with self.update_lock:
+                if mtime != self.meta_mtime:
+                    self._load()
+
+    def _reset_files(self):
+        for path in (self.vectors_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _remap(self):
+        """Открывает матрицу заново после изменения и публикует ее для поиска"""
+        matrix = None
+        if self.ids:
+            matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(len(self.ids), self.dim))
+        with self.lock:
+            self.state = (matrix, dict(self.row_of), self.state[2] + 1)
+
+    def _save_meta(self):
+        payload = json.dumps({"model": self.model, "dim": self.dim, "ids": self.ids})
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp_path, self.meta_path)
+
+    def _embed_batch(self, texts):
+        vectors = np.asarray(list(self.executor.map(self.embed, texts)), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def update(self, chunks):
+        """Считает эмбеддинги фрагментов, которых еще нет в индексе; возвращает их число"""
+        if self.read_only:
+            return 0
+        with self.update_lock:
+            pending = {}
+            for chunk in chunks:
+                if chunk["id"] not in self.row_of:
+                    pending.setdefault(chunk["id"], chunk["text"])
+            if not pending:
+                return 0
+
+            done = 0
+            items = list(pending.items())
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                try:
+                    vectors = self._embed_batch([text for _, text in batch])
+                except Exception as e:
+                    print(f"Ошибка построения эмбеддингов ({done} из {len(items)} готово): {e}")
+                    break
+                if self.dim is None:
+                    self.dim = vectors.shape[1]
+                with open(self.vectors_path, 'ab') as f:
+                    f.write(vectors.tobytes())
+                for chunk_id, _ in batch:
+                    self.row_of[chunk_id] = len(self.ids)
+                    self.ids.append(chunk_id)
+                self._save_meta()
+                self._remap()
+                done += len(batch)
+            print(f"🧭 Эмбеддинги: добавлено {done}, всего {len(self.ids)}")
+            return done
+
+    def compact(self, live_ids):
+        """Переписывает матрицу без строк удаленных фрагментов, если их больше половины"""
+        if self.read_only:
+            return
+        with self.update_lock:
+            live = [chunk_id for chunk_id in self.ids if chunk_id in live_ids]
+            if len(live) * 2 >= len(self.ids):
+                return
+            with self.lock:
+                matrix = self.state[0]
+            rows = np.array([self.row_of[chunk_id] for chunk_id in live], dtype=np.int64)
+            tmp_path = self.vectors_path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                if len(rows):
+                    f.write(np.ascontiguousarray(matrix[rows]).tobytes())
+            os.replace(tmp_path, self.vectors_path)
+            self.ids = live
+            self.row_of = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+            self._save_meta()
+            self._remap()
+
+    def _rows(self, chunks, key, row_of, generation):
+        """Строки матрицы для фрагментов снимка (кэшируется по ключу снимка)"""
+        with self.lock:
+            cached = self.rows_cache
+        if cached and cached[0] == key and cached[1] == generation:
+            return cached[2], cached[3]
+        present = [chunk for chunk in chunks if chunk["id"] in row_of]
+        rows = np.fromiter((row_of[chunk["id"]] for chunk in present), dtype=np.int64, count=len(present))
+        with self.lock:
+            self.rows_cache = (key, generation, rows, present)
+        return rows, present
+
+    def search(self, query, chunks, k=5, key=None):
+        """Top-k фрагментов по косинусной близости: список пар (близость, фрагмент).
+
+        chunks - фрагменты текущего снимка базы, key - его версия для кэша строк.
+        """
+        if self.read_only:
+            self.refresh()
+        with self.lock:
+            matrix, row_of, generation = self.state
+        if matrix is None:
+            return []
+        rows, present = self._rows(chunks, key, row_of, generation)
+        if not len(rows):
+            return []
+
+        query_vector = np.asarray(self.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm == 0:
+            return []
+        scores = (matrix @ (query_vector / norm))[rows]
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), present[i]) for i in top]
+
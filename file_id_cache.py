@@ -0,0 +1,94 @@
+"""Кэш file_id документов, уже загруженных в Telegram"""
+import json
+import os
+import threading
+
+from corpus_store import file_sha256
+
+
+class FileIdCache:
+    """Запоминает file_id отправленного файла по имени и хэшу содержимого.
+
+    Повторная отправка того же файла идет по file_id без загрузки байтов.
+    Если файл на диске изменился, хэш не совпадет и файл загрузится заново.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()  # Сохранения из разных потоков не пересекаются
+        self.hits = 0
+        self.misses = 0
+        self.entries = self._load()  # filename -> {"sha256", "size", "mtime", "file_id"}
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Ошибка чтения кэша file_id {self.path}: {e}")
+            return {}
+
+    def get(self, filename, file_path):
+        """Возвращает (file_id или None, sha256 файла или None)"""
+        stat = os.stat(file_path)
+        with self.lock:
+            entry = self.entries.get(filename)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            with self.lock:
+                self.hits += 1
+            return entry["file_id"], entry["sha256"]
+
+        sha256 = file_sha256(file_path)
+        if entry and entry["sha256"] == sha256:
+            with self.lock:
+                entry["size"] = stat.st_size
+                entry["mtime"] = stat.st_mtime_ns
+                self.hits += 1
+            return entry["file_id"], sha256
+        with self.lock:
+            self.misses += 1
+        return None, sha256
+
+    def put(self, filename, file_path, sha256, file_id):
+        """Запоминает file_id, полученный после загрузки файла"""
+        stat = os.stat(file_path)
+        with self.lock:
+            self.entries[filename] = {
+                "sha256": sha256,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "file_id": file_id,
+            }
+        self.save()
+
+    def drop(self, filename):
+        """Забывает file_id файла (файл заменен или удален)"""
+        with self.lock:
+            if self.entries.pop(filename, None) is None:
+                return
+        self.save()
+
+    def stats(self):
+        """Статистика попаданий и промахов кэша"""
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "files": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    def save(self):
+        """Атомарно сохраняет кэш на диск"""
+        with self.save_lock:
+            with self.lock:
+                payload = json.dumps(self.entries, ensure_ascii=False, indent=2)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp_path, self.path)
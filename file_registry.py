@@ -0,0 +1,155 @@
+"""Реестр файлов папки data: короткие id для кнопок и готовые постраничные клавиатуры"""
+import hashlib
+import html
+import os
+import threading
+
+from telebot import types as t
+
+PAGE_SIZE = 10  # Файлов на одной странице списка
+
+# Режим списка -> (значок кнопки, префикс callback_data файла, callback_data кнопки "Назад")
+MODES = {
+    "user": ("📥", "get", "user_back"),
+    "delete": ("🗑️", "del", "admin_panel"),
+    "list": (None, None, "admin_panel"),  # Только просмотр, файлы перечислены в тексте сообщения
+}
+
+
+def short_id(name, length=8):
+    """Устойчивый короткий id файла: одинаковый после перезапуска и во всех процессах"""
+    return hashlib.blake2s(name.encode("utf-8"), digest_size=8).hexdigest()[:length]
+
+
+def format_size(size):
+    for unit in ("байт", "КБ", "МБ"):
+        if size < 1024 or unit == "МБ":
+            return f"{size:.0f} {unit}" if unit == "байт" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class FileRegistry:
+    """Список файлов папки с метаданными, который читается с диска только после invalidate().
+
+    callback_data кнопок содержит короткий id файла вместо имени (лимит
+    Telegram - 64 байта), клавиатуры и тексты страниц строятся один раз.
+    """
+
+    def __init__(self, folder, page_size=PAGE_SIZE):
+        self.folder = folder
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.files = None  # [{"id", "name", "size"}] по имени; None - нужно перечитать папку
+        self.by_id = {}
+        self.by_name = {}
+        self.cache = {}  # (вид, режим, страница) -> клавиатура или текст
+        self.generation = 0  # Растет при invalidate(): устаревшая сборка не попадает в кэш
+
+    def invalidate(self):
+        """Сбрасывает список после загрузки, удаления или перезагрузки файлов"""
+        with self.lock:
+            self.files = None
+            self.cache = {}
+            self.generation += 1
+
+    def _scan(self):
+        files = []
+        try:
+            entries = list(os.scandir(self.folder))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            # Скрытые файлы - недописанные загрузки
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            files.append({"name": entry.name, "size": entry.stat().st_size})
+        files.sort(key=lambda item: item["name"])
+        by_id = {}
+        for item in files:
+            file_id = short_id(item["name"])
+            length = 8
+            while file_id in by_id:
+                # Совпадение коротких id - удлиняем id второго файла
+                length += 4
+                file_id = short_id(item["name"], length)
+            item["id"] = file_id
+            by_id[file_id] = item
+        self.files = files
+        self.by_id = by_id
+        self.by_name = {item["name"]: item for item in files}
+
+    def _files(self):
+        with self.lock:
+            if self.files is None:
+                self._scan()
+            return self.files, self.by_id, self.by_name
+
+    def list(self):
+        return list(self._files()[0])
+
+    def get(self, file_id):
+        """Имя файла по id кнопки; None, если файла уже нет"""
+        item = self._files()[1].get(file_id)
+        return item["name"] if item else None
+
+    def __contains__(self, name):
+        return name in self._files()[2]
+
+    def _page(self, page):
+        files = self._files()[0]
+        pages = max(1, -(-len(files) // self.page_size))
+        page = min(max(page, 0), pages - 1)
+        return files[page * self.page_size:(page + 1) * self.page_size], page, pages
+
+    def _cached(self, key, build):
+        with self.lock:
+            value = self.cache.get(key)
+            generation = self.generation
+        if value is None:
+            value = build()
+            with self.lock:
+                if generation == self.generation:
+                    self.cache[key] = value
+        return value
+
+    def markup(self, mode, page=0):
+        """Клавиатура страницы списка файлов для режима из MODES"""
+        return self._cached(("markup", mode, page), lambda: self._build_markup(mode, page))
+
+    def _build_markup(self, mode, page):
+        icon, action, back = MODES[mode]
+        files, page, pages = self._page(page)
+        markup = t.InlineKeyboardMarkup()
+        if action:
+            for item in files:
+                markup.add(t.InlineKeyboardButton(text=f"{icon} {item['name']}",
+                                                  callback_data=f"{action}:{item['id']}"))
+        if pages > 1:
+            navigation = []
+            if page > 0:
+                navigation.append(t.InlineKeyboardButton(text="◀️", callback_data=f"files:{mode}:{page - 1}"))
+            navigation.append(t.InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data="noop"))
+            if page < pages - 1:
+                navigation.append(t.InlineKeyboardButton(text="▶️", callback_data=f"files:{mode}:{page + 1}"))
+            markup.row(*navigation)
+        markup.add(t.InlineKeyboardButton(text="🔙 Назад", callback_data=back))
+        return markup
+
+    def listing(self, title, page=0, total_size=False):
+        """HTML-текст страницы списка: заголовок с числом файлов, файлы страницы с размерами"""
+        return self._cached(("listing", title, page, total_size),
+                            lambda: self._build_listing(title, page, total_size))
+
+    def _build_listing(self, title, page, total_size):
+        all_files = self._files()[0]
+        if not all_files:
+            return "📁 Папка data пуста"
+        files, page, pages = self._page(page)
+        text = f"<b>{title} ({len(all_files)}):</b>\n\n"
+        for number, item in enumerate(files, page * self.page_size + 1):
+            text += f"{number}. {html.escape(item['name'])} ({format_size(item['size'])})\n"
+        if total_size:
+            text += f"\n💾 Общий размер: {format_size(sum(item['size'] for item in all_files))}"
+        if pages > 1:
+            text += f"\n📄 Страница {page + 1} из {pages}"
+        return text
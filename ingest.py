@@ -0,0 +1,196 @@
+"""Извлечение текста из файлов папки data, в том числе параллельно в пуле процессов"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from rtf_reader import read_rtf
+
+PAGES_PER_TASK = 25  # Размер диапазона страниц PDF для одной задачи пула
+PAGE_SEPARATOR = "\f"  # Разделитель страниц в извлеченном тексте PDF
+
+
+# Функции для чтения файлов
+def read_txt_file(file_path):
+    """Чтение текстовых файлов"""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return file.read()
+    except Exception as e:
+        print(f"Ошибка чтения TXT файла {file_path}: {e}")
+        return ""
+
+
+def iter_pdf_pages(file_path, start=0, stop=None):
+    """Генератор пар (номер страницы, текст) для страниц PDF из диапазона [start, stop).
+
+    Ошибка на отдельной странице не прерывает чтение остальных.
+    """
+    from pypdf import PdfReader  # Импорт при первом PDF, чтобы не замедлять запуск бота
+
+    return _iter_pages(file_path, PdfReader(file_path).pages, start, stop)
+
+
+def _iter_pages(file_path, pages, start, stop):
+    stop = len(pages) if stop is None else min(stop, len(pages))
+    for page_index in range(start, stop):
+        try:
+            text = pages[page_index].extract_text() or ""
+        except Exception as e:
+            print(f"Ошибка чтения страницы {page_index + 1} PDF файла {file_path}: {e}")
+            text = ""
+        yield page_index + 1, text + "\n"
+
+
+def read_pdf_file(file_path):
+    """Чтение PDF файлов"""
+    try:
+        # Страницы разделяются символом \f, чтобы сохранить номера страниц для источников
+        return PAGE_SEPARATOR.join(text for _, text in iter_pdf_pages(file_path))
+    except Exception as e:
+        print(f"Ошибка чтения PDF файла {file_path}: {e}")
+        return ""
+
+
+def read_docx_file(file_path):
+    """Чтение DOCX файлов"""
+    try:
+        import docx  # Импорт при первом DOCX
+
+        doc = docx.Document(file_path)
+        return "\n".join(paragraph.text for paragraph in doc.paragraphs) + "\n"
+    except Exception as e:
+        print(f"Ошибка чтения DOCX файла {file_path}: {e}")
+        return ""
+
+
+def read_rtf_file(file_path):
+    """Чтение RTF файлов (разметка RTF убирается, остается только текст)"""
+    try:
+        return read_rtf(file_path)
+    except Exception as e:
+        print(f"Ошибка чтения RTF файла {file_path}: {e}")
+        return ""
+
+
+def read_any_file(file_path):
+    """Чтение файла поддерживаемого формата"""
+    if file_path.endswith('.txt'):
+        return read_txt_file(file_path)
+    elif file_path.endswith('.pdf'):
+        return read_pdf_file(file_path)
+    elif file_path.endswith('.docx'):
+        return read_docx_file(file_path)
+    elif file_path.endswith('.rtf'):
+        return read_rtf_file(file_path)
+    return ""
+
+
+def _extract_task(file_path, start, stop):
+    """Задача пула: страницы [start, stop) PDF или файл целиком (start = None).
+
+    Возвращает и число страниц PDF: по нему первая задача файла
+    планирует остальные диапазоны страниц.
+    """
+    started = time.perf_counter()
+    page_count = None
+    try:
+        if start is None:
+            records = [(1, read_any_file(file_path))]
+        else:
+            from pypdf import PdfReader
+
+            pages = PdfReader(file_path).pages
+            page_count = len(pages)
+            records = list(_iter_pages(file_path, pages, start, stop))
+        error = None
+    except Exception as e:
+        records, error = [], str(e)
+    return file_path, start, records, time.perf_counter() - started, error, page_count
+
+
+def _first_task(file_path):
+    """Первая задача файла: PDF - первый диапазон страниц (страницы считает процесс пула)"""
+    if file_path.endswith('.pdf'):
+        return file_path, 0, PAGES_PER_TASK
+    return file_path, None, None
+
+
+def _more_tasks(file_path, page_count):
+    """Остальные диапазоны страниц PDF после первой задачи"""
+    return [(file_path, start, start + PAGES_PER_TASK) for start in range(PAGES_PER_TASK, page_count, PAGES_PER_TASK)]
+
+
+def extract_files(file_paths, workers=None):
+    """Извлекает текст файлов, распределяя файлы и диапазоны страниц по процессам.
+
+    Генератор: по мере готовности каждого файла выдает словарь
+    {"path", "text", "pages", "seconds", "error"}. Битый файл дает
+    пустой текст и описание ошибки, не прерывая обработку остальных.
+    Процессы пула запускаются через spawn: у бота уже работают потоки
+    (polling, планировщик, эмбеддинги), и fork мог бы унаследовать
+    захваченную ими блокировку.
+    """
+    workers = workers or os.cpu_count() or 1
+    file_paths = list(file_paths)
+    remaining = {file_path: 1 for file_path in file_paths}
+    collected = {file_path: {"records": [], "seconds": 0.0, "errors": []} for file_path in remaining}
+
+    def collect(result, schedule):
+        file_path, start, records, seconds, error, page_count = result
+        state = collected[file_path]
+        state["records"].extend(records)
+        state["seconds"] += seconds
+        if error:
+            state["errors"].append(error)
+        remaining[file_path] -= 1
+        if start == 0 and page_count:
+            more = _more_tasks(file_path, page_count)
+            remaining[file_path] += len(more)
+            for task in more:
+                schedule(task)
+        if remaining[file_path]:
+            return None
+        state = collected.pop(file_path)
+        pages = sorted(state["records"])
+        separator = PAGE_SEPARATOR if file_path.endswith('.pdf') else ""
+        return {
+            "path": file_path,
+            "text": separator.join(text for _, text in pages) if any(text.strip() for _, text in pages) else "",
+            "pages": len(pages),
+            "seconds": state["seconds"],
+            "error": "; ".join(state["errors"]) or None,
+        }
+
+    if workers <= 1 or not file_paths or (len(file_paths) == 1 and not file_paths[0].endswith('.pdf')):
+        queue = [_first_task(file_path) for file_path in file_paths]
+        while queue:
+            done = collect(_extract_task(*queue.pop(0)), queue.append)
+            if done:
+                yield done
+        return
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            pending = {pool.submit(_extract_task, *_first_task(file_path)) for file_path in file_paths}
+
+            def schedule(task):
+                pending.add(pool.submit(_extract_task, *task))
+
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    pending.discard(future)
+                    done = collect(future.result(), schedule)
+                    if done:
+                        yield done
+    except BrokenProcessPool as e:
+        # Пул процессов недоступен - дочитываем оставшиеся файлы в текущем процессе
+        print(f"Пул процессов остановлен ({e}), продолжаю последовательно")
+        for file_path in list(collected):
+            started = time.perf_counter()
+            text = read_any_file(file_path)
+            collected.pop(file_path)
+            yield {"path": file_path, "text": text, "pages": text.count(PAGE_SEPARATOR) + 1,
+                   "seconds": time.perf_counter() - started, "error": None}
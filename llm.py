@@ -0,0 +1,267 @@
+"""Клиент ollama: пул соединений к нескольким серверам, таймауты, повторы и время генерации"""
+import random
+import threading
+import time
+
+import metrics
+
+
+def _modules():
+    """ollama и httpx импортируются при первом обращении к модели, а не при запуске бота"""
+    import httpx
+    import ollama
+    return httpx, ollama
+
+
+class LLMUnavailable(Exception):
+    """Ни один сервер ollama не смог ответить"""
+
+
+class LLMTimeout(LLMUnavailable):
+    """Ответ не получен за отведенное время"""
+
+
+def timing(response):
+    """Время из финального ответа ollama: загрузка, разбор промпта и генерация (секунды)"""
+    def seconds(key):
+        return (response.get(key) or 0) / 1e9
+
+    return {
+        "load": seconds("load_duration"),
+        "prompt_eval": seconds("prompt_eval_duration"),
+        "prompt_tokens": response.get("prompt_eval_count") or 0,
+        "eval": seconds("eval_duration"),
+        "eval_tokens": response.get("eval_count") or 0,
+        "total": seconds("total_duration"),
+    }
+
+
+class TimingStats:
+    """Последнее и суммарное время разбора промпта и генерации"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last = None
+        self.requests = 0
+        self.prompt_eval = 0.0
+        self.eval = 0.0
+
+    def record(self, response):
+        stats = timing(response)
+        with self.lock:
+            self.last = stats
+            self.requests += 1
+            self.prompt_eval += stats["prompt_eval"]
+            self.eval += stats["eval"]
+        metrics.observe("ollama_load", stats["load"])
+        metrics.observe("ollama_prompt_eval", stats["prompt_eval"])
+        metrics.observe("ollama_eval", stats["eval"])
+        metrics.inc("bot_ollama_prompt_tokens_total", "Токены промптов, разобранные моделью", stats["prompt_tokens"])
+        metrics.inc("bot_ollama_eval_tokens_total", "Токены, сгенерированные моделью", stats["eval_tokens"])
+        print(f"🧠 Промпт: {stats['prompt_tokens']} ток. за {stats['prompt_eval']:.2f} с, "
+              f"генерация: {stats['eval_tokens']} ток. за {stats['eval']:.2f} с, "
+              f"загрузка модели: {stats['load']:.2f} с")
+        return stats
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "last": dict(self.last) if self.last else None,
+                "requests": self.requests,
+                "prompt_eval": self.prompt_eval,
+                "eval": self.eval,
+            }
+
+
+class _Host:
+    """Сервер ollama с собственным пулом HTTP-соединений"""
+
+    def __init__(self, url, timeout, connect_timeout):
+        self.url = url
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._transport = None
+        self._transport_lock = threading.Lock()
+        self.active = 0  # Запросов в работе
+        self.failed_until = 0.0  # До этого момента сервер считается недоступным
+
+    def client(self, timeout=None):
+        """Клиент ollama с таймаутом timeout секунд (по умолчанию self.timeout).
+
+        Все клиенты сервера делят один пул соединений: httpx применяет таймаут
+        к каждому запросу, поэтому у попыток может быть разный таймаут.
+        """
+        httpx, ollama = _modules()
+        if self._transport is None:
+            with self._transport_lock:
+                if self._transport is None:
+                    self._transport = httpx.HTTPTransport()
+        timeout = self.timeout if timeout is None else timeout
+        return ollama.Client(host=self.url, transport=self._transport,
+                             timeout=httpx.Timeout(timeout, connect=min(self.connect_timeout, timeout)))
+
+
+class LLMClient:
+    """Клиент модели поверх одного или нескольких серверов ollama.
+
+    Запрос уходит на наименее загруженный доступный сервер. Ошибки соединения,
+    таймауты и ответы 5xx повторяются на другом сервере с экспоненциальной
+    задержкой и случайным разбросом, но только пока пользователю не отправлен
+    ни один токен. Таймаут попытки не больше времени, оставшегося до deadline.
+    Сервер, который не ответил, исключается на failure_cooldown секунд.
+    """
+
+    def __init__(self, model, hosts, keep_alive=None, timeout=120, connect_timeout=5,
+                 deadline=300, retries=2, backoff=0.5, failure_cooldown=30):
+        if not hosts:
+            raise ValueError("Не указан ни один сервер ollama")
+        self.model = model
+        self.keep_alive = keep_alive
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.failure_cooldown = failure_cooldown
+        self.hosts = [_Host(url, timeout, connect_timeout) for url in hosts]
+        self.lock = threading.Lock()
+
+    def _acquire(self, exclude):
+        """Выбирает сервер с наименьшим числом запросов в работе"""
+        now = time.monotonic()
+        with self.lock:
+            candidates = [host for host in self.hosts if host not in exclude] or self.hosts
+            healthy = [host for host in candidates if host.failed_until <= now] or candidates
+            host = min(healthy, key=lambda h: (h.active, random.random()))
+            host.active += 1
+            return host
+
+    def _release(self, host, failed=False):
+        with self.lock:
+            host.active -= 1
+            if failed:
+                host.failed_until = time.monotonic() + self.failure_cooldown
+            else:
+                host.failed_until = 0.0
+
+    @staticmethod
+    def _retryable(error):
+        httpx, ollama = _modules()
+        if isinstance(error, ollama.ResponseError):
+            return error.status_code >= 500 or error.status_code == 429
+        return isinstance(error, (httpx.TransportError, ConnectionError))
+
+    def _sleep_before_retry(self, attempt):
+        delay = self.backoff * (2 ** attempt)
+        time.sleep(random.uniform(delay / 2, delay))
+
+    def _call(self, client, messages, stream, options):
+        return client.chat(model=self.model, messages=messages, stream=stream,
+                           options=options, keep_alive=self.keep_alive)
+
+    def _remaining(self, started):
+        """Секунды до дедлайна запроса, начатого в started"""
+        return self.deadline - (time.monotonic() - started)
+
+    def _request(self, call, deadline=None, retries=None):
+        """Выполняет call(client) с повторами на других серверах.
+
+        deadline и retries заменяют общие ограничения клиента для этого запроса.
+        """
+        deadline = self.deadline if deadline is None else deadline
+        retries = self.retries if retries is None else retries
+        started = time.monotonic()
+        tried = []
+        last_error = None
+        for attempt in range(retries + 1):
+            if attempt:
+                self._sleep_before_retry(attempt - 1)
+            remaining = deadline - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            host = self._acquire(tried)
+            tried.append(host)
+            try:
+                response = call(host.client(min(host.timeout, remaining)))
+            except Exception as e:
+                self._release(host, failed=self._retryable(e))
+                if not self._retryable(e):
+                    raise
+                print(f"Ошибка запроса к ollama {host.url} (попытка {attempt + 1}): {e}")
+                metrics.inc("bot_ollama_retries_total", "Повторы запросов к ollama", host=host.url)
+                last_error = e
+                continue
+            self._release(host)
+            return response
+        if last_error is None or isinstance(last_error, _modules()[0].TimeoutException):
+            raise LLMTimeout(f"Модель не ответила за {deadline} с")
+        raise LLMUnavailable(str(last_error)) from last_error
+
+    def chat(self, messages, options=None):
+        """Возвращает полный ответ модели (dict ollama)"""
+        return self._request(lambda client: self._call(client, messages, False, options))
+
+    def embed(self, model, text, deadline=None, retries=None):
+        """Вектор текста от модели эмбеддингов model"""
+        response = self._request(lambda client: client.embeddings(model=model, prompt=text,
+                                                                  keep_alive=self.keep_alive),
+                                 deadline=deadline, retries=retries)
+        return response["embedding"]
+
+    def stream_chat(self, messages, options=None):
+        """Генератор частей ответа модели.
+
+        Повтор возможен только до первой части: после нее ошибка
+        передается вызывающему коду как LLMUnavailable.
+        """
+        started = time.monotonic()
+        tried = []
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._sleep_before_retry(attempt - 1)
+            remaining = self._remaining(started)
+            if remaining <= 0:
+                break
+            host = self._acquire(tried)
+            tried.append(host)
+            received = False
+            try:
+                for part in self._call(host.client(min(host.timeout, remaining)), messages, True, options):
+                    received = True
+                    yield part
+                    if time.monotonic() - started > self.deadline:
+                        raise LLMTimeout(f"Генерация не завершилась за {self.deadline} с")
+            except (LLMTimeout, GeneratorExit):
+                # Дедлайн или вызывающий код прекратил чтение ответа
+                self._release(host)
+                raise
+            except Exception as e:
+                retryable = self._retryable(e)
+                self._release(host, failed=retryable)
+                if not retryable:
+                    raise
+                print(f"Ошибка запроса к ollama {host.url} (попытка {attempt + 1}): {e}")
+                metrics.inc("bot_ollama_retries_total", "Повторы запросов к ollama", host=host.url)
+                if received:
+                    raise LLMUnavailable(str(e)) from e
+                last_error = e
+                continue
+            self._release(host)
+            return
+        if last_error is None or isinstance(last_error, _modules()[0].TimeoutException):
+            raise LLMTimeout(f"Модель не ответила за {self.deadline} с")
+        raise LLMUnavailable(str(last_error)) from last_error
+
+    def warm_up(self, system_message):
+        """Загружает модель на каждом сервере и разбирает системный промпт.
+
+        Генерируется один токен; следующий запрос с тем же системным сообщением
+        в начале разбирает только новые токены.
+        """
+        for host in self.hosts:
+            try:
+                response = self._call(host.client(), [system_message], False, {"num_predict": 1})
+                stats = timing(response)
+                print(f"🔥 Модель {self.model} прогрета на {host.url}: промпт {stats['prompt_tokens']} ток. за "
+                      f"{stats['prompt_eval']:.2f} с, загрузка {stats['load']:.2f} с")
+            except Exception as e:
+                print(f"Ошибка прогрева модели {self.model} на {host.url}: {e}")
@@ -1,211 +1,533 @@
 import telebot
 from telebot import types as t
 from config import token
-import ollama
 import os
 import glob
 import json
-from pypdf import PdfReader
-import docx
 import datetime
-import re
-import speech_recognition as sr
-from pydub import AudioSegment
-import io
+import atexit
+import shutil
+import threading
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from corpus_store import CorpusStore
+from corpus import CorpusHolder, CorpusSnapshot, collapse_duplicates
+from corpus_map import open_snapshot, write_snapshot
+from clauses import answer_clause_question, build_clause_index
+from ingest import extract_files
+from retrieval import build_index, build_context_message, hybrid_merge, is_relevant, update_index
+from telegram_stream import ProgressMessage, StreamingReply
+from uploads import ALLOWED_EXTENSIONS, UploadError, clean_filename, download, extract_zip, is_allowed, \
+    telegram_file_url
+from chat_context import ChatContexts
+from session_store import ChatFlags, SessionStore
+from answer_cache import AnswerCache, make_key as make_answer_key
+from file_id_cache import FileIdCache
+from file_registry import FileRegistry
+from voice import decode_voice, has_av, SAMPLE_RATE as VOICE_SAMPLE_RATE
+from asr import SpeechService, create_backend
+from scheduler import ChatScheduler, LLMGate, LLMQueueFull, ScheduledTeleBot
+from llm import LLMClient, LLMTimeout, LLMUnavailable, TimingStats
+import metrics
 
-bot = telebot.TeleBot(token)
 MODEL_NAME = "llama3"
 
 # Конфигурация
+OLLAMA_HOSTS = os.environ.get("OLLAMA_HOSTS", "http://127.0.0.1:11434").split(",")  # Серверы ollama через запятую
+OLLAMA_KEEP_ALIVE = "24h"  # Сколько держать модель в памяти после запроса (-1 - всегда)
+LLM_TIMEOUT = 120  # Секунд ожидания очередной части ответа сервера
+LLM_DEADLINE = 300  # Максимальное время одного ответа модели, секунд
+LLM_RETRIES = 2  # Повторы на другом сервере при ошибке соединения или 5xx
+UPDATE_WORKERS = 8  # Потоки для сообщений (порядок внутри чата сохраняется)
+CALLBACK_WORKERS = 4  # Отдельные потоки для кнопок меню и админ-панели
+LLM_PER_HOST = 1  # Одновременных запросов к одному серверу ollama
+LLM_MAX_CONCURRENT = LLM_PER_HOST * len(OLLAMA_HOSTS)  # Одновременных запросов к модели
+LLM_MAX_QUEUE = 20  # Максимум запросов, ожидающих модель
+HISTORY_TOKEN_BUDGET = 2000  # Бюджет токенов на историю диалога (без системного промпта и фрагментов)
+CHAT_IDLE_TTL = 60 * 60  # Через сколько секунд простоя контекст чата удаляется
 ADMIN_PASSWORD = "admin123"  # Замените на свой пароль
-AUTH_FILE = "authorized_users.json"
+AUTH_FILE = "authorized_users.json"  # Старый файл пользователей, переносится в SESSION_DB
+SESSION_DB = os.path.join("cache", "sessions.sqlite3")  # Сессии чатов и авторизация
+SESSION_FLUSH_INTERVAL = 1.0  # Как часто записывать изменения сессий на диск, секунд
+DATA_FOLDER = "data"
+UPLOAD_MAX_BYTES = 20 * 1024 * 1024  # Telegram Bot API отдает боту файлы до 20 МБ
+ZIP_MAX_FILE_BYTES = 200 * 1024 * 1024  # Ограничения на распаковку архива (защита от zip-бомб)
+ZIP_MAX_TOTAL_BYTES = 1024 * 1024 * 1024
+CORPUS_CACHE_DIR = os.path.join("cache", "corpus")
+SHARED_SNAPSHOT_DIR = os.path.join("cache", "snapshot")  # Снимок базы знаний для процессов-обработчиков webhook
+PARSER_VERSION = 3  # Увеличьте при изменении функций чтения файлов
+INGEST_WORKERS = os.cpu_count() or 1  # Процессы для разбора новых и измененных файлов
+TOP_K_CHUNKS = 5  # Сколько фрагментов документов передавать модели с вопросом
+MAX_CONTEXT_CHARS = 6000  # Ограничение размера фрагментов в одном запросе
+STREAM_RESPONSES = True  # Показывать ответ модели по мере генерации
+STREAM_EDIT_TOKENS = 30  # Обновлять сообщение каждые N токенов...
+STREAM_EDIT_INTERVAL = 1.5  # ...или каждые T секунд (но не чаще раза в секунду)
+RELEVANCE_MIN_SCORE = 4.0  # Минимальная BM25-оценка лучшего фрагмента для релевантного вопроса
+RELEVANCE_MIN_COVERAGE = 0.5  # Минимальная доля слов вопроса (с весами idf), найденных в этом фрагменте
+EMBEDDINGS_ENABLED = True  # Искать фрагменты еще и по смыслу (эмбеддинги ollama)
+EMBEDDING_MODEL = "nomic-embed-text"  # Модель эмбеддингов (ollama pull nomic-embed-text)
+EMBEDDINGS_DIR = os.path.join("cache", "embeddings")
+EMBEDDING_SIM_FLOOR = 0.4  # Косинусная близость, ниже которой фрагмент не получает баллов
+EMBEDDING_MIN_SIMILARITY = 0.6  # Близость, которая сама по себе делает вопрос релевантным
+EMBEDDING_QUERY_DEADLINE = 3  # Секунд на эмбеддинг вопроса без повторов, иначе поиск только по BM25
+ANSWER_CACHE_SIZE = 500  # Сколько ответов хранить в кэше
+ANSWER_CACHE_TTL = 24 * 60 * 60  # Время жизни ответа в кэше, секунд
+ANSWER_CACHE_FILE = os.path.join("cache", "answers.json")  # None - не сохранять на диск
+FILE_ID_CACHE_FILE = os.path.join("cache", "file_ids.json")  # file_id документов, уже отправленных в Telegram
+ASR_ENGINE = "google"  # Распознавание речи: "google" (онлайн), "vosk" или "whisper" (офлайн)
+VOSK_MODEL_PATH = os.path.join("models", "vosk-model-small-ru-0.22")
+WHISPER_MODEL = "small"  # Модель faster-whisper
+ASR_WORKERS = 1  # Сколько голосовых распознается одновременно
+METRICS_HOST = "127.0.0.1"  # Адрес HTTP-сервера метрик Prometheus
+METRICS_PORT = 9108  # Порт метрик (GET /metrics), None - не запускать
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")  # Публичный HTTPS-адрес webhook, None - long polling
+WEBHOOK_LISTEN = "127.0.0.1"  # Адрес локального HTTP-сервера webhook (за HTTPS-прокси)
+WEBHOOK_PORT = 8443
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")  # Проверяется в заголовке каждого запроса Telegram
+WEBHOOK_WORKERS = os.cpu_count() or 1  # Процессы-обработчики обновлений в режиме webhook
+
+bot = ScheduledTeleBot(token, ChatScheduler(workers=UPDATE_WORKERS, callback_workers=CALLBACK_WORKERS))
+llm_gate = LLMGate(max_concurrent=LLM_MAX_CONCURRENT, max_waiting=LLM_MAX_QUEUE)
+llm_timing = TimingStats()  # Время разбора промпта и генерации по ответам ollama
+llm_client = LLMClient(MODEL_NAME, OLLAMA_HOSTS, keep_alive=OLLAMA_KEEP_ALIVE, timeout=LLM_TIMEOUT,
+                       deadline=LLM_DEADLINE, retries=LLM_RETRIES)
+
+# Распознавание речи: движок выбирается в конфигурации, модель одна на все чаты
+speech_service = SpeechService(
+    create_backend(ASR_ENGINE, vosk_model_path=VOSK_MODEL_PATH, whisper_model=WHISPER_MODEL),
+    workers=ASR_WORKERS,
+)
+
+
+# Контексты AI-чатов, состояния меню и авторизация переживают перезапуск бота
+session_store = SessionStore(SESSION_DB, flush_interval=SESSION_FLUSH_INTERVAL)
+atexit.register(session_store.close)
 
-# Ключевые слова для определения релевантности вопросов
-RELEVANCE_KEYWORDS = []
 
-# Инициализация распознавателя речи
-recognizer = sr.Recognizer()
-
-
-# Загрузка авторизованных пользователей
 def load_authorized_users():
+    """Авторизованные пользователи; при первом запуске переносятся из AUTH_FILE"""
     if os.path.exists(AUTH_FILE):
-        with open(AUTH_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
+        try:
+            with open(AUTH_FILE, 'r', encoding='utf-8') as f:
+                if session_store.import_authorized(json.load(f)):
+                    print(f"Авторизованные пользователи перенесены из {AUTH_FILE} в {SESSION_DB}")
+        except Exception as e:
+            print(f"Ошибка переноса {AUTH_FILE}: {e}")
+    return session_store.authorized_users()
 
 
-# Сохранение авторизованных пользователей
-def save_authorized_users(users):
-    with open(AUTH_FILE, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+def set_authorized_user(chat_id, data):
+    """Добавляет (data) или удаляет (None) пользователя; запись в базу идет в фоне"""
+    if data is None:
+        authorized_users.pop(chat_id, None)
+    else:
+        authorized_users[chat_id] = data
+    session_store.save_authorized(chat_id, data)
 
 
 # Загружаем авторизованных пользователей
 authorized_users = load_authorized_users()
 
 
-def convert_voice_to_text(voice_file_path):
-    """Конвертирует голосовое сообщение в текст"""
+def convert_voice_to_text(voice_data):
+    """Конвертирует голосовое сообщение (байты OGG) в текст без временных файлов"""
     try:
-        # Конвертируем OGG в WAV
-        audio = AudioSegment.from_ogg(voice_file_path)
-        wav_file_path = voice_file_path.replace('.ogg', '.wav')
-        audio.export(wav_file_path, format='wav')
-
-        # Распознаем речь
-        with sr.AudioFile(wav_file_path) as source:
-            audio_data = recognizer.record(source)
-            text = recognizer.recognize_google(audio_data, language='ru-RU')
-
-        # Удаляем временные файлы
-        os.remove(wav_file_path)
-        os.remove(voice_file_path)
-
-        return text
-    except sr.UnknownValueError:
-        return None  # Не удалось распознать речь
+        # Декодируем OGG/Opus сразу в 16 кГц моно PCM в памяти
+        with metrics.span("voice_decode"):
+            pcm = decode_voice(voice_data, VOICE_SAMPLE_RATE)
+
+        # Распознаем речь выбранным движком (буфер передается без копирования)
+        return speech_service.transcribe(pcm, VOICE_SAMPLE_RATE)
     except Exception as e:
         print(f"Ошибка конвертации голоса: {e}")
-        # Удаляем временные файлы в случае ошибки
-        if os.path.exists(voice_file_path):
-            os.remove(voice_file_path)
-        wav_file_path = voice_file_path.replace('.ogg', '.wav')
-        if os.path.exists(wav_file_path):
-            os.remove(wav_file_path)
         return None
 
 
-# Функции для чтения файлов
-def read_txt_file(file_path):
-    """Чтение текстовых файлов"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read()
-    except Exception as e:
-        print(f"Ошибка чтения TXT файла {file_path}: {e}")
-        return ""
+# Кэш извлеченного текста, общий для всех чатов и переживающий перезапуск
+corpus_store = CorpusStore(CORPUS_CACHE_DIR, parser_version=PARSER_VERSION)
 
+# Текущий снимок базы знаний (тексты + BM25-индекс), один на все чаты
+corpus_holder = CorpusHolder()
+corpus_load_lock = threading.Lock()
+bot_ready = threading.Event()  # Установлен, когда база знаний загружена после запуска
+reindex_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reindex")
 
-def read_pdf_file(file_path):
-    """Чтение PDF файлов"""
-    try:
-        text = ""
-        reader = PdfReader(file_path)
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        print(f"Ошибка чтения PDF файла {file_path}: {e}")
-        return ""
+# В режиме webhook файлы разбирает и эмбеддинги пишет только ведущий процесс,
+# обработчики сообщают ему об изменениях через notify_corpus_changed(имя файла)
+corpus_leader = True
+notify_corpus_changed = None
+pending_reindex_chats = {}  # Файлы -> (чат, сообщение о ходе загрузки) для отчета об обновлении
 
+# Ответы на повторяющиеся вопросы; записи старых версий базы знаний удаляются
+answer_cache = AnswerCache(max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, path=ANSWER_CACHE_FILE)
 
-def read_docx_file(file_path):
-    """Чтение DOCX файлов"""
+
+def save_answer_cache():
+    """Сохраняет ответы, добавленные после последней записи (put пишет на диск не чаще save_interval)"""
     try:
-        doc = docx.Document(file_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
+        answer_cache.save()
     except Exception as e:
-        print(f"Ошибка чтения DOCX файла {file_path}: {e}")
-        return ""
+        print(f"Ошибка сохранения кэша ответов: {e}")
 
 
-def read_rtf_file(file_path):
-    """Чтение RTF файлов"""
-    try:
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
-            return file.read()
-    except Exception as e:
-        print(f"Ошибка чтения RTF файла {file_path}: {e}")
-        return ""
+# Обработчик webhook заменяет answer_cache своим - при выходе сохраняется текущий
+atexit.register(save_answer_cache)
+
+# Повторная отправка документа по file_id вместо загрузки байтов
+file_id_cache = FileIdCache(FILE_ID_CACHE_FILE)
+
+# Список файлов data с короткими id для кнопок; перечитывается после загрузки и удаления
+file_registry = FileRegistry(DATA_FOLDER)
 
 
-def extract_keywords_from_text(text):
-    """Извлекает ключевые слова из текста"""
-    # Удаляем спецсимволы и приводим к нижнему регистру
-    clean_text = re.sub(r'[^\w\s]', ' ', text.lower())
-    # Разбиваем на слова и убираем стоп-слова
-    words = clean_text.split()
-    # Фильтруем короткие слова и оставляем только значимые
-    keywords = [word for word in words if len(word) > 3]
-    # Убираем дубликаты
-    return list(set(keywords))
+def send_data_file(chat_id, filename):
+    """Отправляет файл из data; возвращает False, если файла нет"""
+    file_path = os.path.join(DATA_FOLDER, filename)
+    if not os.path.exists(file_path):
+        return False
 
+    caption = f"📥 Вот ваш файл: {filename}"
+    file_id, sha256 = file_id_cache.get(filename, file_path)
+    if file_id:
+        try:
+            bot.send_document(chat_id, file_id, caption=caption)
+            return True
+        except Exception as e:
+            # file_id мог устареть - загружаем файл заново
+            print(f"Не удалось отправить {filename} по file_id: {e}")
+            file_id_cache.drop(filename)
+
+    with open(file_path, 'rb') as file:
+        sent = bot.send_document(chat_id, file, caption=caption)
+    if sent.document:
+        file_id_cache.put(filename, file_path, sha256, sent.document.file_id)
+    return True
 
+
+@metrics.timed("corpus_load")
 def load_all_data_with_sources():
-    """Загрузка всех данных из папки data с указанием источников"""
-    global RELEVANCE_KEYWORDS
-    data_content = ""
-    data_folder = "data"
+    """Загрузка всех данных из папки data в новый снимок базы знаний.
+
+    Снимок становится текущим для всех чатов и возвращается.
+    """
+    if not corpus_leader:
+        corpus = load_shared_snapshot()
+        if corpus is not None:
+            return corpus
+
+    data_folder = DATA_FOLDER
     file_contents = {}
-    all_keywords = []
 
     if not os.path.exists(data_folder):
         os.makedirs(data_folder)
         print(f"Создана папка {data_folder}")
-        return "", file_contents
 
-    # Чтение всех файлов в папке data
-    for file_path in glob.glob(os.path.join(data_folder, "*")):
+    # Чтение всех файлов в папке data (повторно парсятся только новые и измененные)
+    file_paths = sorted(glob.glob(os.path.join(data_folder, "*")))
+    changed = {}
+    for file_path in file_paths:
         filename = os.path.basename(file_path)
-        file_content = ""
-
-        if file_path.endswith('.txt'):
-            file_content = read_txt_file(file_path)
-        elif file_path.endswith('.pdf'):
-            file_content = read_pdf_file(file_path)
-        elif file_path.endswith('.docx'):
-            file_content = read_docx_file(file_path)
-        elif file_path.endswith('.rtf'):
-            file_content = read_rtf_file(file_path)
+        try:
+            file_content, sha256 = corpus_store.lookup(file_path)
+        except Exception as e:
+            print(f"Ошибка загрузки файла {file_path}: {e}")
+            continue
 
         if file_content:
-            data_content += f"\n--- Содержимое файла {filename} ---\n{file_content}\n"
             file_contents[filename] = file_content
-            # Извлекаем ключевые слова из содержимого файла
-            keywords = extract_keywords_from_text(file_content)
-            all_keywords.extend(keywords)
+        elif file_content is None:
+            changed[file_path] = sha256
+
+    # Новые и измененные файлы разбираем параллельно: PDF - диапазонами страниц
+    for result in extract_files(list(changed), workers=INGEST_WORKERS):
+        file_path = result["path"]
+        filename = os.path.basename(file_path)
+        if result["error"]:
+            print(f"Ошибка чтения файла {filename}: {result['error']}")
+        print(f"📄 {filename}: {result['pages']} стр., {len(result['text'])} символов за {result['seconds']:.1f} с")
+        record_ingest(file_path, result)
+        if result["text"]:
+            corpus_store.put(file_path, changed[file_path], result["text"])
+            file_contents[filename] = result["text"]
+
+    # Забываем удаленные файлы и сохраняем индекс кэша
+    corpus_store.prune(file_paths)
+    try:
+        corpus_store.save()
+    except Exception as e:
+        print(f"Ошибка сохранения кэша данных: {e}")
+
+    # Документ, сохраненный и в PDF, и в RTF, индексируем один раз
+    fingerprints = {}
+    file_contents, duplicates = collapse_duplicates(file_contents, fingerprints)
+    for duplicate, original in duplicates.items():
+        print(f"Файл {duplicate} совпадает с {original}, индексируется один раз")
+
+    # Строим индекс фрагментов и атомарно заменяем текущий снимок
+    corpus = CorpusSnapshot(file_contents, build_index(file_contents), duplicates, fingerprints,
+                            build_clause_index(file_contents))
+    corpus_holder.publish(corpus)
+    answer_cache.retain_version(corpus.version)
+    schedule_model_warm_up(corpus)
+    return corpus
+
+
+def record_ingest(file_path, result):
+    """Метрики разбора одного файла"""
+    metrics.observe("ingest_file", result["seconds"])
+    metrics.inc("bot_ingest_files_total", "Разобранные файлы")
+    metrics.inc("bot_ingest_pages_total", "Разобранные страницы", result["pages"])
+    try:
+        metrics.inc("bot_ingest_bytes_total", "Размер разобранных файлов", os.path.getsize(file_path))
+    except OSError:
+        pass
 
-    # Обновляем глобальный список ключевых слов
-    RELEVANCE_KEYWORDS = list(set(all_keywords))
-    return data_content, file_contents
 
+@metrics.timed("corpus_update")
+def update_corpus_files(filenames, on_progress=None):
+    """Обновляет в текущем снимке добавленные, замененные или удаленные файлы.
 
-def is_question_relevant(question, file_contents):
-    """Проверяет, относится ли вопрос к предоставленным данным"""
-    question_lower = question.lower()
+    Разбираются только эти файлы (параллельно), сегменты индекса остальных
+    файлов переиспользуются. on_progress(разобрано, всего) вызывается после
+    каждого разобранного файла. Новый снимок становится текущим и возвращается.
+    """
+    filenames = set(filenames)
+    with corpus_load_lock:
+        current = corpus_holder.get()
+        if current is None or not corpus_leader:
+            # Обработчик webhook открывает снимок, уже обновленный ведущим процессом
+            return load_all_data_with_sources()
+
+        # Тексты всех файлов, включая дубликаты в других форматах (они лежат в кэше)
+        all_contents = dict(current.file_contents)
+        for duplicate in current.duplicates:
+            duplicate_path = os.path.join(DATA_FOLDER, duplicate)
+            if os.path.exists(duplicate_path):
+                text, _ = corpus_store.lookup(duplicate_path)
+                if text:
+                    all_contents[duplicate] = text
+        for filename in filenames:
+            all_contents.pop(filename, None)
+        fingerprints = {name: value for name, value in current.fingerprints.items() if name not in filenames}
+
+        changed_paths = {}
+        for filename in filenames:
+            file_path = os.path.join(DATA_FOLDER, filename)
+            if not os.path.exists(file_path):
+                continue
+            text, sha256 = corpus_store.lookup(file_path)
+            if text is None:
+                changed_paths[file_path] = sha256
+            elif text:
+                all_contents[filename] = text
+
+        for done, result in enumerate(extract_files(list(changed_paths), workers=INGEST_WORKERS), 1):
+            file_path = result["path"]
+            filename = os.path.basename(file_path)
+            if result["error"]:
+                print(f"Ошибка чтения файла {filename}: {result['error']}")
+            record_ingest(file_path, result)
+            corpus_store.put(file_path, changed_paths[file_path], result["text"])
+            if result["text"]:
+                all_contents[filename] = result["text"]
+            if on_progress:
+                on_progress(done, len(changed_paths))
+
+        corpus_store.prune(glob.glob(os.path.join(DATA_FOLDER, "*")))
+        try:
+            corpus_store.save()
+        except Exception as e:
+            print(f"Ошибка сохранения кэша данных: {e}")
 
-    # Проверяем наличие ключевых слов в вопросе
-    for keyword in RELEVANCE_KEYWORDS:
-        if keyword in question_lower and len(keyword) > 3:
-            return True
+        file_contents, duplicates = collapse_duplicates(all_contents, fingerprints)
+        # Заново индексируем сами файлы и дубликаты, которые могли занять место удаленных
+        changed = filenames | (set(file_contents) - set(current.file_contents))
+        index = update_index(current.index, file_contents, changed)
+        clause_index = build_clause_index(file_contents, current.clause_index, changed)
+
+        corpus = CorpusSnapshot(file_contents, index, duplicates, fingerprints, clause_index)
+        corpus_holder.publish(corpus)
+        answer_cache.retain_version(corpus.version)
+        schedule_model_warm_up(corpus)
+        return corpus
+
+
+# Векторный индекс фрагментов; создается при прогреве (numpy импортируется там же)
+# и строится фоново после каждого обновления базы знаний
+embedding_index = None
+
+
+def create_embedding_index(directory=EMBEDDINGS_DIR):
+    from embeddings import EmbeddingIndex
+
+    return EmbeddingIndex(directory, EMBEDDING_MODEL, lambda text: llm_client.embed(EMBEDDING_MODEL, text),
+                          workers=2 * len(OLLAMA_HOSTS), read_only=not corpus_leader,
+                          embed_query=lambda text: llm_client.embed(EMBEDDING_MODEL, text,
+                                                                    deadline=EMBEDDING_QUERY_DEADLINE, retries=0))
+
+
+@metrics.timed("embeddings_update")
+def update_embeddings(corpus):
+    """Досчитывает эмбеддинги новых фрагментов и убирает лишние строки"""
+    chunks = corpus.index.chunks
+    embedding_index.update(chunks)
+    embedding_index.compact({chunk["id"] for chunk in chunks})
+
+
+def schedule_model_warm_up(corpus):
+    """Фоново прогревает модель системным промптом новой версии базы знаний"""
+    if not corpus_leader:
+        return
+    reindex_executor.submit(llm_client.warm_up, get_system_prompt(corpus))
+    if embedding_index is not None:
+        reindex_executor.submit(update_embeddings, corpus)
+
+
+def run_reindex(filenames, chat_id=None, progress=None):
+    """Обновляет базу знаний после загрузки или удаления файлов и сообщает об этом в чат.
+
+    progress - сообщение о ходе загрузки (ProgressMessage), в нем же выводится итог.
+    """
+    label = filenames[0] if len(filenames) == 1 else f"{len(filenames)} файлов"
+
+    def report(text):
+        if progress:
+            progress.finish(text)
+        elif chat_id:
+            bot.send_message(chat_id, text)
+
+    def on_progress(done, total):
+        progress.update(f"🔎 Разбираю файлы: {done} из {total}...")
+
+    started = time.perf_counter()
+    try:
+        corpus = update_corpus_files(filenames, on_progress=on_progress if progress else None)
+    except Exception as e:
+        print(f"Ошибка обновления базы знаний для {label}: {e}")
+        report(f"⚠️ Не удалось обновить базу знаний для {label}: {e}")
+        return
+    report(f"🔎 База знаний обновлена ({label}) за {time.perf_counter() - started:.1f} с: "
+           f"{len(corpus)} документов. Активные чаты получат обновление со следующим вопросом.")
+
+
+def schedule_reindex(filenames, chat_id=None, progress=None):
+    """Фоново обновляет базу знаний после загрузки или удаления файла (или нескольких)"""
+    filenames = (filenames,) if isinstance(filenames, str) else tuple(filenames)
+    if notify_corpus_changed is not None:
+        # Файлы разберет ведущий процесс, затем изменение придет всем обработчикам
+        pending_reindex_chats[filenames] = (chat_id, progress)
+        notify_corpus_changed(filenames)
+        return
+    reindex_executor.submit(run_reindex, filenames, chat_id, progress)
+
+
+def reload_corpus():
+    """Заново загружает все файлы в новый общий снимок"""
+    with corpus_load_lock:
+        return load_all_data_with_sources()
+
+
+def apply_corpus_change(filenames):
+    """Обработчик: ведущий процесс уже разобрал файлы (None - все файлы), обновляем свой снимок из кэша"""
+    chat_id, progress = pending_reindex_chats.pop(filenames, (None, None))
+    # Файлы менял другой процесс - список для кнопок перечитываем с диска
+    file_registry.invalidate()
+    if filenames is not None:
+        reindex_executor.submit(run_reindex, filenames, chat_id, progress)
+        return
+
+    def run():
+        corpus = reload_corpus()
+        if chat_id:
+            bot.send_message(chat_id, f"✅ Данные перезагружены! Загружено {len(corpus)} файлов, "
+                                      f"{corpus.total_chars} символов")
+
+    reindex_executor.submit(run)
+
+
+def load_shared_snapshot():
+    """Обработчик webhook: открывает снимок, записанный ведущим процессом; None, если его нет"""
+    try:
+        corpus = open_snapshot(SHARED_SNAPSHOT_DIR)
+    except Exception as e:
+        print(f"Ошибка открытия снимка базы знаний {SHARED_SNAPSHOT_DIR}: {e}")
+        return None
+    if corpus is not None:
+        corpus_holder.publish(corpus)
+        answer_cache.retain_version(corpus.version)
+    return corpus
+
+
+def leader_corpus_change(filenames):
+    """Ведущий процесс: разбирает измененные файлы (None - все файлы) в общий кэш и снимок"""
+    if filenames is None:
+        corpus = reload_corpus()
+    else:
+        corpus = update_corpus_files(filenames)
+    write_snapshot(SHARED_SNAPSHOT_DIR, corpus)
+
+
+def get_corpus():
+    """Текущий снимок базы знаний; при первом обращении загружает данные"""
+    corpus = corpus_holder.get()
+    if corpus is not None:
+        return corpus
+    with corpus_load_lock:
+        corpus = corpus_holder.get()
+        if corpus is None:
+            corpus = load_all_data_with_sources()
+    return corpus
+
+
+def search_passages(question, corpus):
+    """Ищет фрагменты документов для вопроса: список троек (оценка, фрагмент, близость).
+
+    Оценка - BM25 плюс балл за смысловую близость в той же шкале,
+    поэтому порог RELEVANCE_MIN_SCORE подходит для обоих поисков.
+    """
+    keyword_hits = corpus.index.search(question, k=TOP_K_CHUNKS)
+    if embedding_index is None:
+        return [(score, chunk, 0.0) for score, chunk in keyword_hits]
+    try:
+        dense_hits = embedding_index.search(question, corpus.index.chunks, k=TOP_K_CHUNKS, key=corpus.version)
+    except Exception as e:
+        print(f"Ошибка векторного поиска: {e}")
+        dense_hits = []
+    return hybrid_merge(keyword_hits, dense_hits, TOP_K_CHUNKS,
+                        EMBEDDING_SIM_FLOOR, EMBEDDING_MIN_SIMILARITY, RELEVANCE_MIN_SCORE)
+
+
+def is_question_relevant(question, corpus, passages=None):
+    """Проверяет, относится ли вопрос к предоставленным данным.
+
+    passages - уже найденные search_passages() фрагменты, чтобы не искать повторно.
+    """
+    if passages is None:
+        passages = search_passages(question, corpus)
+    if is_relevant(corpus.index, question, passages, RELEVANCE_MIN_SCORE, RELEVANCE_MIN_COVERAGE,
+                   EMBEDDING_MIN_SIMILARITY):
+        return True
 
     # Проверяем прямое упоминание файлов
-    for filename in file_contents.keys():
+    question_lower = question.lower()
+    for filename in corpus.file_contents.keys():
         filename_without_ext = os.path.splitext(filename)[0].lower()
         if filename_without_ext in question_lower:
             return True
 
-    # Проверяем общие вопросы о данных
-    general_data_questions = [
-        'что в файл', 'что в документ', 'информация в баз', 'данные в файл',
-        'содержан', 'напиши о', 'расскажи о', 'информация о', 'данные о',
-        'что известно', 'какая информация', 'какие данные'
-    ]
-
-    for data_question in general_data_questions:
-        if data_question in question_lower:
-            return True
-
     return False
 
 
-def get_system_prompt(data_content, file_contents):
-    """Создает системный промпт на основе загруженных данных"""
-    files_list = "\n".join([f"- {filename}" for filename in file_contents.keys()])
+def get_system_prompt(corpus):
+    """Создает системный промпт на основе снимка базы знаний.
+
+    Сами документы в промпт не вставляются: к каждому вопросу
+    добавляются только найденные фрагменты (см. process_ai_question).
+    """
+    # Промпт должен быть одинаковым байт в байт для всех чатов одной версии базы,
+    # тогда ollama переиспользует уже разобранный префикс
+    files_list = "\n".join([f"- {filename}" for filename in sorted(corpus.file_contents)])
 
     return {
         "role": "system",
@@ -218,7 +540,7 @@ def get_system_prompt(data_content, file_contents):
 2. Если в данных нет информации для ответа - скажи "В предоставленных данных нет информации по этому вопросу"
 3. Не придумывай информацию
 4. Не используй свои знания вне этих данных
-5. В КАЖДОМ ответе ОБЯЗАТЕЛЬНО указывай источник информации - название файла, откуда взята информация
+5. В КАЖДОМ ответе ОБЯЗАТЕЛЬНО указывай источник информации - название файла, откуда взята информация (и страницу или пункт, если они указаны у фрагмента)
 6. Если информация взята из нескольких файлов - укажи все источники
 7. Формат указания источников: [Источник: название_файла.расширение]
 8. Будь точным и ссылайся на конкретные данные
@@ -232,8 +554,8 @@ def get_system_prompt(data_content, file_contents):
 Доступные файлы:
 {files_list}
 
-Данные для работы:
-{data_content}
+Перед каждым вопросом ты получишь фрагменты документов с указанием источника.
+Данные для работы - только эти фрагменты.
 
 Теперь ты готов отвечать на вопросы строго по этим данным. ВСЕГДА указывай источники!
 """
@@ -256,49 +578,9 @@ def admin_panel_markup():
     button2 = t.InlineKeyboardButton(text="📤 Загрузить файлы", callback_data="admin_upload_files")
     button3 = t.InlineKeyboardButton(text="🗑️ Удалить файлы", callback_data="admin_delete_files")
     button4 = t.InlineKeyboardButton(text="👥 Пользователи", callback_data="admin_users")
-    button5 = t.InlineKeyboardButton(text="🔙 Назад", callback_data="admin_back")
-    markup.add(button1, button2, button3, button4, button5)
-    return markup
-
-
-def files_list_markup(mode="delete"):
-    """Клавиатура со списком файлов"""
-    markup = t.InlineKeyboardMarkup()
-    data_folder = "data"
-
-    if not os.path.exists(data_folder):
-        markup.add(t.InlineKeyboardButton(text="🔙 Назад", callback_data="admin_panel"))
-        return markup
-
-    files = glob.glob(os.path.join(data_folder, "*"))
-    for file_path in files:
-        filename = os.path.basename(file_path)
-        if mode == "delete":
-            button = t.InlineKeyboardButton(text=f"🗑️ {filename}", callback_data=f"delete_{filename}")
-        else:  # download
-            button = t.InlineKeyboardButton(text=f"📥 {filename}", callback_data=f"download_{filename}")
-        markup.add(button)
-
-    markup.add(t.InlineKeyboardButton(text="🔙 Назад", callback_data="admin_panel"))
-    return markup
-
-
-def user_files_markup():
-    """Клавиатура со списком файлов для обычных пользователей"""
-    markup = t.InlineKeyboardMarkup()
-    data_folder = "data"
-
-    if not os.path.exists(data_folder):
-        markup.add(t.InlineKeyboardButton(text="🔙 Назад", callback_data="user_back"))
-        return markup
-
-    files = glob.glob(os.path.join(data_folder, "*"))
-    for file_path in files:
-        filename = os.path.basename(file_path)
-        button = t.InlineKeyboardButton(text=f"📥 {filename}", callback_data=f"user_download_{filename}")
-        markup.add(button)
-
-    markup.add(t.InlineKeyboardButton(text="🔙 Назад", callback_data="user_back"))
+    button5 = t.InlineKeyboardButton(text="📊 Кэш данных", callback_data="admin_cache_stats")
+    button6 = t.InlineKeyboardButton(text="🔙 Назад", callback_data="admin_back")
+    markup.add(button1, button2, button3, button4, button5, button6)
     return markup
 
 
@@ -320,9 +602,9 @@ def start_message(message):
 
 
 # Словари для хранения состояний
-file_upload_sessions = {}
-admin_auth_sessions = {}
-file_contents_cache = {}  # Кэш содержимого файлов для каждого чата
+file_upload_sessions = ChatFlags(session_store, "upload")
+admin_auth_sessions = ChatFlags(session_store, "admin_auth")
+chat_corpus_versions = {}  # Версия снимка базы знаний, на которой построен контекст чата
 
 
 @bot.callback_query_handler(func=lambda call: True)
@@ -330,26 +612,26 @@ def check_click(call):
     try:
         if call.data == "send_question":
             chat_id = call.message.chat.id
+            if warming_up(chat_id):
+                bot.answer_callback_query(call.id)
+                return
 
             bot.delete_message(call.message.chat.id, call.message.message_id)
-            bot.send_message(chat_id, "🔄 Загружаю данные из папки data...")
+            if corpus_holder.get() is None:
+                bot.send_message(chat_id, "🔄 Загружаю данные из папки data...")
 
-            loaded_data, file_contents = load_all_data_with_sources()
-            file_count = len(glob.glob(os.path.join("data", "*")))
+            corpus = get_corpus()
 
-            if not loaded_data:
+            if not corpus.total_chars:
                 bot.send_message(chat_id, "❌ В папке data нет файлов или произошла ошибка загрузки")
                 return
 
-            system_prompt = get_system_prompt(loaded_data, file_contents)
-            user_contexts[chat_id] = [system_prompt]
-            active_ai_chats[chat_id] = True
-            file_contents_cache[chat_id] = file_contents  # Сохраняем содержимое файлов для этого чата
+            start_ai_session(chat_id, corpus)
 
             welcome_msg = f"""🤖 <b>AI-режим активирован</b>
 
-📊 База знаний: {file_count} файлов из папки data
-💾 Загружено {len(loaded_data)} символов данных
+📊 База знаний: {len(corpus)} файлов из папки data
+💾 Загружено {corpus.total_chars} символов данных
 📝 Отвечаю только на основе предоставленных данных
 🔍 В ответах указываю источники информации
 🎤 Поддерживаются голосовые сообщения
@@ -361,38 +643,53 @@ def check_click(call):
             bot.send_message(chat_id, welcome_msg, parse_mode="HTML")
 
         elif call.data == "user_download_files":
-            chat_id = call.message.chat.id
-            files_markup = user_files_markup()
+            bot.edit_message_text(file_registry.listing("📚 Доступные файлы"),
+                                  call.message.chat.id,
+                                  call.message.message_id,
+                                  parse_mode="HTML",
+                                  reply_markup=file_registry.markup("user"))
 
-            data_folder = "data"
-            if not os.path.exists(data_folder):
-                files_list = "📁 Папка data пуста"
-            else:
-                files = glob.glob(os.path.join(data_folder, "*"))
-                if not files:
-                    files_list = "📁 Папка data пуста"
+        elif call.data.startswith("get:"):
+            filename = file_registry.get(call.data[len("get:"):])
+
+            try:
+                if filename and send_data_file(call.message.chat.id, filename):
+                    bot.answer_callback_query(call.id, f"✅ Файл {filename} отправлен")
                 else:
-                    files_list = f"📚 <b>Доступные файлы ({len(files)}):</b>\n\n"
-                    for i, file_path in enumerate(files, 1):
-                        filename = os.path.basename(file_path)
-                        size = os.path.getsize(file_path)
-                        files_list += f"{i}. {filename} ({size} байт)\n"
+                    bot.answer_callback_query(call.id, "❌ Файл не найден")
+            except Exception as e:
+                bot.answer_callback_query(call.id, f"❌ Ошибка отправки: {str(e)}")
+
+        elif call.data.startswith("files:"):
+            # Переход по страницам списка файлов
+            _, mode, page = call.data.split(":")
+            page = int(page)
+            if mode != "user" and str(call.message.chat.id) not in authorized_users:
+                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
+                return
 
-            bot.edit_message_text(files_list,
+            if mode == "user":
+                text = file_registry.listing("📚 Доступные файлы", page)
+            elif mode == "list":
+                text = file_registry.listing("📁 Файлы в папке data", page, total_size=True)
+            else:
+                text = "🗑️ <b>Удаление файлов</b>\n\nВыберите файл для удаления:"
+            bot.edit_message_text(text,
                                   call.message.chat.id,
                                   call.message.message_id,
                                   parse_mode="HTML",
-                                  reply_markup=files_markup)
+                                  reply_markup=file_registry.markup(mode, page))
+            bot.answer_callback_query(call.id)
+
+        elif call.data == "noop":
+            bot.answer_callback_query(call.id)
 
-        elif call.data.startswith("user_download_"):
-            filename = call.data.replace("user_download_", "")
-            file_path = os.path.join("data", filename)
+        elif call.data.startswith("user_download_") or call.data.startswith("download_"):
+            # Кнопки из сообщений, отправленных до перехода на короткие id
+            filename = call.data.split("download_", 1)[1]
 
             try:
-                if os.path.exists(file_path):
-                    with open(file_path, 'rb') as file:
-                        bot.send_document(call.message.chat.id, file,
-                                          caption=f"📥 Вот ваш файл: {filename}")
+                if filename in file_registry and send_data_file(call.message.chat.id, filename):
                     bot.answer_callback_query(call.id, f"✅ Файл {filename} отправлен")
                 else:
                     bot.answer_callback_query(call.id, "❌ Файл не найден")
@@ -426,35 +723,28 @@ def check_click(call):
                                       call.message.message_id,
                                       parse_mode="HTML")
 
-        elif call.data == "admin_list_files":
-            # Проверяем авторизацию
+        elif call.data == "admin_panel":
             if str(call.message.chat.id) not in authorized_users:
                 bot.answer_callback_query(call.id, "❌ Доступ запрещен")
                 return
 
-            data_folder = "data"
-            if not os.path.exists(data_folder):
-                files_list = "📁 Папка data пуста"
-            else:
-                files = glob.glob(os.path.join(data_folder, "*"))
-                if not files:
-                    files_list = "📁 Папка data пуста"
-                else:
-                    files_list = f"📁 <b>Файлы в папке data ({len(files)}):</b>\n\n"
-                    total_size = 0
-                    for i, file_path in enumerate(files, 1):
-                        filename = os.path.basename(file_path)
-                        size = os.path.getsize(file_path)
-                        total_size += size
-                        files_list += f"{i}. {filename} ({size} байт)\n"
+            bot.edit_message_text("🔧 <b>Админ панель</b>\n\nВыберите действие:",
+                                  call.message.chat.id,
+                                  call.message.message_id,
+                                  parse_mode="HTML",
+                                  reply_markup=admin_panel_markup())
 
-                    files_list += f"\n💾 Общий размер: {total_size} байт"
+        elif call.data == "admin_list_files":
+            # Проверяем авторизацию
+            if str(call.message.chat.id) not in authorized_users:
+                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
+                return
 
-            bot.edit_message_text(files_list,
+            bot.edit_message_text(file_registry.listing("📁 Файлы в папке data", total_size=True),
                                   call.message.chat.id,
                                   call.message.message_id,
                                   parse_mode="HTML",
-                                  reply_markup=admin_panel_markup())
+                                  reply_markup=file_registry.markup("list"))
 
         elif call.data == "admin_upload_files":
             # Проверяем авторизацию
@@ -468,6 +758,7 @@ def check_click(call):
 
             bot.edit_message_text("📤 <b>Загрузка файлов</b>\n\n"
                                   "Отправьте файлы в формате TXT, PDF, DOCX или RTF.\n"
+                                  "Пакет документов можно отправить одним ZIP-архивом.\n"
                                   "Файлы будут автоматически сохранены в папку data.\n\n"
                                   "Для отмены нажмите /cancel",
                                   call.message.chat.id,
@@ -480,33 +771,39 @@ def check_click(call):
                 bot.answer_callback_query(call.id, "❌ Доступ запрещен")
                 return
 
-            files_markup = files_list_markup("delete")
             bot.edit_message_text("🗑️ <b>Удаление файлов</b>\n\n"
                                   "Выберите файл для удаления:",
                                   call.message.chat.id,
                                   call.message.message_id,
                                   parse_mode="HTML",
-                                  reply_markup=files_markup)
+                                  reply_markup=file_registry.markup("delete"))
 
-        elif call.data.startswith("delete_"):
+        elif call.data.startswith("del:") or call.data.startswith("delete_"):
             # Проверяем авторизацию
             if str(call.message.chat.id) not in authorized_users:
                 bot.answer_callback_query(call.id, "❌ Доступ запрещен")
                 return
 
-            filename = call.data.replace("delete_", "")
-            file_path = os.path.join("data", filename)
+            if call.data.startswith("del:"):
+                filename = file_registry.get(call.data[len("del:"):])
+            else:
+                # Кнопки из сообщений, отправленных до перехода на короткие id
+                filename = call.data.replace("delete_", "")
+                if filename not in file_registry:
+                    filename = None
 
             try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
+                if filename and os.path.exists(os.path.join(DATA_FOLDER, filename)):
+                    os.remove(os.path.join(DATA_FOLDER, filename))
+                    file_id_cache.drop(filename)
+                    file_registry.invalidate()
                     bot.answer_callback_query(call.id, f"✅ Файл {filename} удален")
+                    schedule_reindex(filename, call.message.chat.id)
 
                     # Обновляем список файлов
-                    files_markup = files_list_markup("delete")
                     bot.edit_message_reply_markup(call.message.chat.id,
                                                   call.message.message_id,
-                                                  reply_markup=files_markup)
+                                                  reply_markup=file_registry.markup("delete"))
                 else:
                     bot.answer_callback_query(call.id, "❌ Файл не найден")
             except Exception as e:
@@ -518,8 +815,10 @@ def check_click(call):
                 bot.answer_callback_query(call.id, "❌ Доступ запрещен")
                 return
 
-            users_list = f"👥 <b>Авторизованные пользователи ({len(authorized_users)}):</b>\n\n"
-            for user_id, user_data in authorized_users.items():
+            # В режиме webhook пользователей авторизуют и другие процессы
+            users = session_store.authorized_users()
+            users_list = f"👥 <b>Авторизованные пользователи ({len(users)}):</b>\n\n"
+            for user_id, user_data in users.items():
                 users_list += f"🆔 ID: {user_id}\n"
                 users_list += f"👤 Имя: {user_data.get('first_name', 'Unknown')}\n"
                 users_list += f"📛 Username: @{user_data.get('username', 'Unknown')}\n"
@@ -531,6 +830,40 @@ def check_click(call):
                                   parse_mode="HTML",
                                   reply_markup=admin_panel_markup())
 
+        elif call.data == "admin_cache_stats":
+            # Проверяем авторизацию
+            if str(call.message.chat.id) not in authorized_users:
+                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
+                return
+
+            stats = corpus_store.stats()
+            answers = answer_cache.stats()
+            stats_text = (f"📊 <b>Кэш извлеченного текста</b>\n\n"
+                          f"📁 Файлов в кэше: {stats['files']}\n"
+                          f"✅ Попаданий: {stats['hits']}\n"
+                          f"🔄 Промахов (парсинг): {stats['misses']}\n"
+                          f"📈 Доля попаданий: {stats['hit_ratio']:.0%}\n\n"
+                          f"💬 <b>Кэш ответов</b>\n\n"
+                          f"🗂 Ответов в кэше: {answers['entries']}\n"
+                          f"✅ Попаданий: {answers['hits']}\n"
+                          f"🤖 Промахов (генерация): {answers['misses']}\n"
+                          f"📈 Доля попаданий: {answers['hit_ratio']:.0%}")
+
+            timing = llm_timing.snapshot()
+            if timing["last"]:
+                last = timing["last"]
+                stats_text += (f"\n\n🧠 <b>Модель (последний ответ)</b>\n\n"
+                               f"📝 Разбор промпта: {last['prompt_tokens']} ток. за {last['prompt_eval']:.2f} с\n"
+                               f"✍️ Генерация: {last['eval_tokens']} ток. за {last['eval']:.2f} с\n"
+                               f"📦 Загрузка модели: {last['load']:.2f} с\n"
+                               f"🔢 Всего ответов: {timing['requests']}")
+
+            bot.edit_message_text(stats_text,
+                                  call.message.chat.id,
+                                  call.message.message_id,
+                                  parse_mode="HTML",
+                                  reply_markup=admin_panel_markup())
+
         elif call.data == "admin_back":
             bot.edit_message_text("Привет\nВыбери действие",
                                   call.message.chat.id,
@@ -549,12 +882,11 @@ def handle_admin_auth(message):
 
     if password_attempt == ADMIN_PASSWORD:
         # Авторизация успешна
-        authorized_users[str(chat_id)] = {
+        set_authorized_user(str(chat_id), {
             "username": message.from_user.username or "Unknown",
             "first_name": message.from_user.first_name or "Unknown",
             "auth_date": message.date
-        }
-        save_authorized_users(authorized_users)
+        })
 
         del admin_auth_sessions[chat_id]
         bot.send_message(chat_id, "✅ Авторизация успешна! Доступ к админ-панели разрешен.")
@@ -565,6 +897,49 @@ def handle_admin_auth(message):
         bot.send_message(chat_id, "❌ Неверный пароль. Попробуйте снова или нажмите /cancel для отмены.")
 
 
+def download_document(document, dest_path, max_bytes):
+    """Скачивает документ из Telegram кусками, не держа его целиком в памяти"""
+    if document.file_size and document.file_size > max_bytes:
+        raise UploadError(f"файл больше {max_bytes // (1024 * 1024)} МБ")
+    file_info = bot.get_file(document.file_id)
+    url = telegram_file_url(token, file_info.file_path, telebot.apihelper.FILE_URL)
+    return download(url, dest_path, max_bytes, proxies=telebot.apihelper.proxy)
+
+
+def upload_archive(message, archive_name):
+    """Загрузка пакета документов одним ZIP-архивом с общим сообщением о ходе работы"""
+    chat_id = message.chat.id
+    progress = ProgressMessage(bot, chat_id, f"📦 Скачиваю архив {archive_name}...",
+                               reply_to_message_id=message.message_id)
+    try:
+        with tempfile.TemporaryDirectory(prefix="upload-") as temp_dir:
+            archive_path = os.path.join(temp_dir, "archive.zip")
+            with metrics.span("upload_download"):
+                download_document(message.document, archive_path, UPLOAD_MAX_BYTES)
+            with metrics.span("upload_unzip"):
+                saved, skipped = extract_zip(
+                    archive_path, DATA_FOLDER, ZIP_MAX_FILE_BYTES, ZIP_MAX_TOTAL_BYTES,
+                    on_progress=lambda done, total: progress.update(f"📦 Распаковано {done} из {total}..."))
+    except Exception as e:
+        progress.finish(f"❌ Ошибка загрузки архива {archive_name}: {e}")
+        return
+
+    for name in saved:
+        file_id_cache.drop(name)
+    file_registry.invalidate()
+    report = f"📦 Из архива {archive_name} сохранено файлов: {len(saved)}"
+    if skipped:
+        report += f", пропущено: {len(skipped)}\n" + "\n".join(f"• {name}: {reason}" for name, reason in skipped[:10])
+        if len(skipped) > 10:
+            report += f"\n• ... и еще {len(skipped) - 10}"
+    if not saved:
+        progress.finish(report + "\n❌ В архиве нет файлов поддерживаемых форматов")
+        return
+    print(report)
+    progress.update(report + "\n🔎 Добавляю в базу знаний...")
+    schedule_reindex(saved, chat_id, progress=progress)
+
+
 # Обработчик загрузки файлов
 @bot.message_handler(content_types=['document'])
 def handle_document(message):
@@ -577,27 +952,27 @@ def handle_document(message):
             bot.reply_to(message, "❌ Доступ запрещен")
             return
 
-        # Проверяем формат файла
-        allowed_extensions = ['.txt', '.pdf', '.docx', '.rtf']
-        file_name = message.document.file_name
-        file_extension = os.path.splitext(file_name)[1].lower()
+        file_name = clean_filename(message.document.file_name or "")
+        if file_name and file_name.lower().endswith(".zip"):
+            upload_archive(message, file_name)
+            return
 
-        if file_extension not in allowed_extensions:
+        # Проверяем формат файла
+        if not file_name or not is_allowed(file_name):
+            file_extension = os.path.splitext(file_name or "")[1].lower()
             bot.reply_to(message, f"❌ Неподдерживаемый формат файла: {file_extension}\n"
-                                  f"Разрешенные форматы: {', '.join(allowed_extensions)}")
+                                  f"Разрешенные форматы: {', '.join(ALLOWED_EXTENSIONS + ('.zip',))}")
             return
 
         try:
-            # Скачиваем файл
-            file_info = bot.get_file(message.document.file_id)
-            downloaded_file = bot.download_file(file_info.file_path)
-
-            # Сохраняем в папку data
-            save_path = os.path.join("data", file_name)
-            with open(save_path, 'wb') as new_file:
-                new_file.write(downloaded_file)
+            # Скачиваем файл потоком прямо в папку data (через временный файл)
+            with metrics.span("upload_download"):
+                download_document(message.document, os.path.join(DATA_FOLDER, file_name), UPLOAD_MAX_BYTES)
+            file_id_cache.drop(file_name)
+            file_registry.invalidate()
 
-            bot.reply_to(message, f"✅ Файл {file_name} успешно загружен в папку data")
+            bot.reply_to(message, f"✅ Файл {file_name} успешно загружен в папку data, добавляю в базу знаний...")
+            schedule_reindex(file_name, chat_id)
 
         except Exception as e:
             bot.reply_to(message, f"❌ Ошибка загрузки файла: {str(e)}")
@@ -624,20 +999,15 @@ def handle_voice_message(message):
         file_info = bot.get_file(message.voice.file_id)
         downloaded_file = bot.download_file(file_info.file_path)
 
-        # Сохраняем временный файл
-        voice_file_path = f"temp_voice_{chat_id}.ogg"
-        with open(voice_file_path, 'wb') as f:
-            f.write(downloaded_file)
-
-        # Конвертируем в текст
-        recognized_text = convert_voice_to_text(voice_file_path)
+        # Конвертируем в текст прямо из памяти
+        recognized_text = convert_voice_to_text(downloaded_file)
 
         if recognized_text:
             # Отправляем распознанный текст пользователю
             bot.reply_to(message, f"🎤 <b>Распознано:</b> {recognized_text}", parse_mode="HTML")
 
             # Обрабатываем распознанный текст как обычное сообщение
-            process_ai_question(chat_id, recognized_text, message)
+            return process_ai_question(chat_id, recognized_text, message)
         else:
             bot.reply_to(message, "❌ Не удалось распознать речь. Попробуйте еще раз или напишите текст.")
 
@@ -668,8 +1038,7 @@ def cancel_operation(message):
 def logout_user(message):
     chat_id = str(message.chat.id)
     if chat_id in authorized_users:
-        del authorized_users[chat_id]
-        save_authorized_users(authorized_users)
+        set_authorized_user(chat_id, None)
         bot.reply_to(message, "✅ Вы вышли из админ-панели")
     else:
         bot.reply_to(message, "❌ Вы не авторизованы")
@@ -714,31 +1083,141 @@ def id_your_chat(message):
 
 
 # AI система
-active_ai_chats = {}
-user_contexts = {}
+active_ai_chats = ChatFlags(session_store, "ai")
+
+
+def forget_idle_chat(chat_id):
+    """Отключает AI-режим чата, контекст которого удален по времени простоя"""
+    active_ai_chats.pop(chat_id, None)
+    chat_corpus_versions.pop(chat_id, None)
+
+
+# История каждого чата ограничена бюджетом токенов, простаивающие чаты удаляются
+user_contexts = ChatContexts(token_budget=HISTORY_TOKEN_BUDGET, idle_ttl=CHAT_IDLE_TTL,
+                             on_evict=forget_idle_chat, on_change=session_store.save_chat)
+
+
+def restore_sessions(owns=None):
+    """Возвращает AI-режим, историю диалогов и состояния меню после перезапуска.
+
+    Системное сообщение не хранится: оно строится из текущей базы знаний
+    при первом вопросе чата. owns(chat_id) отбирает чаты этого процесса.
+    """
+    active_ai_chats.restore(owns)
+    file_upload_sessions.restore(owns)
+    admin_auth_sessions.restore(owns)
+    chats = session_store.load_chats(owns)
+    for chat_id, record in chats.items():
+        if chat_id in active_ai_chats:
+            user_contexts.restore(chat_id, record, None)
+        else:
+            session_store.save_chat(chat_id, None)
+    # Чаты, простоявшие дольше CHAT_IDLE_TTL, удаляются вместе с AI-режимом
+    user_contexts.evict_idle()
+    if chats:
+        print(f"💬 Восстановлено AI-чатов: {len(user_contexts)}")
+
+
+def corpus_size(attribute):
+    corpus = corpus_holder.get()
+    if corpus is None:
+        return 0
+    return len(corpus) if attribute == "files" else corpus.index.chunk_count
+
+
+# Текущие значения для метрик: очереди, активные чаты и доли попаданий в кэши
+metrics.gauge("bot_llm_queue_depth", "Вопросы, ожидающие модель", llm_gate.depth)
+metrics.gauge("bot_llm_active", "Генерации в работе", lambda: llm_gate.active)
+metrics.gauge("bot_update_queue_depth", "Обновления, ожидающие в очередях чатов", bot.scheduler.pending)
+metrics.gauge("bot_active_ai_chats", "Чаты в AI-режиме", lambda: len(active_ai_chats))
+metrics.gauge("bot_corpus_files", "Файлы в базе знаний", lambda: corpus_size("files"))
+metrics.gauge("bot_corpus_chunks", "Фрагменты в индексе", lambda: corpus_size("chunks"))
+metrics.gauge("bot_corpus_cache_hit_ratio", "Доля попаданий в кэш текста файлов",
+              lambda: corpus_store.stats()["hit_ratio"])
+metrics.gauge("bot_answer_cache_hit_ratio", "Доля попаданий в кэш ответов",
+              lambda: answer_cache.stats()["hit_ratio"])
+metrics.gauge("bot_file_id_cache_hit_ratio", "Доля отправок документа по file_id",
+              lambda: file_id_cache.stats()["hit_ratio"])
+metrics.gauge("bot_embedding_rows", "Строки матрицы эмбеддингов",
+              lambda: len(embedding_index.ids) if embedding_index is not None else 0)
+metrics.gauge("bot_ready", "Бот прогрет и отвечает на вопросы", lambda: int(bot_ready.is_set()))
+metrics.gauge("bot_session_pending_writes", "Изменения сессий, ожидающие записи в базу",
+              lambda: session_store.stats()["pending"])
+
+
+def warm_up_in_background():
+    """Прогрев после запуска: модель распознавания, база знаний с индексом и модель ollama.
+
+    Обновления принимаются сразу, до готовности /ai отвечает, что бот прогревается.
+    """
+    global embedding_index
+    started = time.monotonic()
+    speech_service.warm_up()
+    try:
+        if EMBEDDINGS_ENABLED:
+            embedding_index = create_embedding_index()
+        # Публикация снимка ставит в очередь прогрев модели и расчет эмбеддингов
+        corpus = get_corpus()
+    except Exception as e:
+        # /ai попробует загрузить базу знаний сам
+        print(f"Ошибка прогрева: {e}")
+        bot_ready.set()
+        return
+    bot_ready.set()
+    print(f"✅ Бот готов за {time.monotonic() - started:.1f} с: {len(corpus)} файлов, "
+          f"{corpus.index.chunk_count} фрагментов")
+
+
+def warming_up(chat_id):
+    """Пока база знаний загружается после запуска, сообщает об этом в чат и возвращает True"""
+    if bot_ready.is_set():
+        return False
+    bot.send_message(chat_id, "🔥 Бот прогревается и загружает базу знаний. Попробуйте через минуту.")
+    return True
+
+
+def warm_up_leader():
+    """Ведущий процесс webhook: разбирает файлы и пишет эмбеддинги в общие кэши"""
+    global embedding_index
+    started = time.monotonic()
+    if EMBEDDINGS_ENABLED:
+        embedding_index = create_embedding_index()
+    corpus = get_corpus()
+    # Тексты, индекс и пункты обработчики отображают в память из общего файла
+    write_snapshot(SHARED_SNAPSHOT_DIR, corpus)
+    print(f"✅ База знаний готова за {time.monotonic() - started:.1f} с: {len(corpus)} файлов, "
+          f"{corpus.index.chunk_count} фрагментов")
+
+
+def start_ai_session(chat_id, corpus):
+    """Включает AI-режим чата на указанном снимке базы знаний"""
+    user_contexts.start(chat_id, get_system_prompt(corpus))
+    active_ai_chats[chat_id] = True
+    chat_corpus_versions[chat_id] = corpus.version
 
 
 @bot.message_handler(commands=["ai", "Ai", "AI"])
 def activate_ai_chat(message):
     chat_id = message.chat.id
 
-    bot.send_message(chat_id, "🔄 Загружаю данные из папки data...")
-    loaded_data, file_contents = load_all_data_with_sources()
-    file_count = len(glob.glob(os.path.join("data", "*")))
+    # Не блокируем обработчик, пока база знаний загружается после запуска
+    if warming_up(chat_id):
+        return
+
+    if corpus_holder.get() is None:
+        bot.send_message(chat_id, "🔄 Загружаю данные из папки data...")
+    corpus = get_corpus()
 
-    if not loaded_data:
+    if not corpus.total_chars:
         bot.send_message(chat_id, "❌ В папке data нет файлов или произошла ошибка загрузки")
         return
 
-    system_prompt = get_system_prompt(loaded_data, file_contents)
-    user_contexts[chat_id] = [system_prompt]
-    active_ai_chats[chat_id] = True
-    file_contents_cache[chat_id] = file_contents
+    start_ai_session(chat_id, corpus)
 
     welcome_msg = f"""🤖 <b>AI-режим активирован</b>
 
-📊 База знаний: {file_count} файлов из папки data
-💾 Загружено {len(loaded_data)} символов данных
+📊 База знаний: {len(corpus)} файлов из папки data
+💾 Загружено {corpus.total_chars} символов данных
 📝 Отвечаю только на основе предоставленных данных
 🔍 В ответах указываю источники информации [Источник: файл.расширение]
 🎤 Поддерживаются голосовые сообщения
@@ -754,15 +1233,20 @@ def activate_ai_chat(message):
 def reload_data(message):
     chat_id = message.chat.id
     bot.send_message(chat_id, "🔄 Перезагружаю данные из папки data...")
-    loaded_data, file_contents = load_all_data_with_sources()
-    file_count = len(glob.glob(os.path.join("data", "*")))
+    # Файлы могли положить в data вручную
+    file_registry.invalidate()
+    if notify_corpus_changed is not None:
+        # Перезагрузку выполнят ведущий процесс и все обработчики, ответ придет после нее
+        pending_reindex_chats[None] = (chat_id, None)
+        notify_corpus_changed(None)
+        return
+    # Новый снимок становится общим, остальные чаты подхватят его при следующем вопросе
+    corpus = reload_corpus()
 
     if chat_id in active_ai_chats:
-        system_prompt = get_system_prompt(loaded_data, file_contents)
-        user_contexts[chat_id] = [system_prompt]
-        file_contents_cache[chat_id] = file_contents
+        start_ai_session(chat_id, corpus)
 
-    bot.reply_to(message, f"✅ Данные перезагружены! Загружено {file_count} файлов, {len(loaded_data)} символов")
+    bot.reply_to(message, f"✅ Данные перезагружены! Загружено {len(corpus)} файлов, {corpus.total_chars} символов")
 
 
 @bot.message_handler(commands=["stop"])
@@ -770,19 +1254,44 @@ def deactivate_ai_chat(message):
     chat_id = message.chat.id
     if chat_id in active_ai_chats:
         del active_ai_chats[chat_id]
-    if chat_id in user_contexts:
-        del user_contexts[chat_id]
-    if chat_id in file_contents_cache:
-        del file_contents_cache[chat_id]
+    user_contexts.drop(chat_id)
+    chat_corpus_versions.pop(chat_id, None)
     bot.reply_to(message, "🛑 AI-режим отключен. Контекст очищен.")
 
 
 def process_ai_question(chat_id, question_text, original_message=None):
     """Обрабатывает вопрос для AI (общая функция для текста и голоса)"""
+    # AI-режим мог быть восстановлен из базы сессий, а база знаний еще загружается
+    if warming_up(chat_id):
+        return
+    corpus = get_corpus()
+
+    # Если база знаний обновилась, переводим чат на новый снимок без сброса диалога
+    if chat_corpus_versions.get(chat_id) != corpus.version:
+        user_contexts.set_system(chat_id, get_system_prompt(corpus))
+        chat_corpus_versions[chat_id] = corpus.version
+
+    # "Что сказано в пункте 45 приказа 782н" - отвечаем текстом пункта без модели
+    with metrics.span("clause_lookup"):
+        clause_answer = answer_clause_question(question_text, corpus)
+    if clause_answer is not None:
+        metrics.inc("bot_answers_total", "Ответы на вопросы", source="clause")
+        user_contexts.add_turn(chat_id, {"role": "user", "content": question_text},
+                               {"role": "assistant", "content": clause_answer})
+        StreamingReply(bot, chat_id,
+                       reply_to_message_id=original_message.message_id if original_message else None).finish(clause_answer)
+        return
+
+    # Ищем фрагменты документов, они же используются для проверки релевантности
+    with metrics.span("retrieval"):
+        passages = search_passages(question_text, corpus)
+
     # Проверяем релевантность вопроса
-    if chat_id in file_contents_cache:
-        if not is_question_relevant(question_text, file_contents_cache[chat_id]):
-            warning_msg = """
+    with metrics.span("relevance"):
+        relevant = is_question_relevant(question_text, corpus, passages)
+    if not relevant:
+        metrics.inc("bot_answers_total", "Ответы на вопросы", source="irrelevant")
+        warning_msg = """
 ⚠️ <b>Вопрос не относится к предоставленным данным</b>
 
 Я могу отвечать только на вопросы, связанные с информацией из загруженных файлов в папке data.
@@ -792,42 +1301,111 @@ def process_ai_question(chat_id, question_text, original_message=None):
 • Какая информация есть о Y?
 • Расскажи о Z из документов
 """
-            if original_message:
-                bot.reply_to(original_message, warning_msg, parse_mode="HTML")
-            else:
-                bot.send_message(chat_id, warning_msg, parse_mode="HTML")
-            return
+        if original_message:
+            bot.reply_to(original_message, warning_msg, parse_mode="HTML")
+        else:
+            bot.send_message(chat_id, warning_msg, parse_mode="HTML")
+        return
 
-    user_contexts[chat_id].append({"role": "user", "content": question_text})
-    bot.send_chat_action(chat_id, 'typing')
+    with metrics.span("prompt_build"):
+        context_message = build_context_message([chunk for _, chunk, _ in passages], max_chars=MAX_CONTEXT_CHARS)
 
-    try:
-        response = ollama.chat(
-            model=MODEL_NAME,
-            messages=user_contexts[chat_id],
-        )
+    # В истории сохраняем только сам вопрос, фрагменты передаем один раз
+    question_message = {"role": "user", "content": question_text}
 
-        ai_response = response['message']['content']
-        user_contexts[chat_id].append({"role": "assistant", "content": ai_response})
+    # Повторный вопрос к той же версии базы знаний отвечаем из кэша без генерации
+    cache_key = make_answer_key(question_text, [chunk["id"] for _, chunk, _ in passages], corpus.version)
+    cached_answer = answer_cache.get(cache_key)
+    if cached_answer is not None:
+        metrics.inc("bot_answers_total", "Ответы на вопросы", source="cache")
+        user_contexts.add_turn(chat_id, question_message, {"role": "assistant", "content": cached_answer})
+        StreamingReply(bot, chat_id,
+                       reply_to_message_id=original_message.message_id if original_message else None).finish(cached_answer)
+        return
 
-        # Добавляем информацию об источниках, если их нет в ответе
-        if chat_id in file_contents_cache and file_contents_cache[chat_id]:
-            files_mentioned = any(filename in ai_response for filename in file_contents_cache[chat_id].keys())
-            if not files_mentioned and "источник" not in ai_response.lower():
-                ai_response += "\n\n📚 <i>Информация взята из предоставленных документов</i>"
+    with metrics.span("prompt_build"):
+        messages = user_contexts.messages(chat_id) + [context_message, question_message]
 
-        if original_message:
-            bot.reply_to(original_message, f"🤖 {ai_response}")
-        else:
-            bot.send_message(chat_id, f"🤖 {ai_response}")
+    def notify_queued(position):
+        bot.send_message(chat_id, f"⏳ Вы #{position} в очереди к AI-помощнику, ответ скоро начнется")
 
-    except Exception as e:
-        print(f"AI Error: {e}")
-        error_msg = "⚠️ Ошибка генерации. Попробуйте позже."
+    def generate():
+        try:
+            with metrics.span("llm_generate"):
+                bot.send_chat_action(chat_id, 'typing')
+                if STREAM_RESPONSES:
+                    # Показываем ответ по мере генерации, редактируя одно сообщение
+                    reply = StreamingReply(bot, chat_id,
+                                           reply_to_message_id=original_message.message_id if original_message else None,
+                                           min_tokens=STREAM_EDIT_TOKENS, interval=STREAM_EDIT_INTERVAL)
+                    ai_response = ""
+                    for part in llm_client.stream_chat(messages):
+                        token = part['message']['content']
+                        ai_response += token
+                        reply.push(token)
+                        if part.get('done'):
+                            llm_timing.record(part)
+                else:
+                    response = llm_client.chat(messages)
+                    ai_response = response['message']['content']
+                    llm_timing.record(response)
+
+            metrics.inc("bot_answers_total", "Ответы на вопросы", source="model")
+            user_contexts.add_turn(chat_id, question_message, {"role": "assistant", "content": ai_response})
+
+            # Добавляем информацию об источниках, если их нет в ответе
+            if corpus.file_contents:
+                files_mentioned = any(filename in ai_response for filename in corpus.file_contents.keys())
+                if not files_mentioned and "источник" not in ai_response.lower():
+                    ai_response += "\n\n📚 <i>Информация взята из предоставленных документов</i>"
+
+            answer_cache.put(cache_key, ai_response, corpus.version)
+
+            if STREAM_RESPONSES:
+                reply.finish(ai_response)
+            elif original_message:
+                bot.reply_to(original_message, f"🤖 {ai_response}")
+            else:
+                bot.send_message(chat_id, f"🤖 {ai_response}")
+
+        except LLMTimeout as e:
+            print(f"AI Timeout: {e}")
+            metrics.inc("bot_answers_total", "Ответы на вопросы", source="timeout")
+            timeout_msg = "⌛ AI-помощник не успел ответить. Попробуйте задать вопрос короче или позже."
+            if original_message:
+                bot.reply_to(original_message, timeout_msg)
+            else:
+                bot.send_message(chat_id, timeout_msg)
+
+        except LLMUnavailable as e:
+            print(f"AI Unavailable: {e}")
+            metrics.inc("bot_answers_total", "Ответы на вопросы", source="unavailable")
+            unavailable_msg = "🔌 AI-помощник временно недоступен. Попробуйте через пару минут."
+            if original_message:
+                bot.reply_to(original_message, unavailable_msg)
+            else:
+                bot.send_message(chat_id, unavailable_msg)
+
+        except Exception as e:
+            print(f"AI Error: {e}")
+            metrics.inc("bot_answers_total", "Ответы на вопросы", source="error")
+            error_msg = "⚠️ Ошибка генерации. Попробуйте позже."
+            if original_message:
+                bot.reply_to(original_message, error_msg)
+            else:
+                bot.send_message(chat_id, error_msg)
+
+    # Генерация идет в пуле модели: поток чата освобождается, следующие
+    # сообщения этого чата ждут ответа (см. ChatScheduler), остальные чаты - нет
+    try:
+        return llm_gate.submit(generate, on_queued=notify_queued)
+    except LLMQueueFull:
+        metrics.inc("bot_answers_total", "Ответы на вопросы", source="queue_full")
+        busy_msg = "⏳ Сейчас слишком много вопросов к AI-помощнику. Попробуйте через минуту."
         if original_message:
-            bot.reply_to(original_message, error_msg)
+            bot.reply_to(original_message, busy_msg)
         else:
-            bot.send_message(chat_id, error_msg)
+            bot.send_message(chat_id, busy_msg)
 
 
 @bot.message_handler(func=lambda msg: True)
@@ -842,28 +1420,107 @@ def handle_text(message):
         return
 
     # Обрабатываем текстовый вопрос
-    process_ai_question(chat_id, message.text, message)
+    return process_ai_question(chat_id, message.text, message)
+
+
+def worker_cache_path(path, index):
+    """Отдельный файл кэша для процесса-обработчика: answers.json -> answers.2.json"""
+    if not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{index}{ext}"
+
+
+def run_webhook_worker(index, count, updates, events):
+    """Процесс-обработчик режима webhook: получает обновления своих чатов из очереди.
+
+    Определен в main.py, чтобы процесс, запущенный через spawn, не импортировал
+    модуль повторно. Снимок базы знаний (тексты, BM25-индекс, пункты) и матрица
+    эмбеддингов отображаются в память из файлов ведущего процесса.
+    """
+    global corpus_leader, notify_corpus_changed, corpus_store, answer_cache, file_id_cache
+    corpus_leader = False
+    notify_corpus_changed = lambda filenames: events.put((index, filenames))
+    corpus_store = CorpusStore(CORPUS_CACHE_DIR, parser_version=PARSER_VERSION, read_only=True)
+    answer_cache = AnswerCache(max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+                               path=worker_cache_path(ANSWER_CACHE_FILE, index))
+    file_id_cache = FileIdCache(worker_cache_path(FILE_ID_CACHE_FILE, index))
+    from webhook import worker_for
+
+    restore_sessions(owns=lambda chat_id: worker_for(chat_id, count) == index)
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT + 1 + index, METRICS_HOST)
+    print(f"🤖 Обработчик {index + 1}/{count} запущен (pid {os.getpid()})")
+
+    deferred = []  # Изменения базы знаний, пришедшие до сигнала готовности ведущего процесса
+
+    def warm_up(changes):
+        warm_up_in_background()
+        for filenames in changes:
+            apply_corpus_change(filenames)
+
+    while True:
+        item = updates.get()
+        if item is None:
+            break
+        if isinstance(item, tuple):
+            if item[0] == "ready":
+                # Ведущий процесс заполнил кэши - до этого обработчик отвечает, что бот прогревается
+                if deferred is not None:
+                    threading.Thread(target=warm_up, args=(deferred,), name="warm-up", daemon=True).start()
+                    deferred = None
+            elif deferred is not None:
+                deferred.append(item[1])
+            else:
+                apply_corpus_change(item[1])
+            continue
+        try:
+            update = t.Update.de_json(item.decode("utf-8"))
+            bot.process_new_updates([update])
+        except Exception as e:
+            print(f"Ошибка обработки обновления: {e}")
+    session_store.close()
 
 
 if __name__ == "__main__":
     # Устанавливаем зависимости для обработки голоса
     print("🔧 Проверка зависимостей для обработки голосовых сообщений...")
-    try:
-        import speech_recognition as sr
-        from pydub import AudioSegment
-
+    # Проверяем без импорта: сама библиотека загрузится при первом голосовом сообщении
+    if has_av():
         print("✅ Все зависимости установлены")
-    except ImportError as e:
-        print(f"❌ Не установлены зависимости для обработки голоса: {e}")
-        print("Установите их командой: pip install SpeechRecognition pydub")
+    else:
+        if shutil.which("ffmpeg"):
+            print("✅ PyAV не установлен, голос будет декодироваться через ffmpeg")
+        else:
+            print("❌ Не установлены зависимости для обработки голоса")
+            print("Установите их командой: pip install av (или установите ffmpeg)")
 
     # Создаем папку data если не существует
     if not os.path.exists("data"):
         os.makedirs("data")
         print("Создана папка data")
 
+    print(f"🎤 Движок распознавания речи: {ASR_ENGINE}")
+
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT, METRICS_HOST)
+        print(f"📈 Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
     print("🤖 Бот запущен...")
     print(f"👥 Авторизованных пользователей: {len(authorized_users)}")
-    print("💾 Данные будут загружаться при активации AI-режима")
-    print("🎤 Обработка голосовых сообщений активна")
-    bot.polling(non_stop=True)
\ No newline at end of file
+    print("💾 База знаний загружается в фоне")
+
+    if WEBHOOK_URL:
+        from webhook import run_webhook
+
+        # Обновления принимаются сразу; ведущий процесс разбирает файлы и пишет эмбеддинги в фоне,
+        # обработчики загружают базу знаний из готовых кэшей после его сигнала
+        run_webhook(bot, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_WORKERS,
+                    run_webhook_worker, leader_corpus_change, secret_token=WEBHOOK_SECRET,
+                    prepare=warm_up_leader)
+    else:
+        restore_sessions()
+        # Бот принимает обновления сразу, база знаний и модели прогреваются параллельно
+        threading.Thread(target=warm_up_in_background, name="warm-up", daemon=True).start()
+        print("🎤 Обработка голосовых сообщений активна")
+        bot.polling(non_stop=True)
@@ -0,0 +1,138 @@
+"""Метрики бота в формате Prometheus: интервалы времени, счетчики и текущие значения"""
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_lock = threading.Lock()
+_spans = {}  # имя интервала -> [счетчики по корзинам, сумма, количество]
+_counters = {}  # (имя, метки) -> значение
+_counter_help = {}
+_gauges = {}  # имя -> (описание, функция)
+
+
+def observe(name, seconds):
+    """Записывает длительность интервала name в гистограмму"""
+    with _lock:
+        histogram = _spans.get(name)
+        if histogram is None:
+            histogram = _spans[name] = [[0] * len(BUCKETS), 0.0, 0]
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            histogram[0][index] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+
+@contextmanager
+def span(name):
+    """Замеряет время блока; исключения считаются в bot_span_errors_total"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc("bot_span_errors_total", "Интервалы, завершившиеся исключением", span=name)
+        raise
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def timed(name):
+    """Декоратор: замеряет время каждого вызова функции как интервал name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def inc(name, help_text="", amount=1, **labels):
+    """Увеличивает счетчик name с метками labels"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+        if help_text:
+            _counter_help.setdefault(name, help_text)
+
+
+def gauge(name, help_text, func):
+    """Регистрирует текущее значение, которое вычисляется при каждом запросе метрик"""
+    with _lock:
+        _gauges[name] = (help_text, func)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def render():
+    """Текст метрик в формате Prometheus"""
+    with _lock:
+        spans = {name: (list(buckets), total, count) for name, (buckets, total, count) in _spans.items()}
+        counters = dict(_counters)
+        counter_help = dict(_counter_help)
+        gauges = dict(_gauges)
+
+    lines = ["# HELP bot_span_seconds Длительность операций бота",
+             "# TYPE bot_span_seconds histogram"]
+    for name in sorted(spans):
+        buckets, total, count = spans[name]
+        cumulative = 0
+        for bound, value in zip(BUCKETS, buckets):
+            cumulative += value
+            lines.append(f'bot_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'bot_span_seconds_bucket{{span="{name}",le="+Inf"}} {count}')
+        lines.append(f'bot_span_seconds_sum{{span="{name}"}} {total:.6f}')
+        lines.append(f'bot_span_seconds_count{{span="{name}"}} {count}')
+
+    for name in sorted({name for name, _ in counters}):
+        if name in counter_help:
+            lines.append(f"# HELP {name} {counter_help[name]}")
+        lines.append(f"# TYPE {name} counter")
+        for (counter_name, labels), value in sorted(counters.items()):
+            if counter_name == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for name in sorted(gauges):
+        help_text, func = gauges[name]
+        try:
+            value = func()
+        except Exception as e:
+            print(f"Ошибка вычисления метрики {name}: {e}")
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    """Запускает HTTP-сервер метрик (GET /metrics) в фоновом потоке"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,301 @@
+"""Разбиение документов на фрагменты и поиск наиболее релевантных из них"""
+import hashlib
+import heapq
+import math
+import re
+from functools import cached_property
+
+from russian_stemmer import stem
+
+CHUNK_SIZE = 1500  # Целевой размер фрагмента в символах
+CHUNK_OVERLAP = 200  # Перекрытие при разрезании слишком длинных пунктов
+PAGE_SEPARATOR = "\f"  # Разделитель страниц в извлеченном тексте PDF
+
+# Заголовки разделов: "I. Общие положения", "Глава 2", "Раздел III", "Приложение N 1"
+SECTION_RE = re.compile(r'^\s*(?:[IVXLC]+\.\s+\S|(?:Глава|Раздел|Приложение)\b)', re.IGNORECASE)
+# Нумерованные пункты: "45. ...", "12.3. ..."
+CLAUSE_RE = re.compile(r'^\s*(\d{1,4}(?:\.\d{1,3})*)\.\s+\S')
+TOKEN_RE = re.compile(r'\w+')
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Служебные слова, не несущие смысла для поиска
+STOP_WORDS = frozenset("""
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы где да даже для до его
+ее ей ему если есть еще же за здесь и из или им их к как какая какие какой когда кто ли либо мне может
+мы на над надо не него нее нет ни них но ну о об однако он она они оно от очень по под при про с со так
+также такой там те тем то того тоже той только том ты у уже хотя чего чей чем что чтобы чье чья эта эти
+это этого этой этом я расскажи скажи напиши подскажи какое каков нужно нужны нужен можно ли
+себе себя такое будет сказано сказать говорится
+""".split())
+
+
+def bm25_idf(chunk_count, df):
+    return math.log(1 + (chunk_count - df + 0.5) / (df + 0.5))
+
+
+def tokenize(text):
+    """Разбивает текст на слова в нижнем регистре"""
+    return TOKEN_RE.findall(text.lower().replace("ё", "е"))
+
+
+def analyze(text):
+    """Возвращает основы значимых слов текста для индексации и поиска"""
+    return [stem(word) for word in tokenize(text)
+            if word not in STOP_WORDS and (len(word) > 1 or word.isdigit())]
+
+
+def _iter_units(text):
+    """Делит текст на смысловые единицы (заголовок или пункт) с метаданными"""
+    section = None
+    unit = None
+    pages = text.split(PAGE_SEPARATOR)
+    paged = len(pages) > 1
+
+    for page_no, page_text in enumerate(pages, 1):
+        for line in page_text.splitlines():
+            if not line.strip():
+                continue
+            is_section = bool(SECTION_RE.match(line)) and len(line) < 200
+            clause_match = CLAUSE_RE.match(line)
+            if is_section or clause_match:
+                if unit:
+                    yield unit
+                if is_section:
+                    section = line.strip()
+                unit = {
+                    "page": page_no if paged else None,
+                    "section": section,
+                    "clause": clause_match.group(1) if clause_match and not is_section else None,
+                    "new_section": is_section,
+                    "lines": [line.strip()],
+                }
+            elif unit is None:
+                unit = {"page": page_no if paged else None, "section": section,
+                        "clause": None, "new_section": False, "lines": [line.strip()]}
+            else:
+                unit["lines"].append(line.strip())
+    if unit:
+        yield unit
+
+
+def _split_long(text):
+    """Режет слишком длинный текст на куски с перекрытием"""
+    step = CHUNK_SIZE - CHUNK_OVERLAP
+    return [text[start:start + CHUNK_SIZE] for start in range(0, len(text), step)]
+
+
+def chunk_document(filename, text):
+    """Разбивает документ на фрагменты с учетом разделов и пунктов"""
+    chunks = []
+    current = None
+
+    def flush():
+        if current and current["text"].strip():
+            chunks.append(current)
+
+    for unit in _iter_units(text):
+        unit_text = "\n".join(unit["lines"])
+        if current and (unit["new_section"] or len(current["text"]) + len(unit_text) > CHUNK_SIZE):
+            flush()
+            current = None
+
+        if len(unit_text) > CHUNK_SIZE:
+            for piece in _split_long(unit_text):
+                chunks.append({"file": filename, "page": unit["page"], "section": unit["section"],
+                               "clause": unit["clause"], "text": piece})
+            continue
+
+        if current is None:
+            current = {"file": filename, "page": unit["page"], "section": unit["section"],
+                       "clause": unit["clause"], "text": unit_text}
+        else:
+            current["text"] += "\n" + unit_text
+            if current["clause"] is None:
+                current["clause"] = unit["clause"]
+    flush()
+    for chunk in chunks:
+        chunk["id"] = chunk_id(chunk)
+    return chunks
+
+
+def chunk_id(chunk):
+    """Устойчивый идентификатор фрагмента: хэш имени файла и текста"""
+    return hashlib.sha1(f"{chunk['file']}\0{chunk['text']}".encode("utf-8")).hexdigest()[:16]
+
+
+def format_source(chunk):
+    """Формирует строку источника для фрагмента"""
+    parts = [chunk["file"]]
+    if chunk.get("page"):
+        parts.append(f"стр. {chunk['page']}")
+    if chunk.get("clause"):
+        parts.append(f"п. {chunk['clause']}")
+    return ", ".join(parts)
+
+
+class Segment:
+    """Неизменяемый сегмент индекса с фрагментами одного файла"""
+
+    def __init__(self, filename, chunks):
+        self.filename = filename
+        self.chunks = chunks
+        self.doc_lengths = []
+        self.postings = {}
+        for local_id, chunk in enumerate(chunks):
+            terms = analyze(chunk["text"])
+            self.doc_lengths.append(len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[local_id] = tf
+        self.total_length = sum(self.doc_lengths)
+
+
+class SearchIndex:
+    """Инвертированный BM25-индекс, состоящий из сегментов по файлам.
+
+    Индекс не изменяется после создания: добавление или удаление файла
+    создает новый индекс, переиспользующий сегменты остальных файлов.
+    """
+
+    def __init__(self, segments):
+        self.segments = tuple(segments)
+        self.chunk_count = sum(len(segment.chunks) for segment in self.segments)
+        total_length = sum(segment.total_length for segment in self.segments)
+        self.avg_length = total_length / self.chunk_count if self.chunk_count else 0.0
+        self.doc_freq = {}
+        for segment in self.segments:
+            for term, postings in segment.postings.items():
+                self.doc_freq[term] = self.doc_freq.get(term, 0) + len(postings)
+
+    @cached_property
+    def chunks(self):
+        """Все фрагменты индекса; список строится один раз, индекс не изменяется"""
+        return [chunk for segment in self.segments for chunk in segment.chunks]
+
+    def with_segment(self, segment):
+        """Новый индекс с добавленным (или замененным) сегментом файла"""
+        others = [s for s in self.segments if s.filename != segment.filename]
+        return SearchIndex(others + [segment])
+
+    def without_file(self, filename):
+        """Новый индекс без сегмента указанного файла"""
+        return SearchIndex([s for s in self.segments if s.filename != filename])
+
+    def idf(self, term):
+        return bm25_idf(self.chunk_count, self.doc_freq.get(term, 0))
+
+    def coverage(self, query, chunk):
+        """Доля значимых слов запроса (с весами idf), найденных во фрагменте.
+
+        Слова, которых нет в документах, получают наибольший вес, поэтому
+        одно общее слово ("дела", "стоит") не делает вопрос релевантным.
+        """
+        terms = set(analyze(query))
+        if not terms:
+            return 0.0
+        chunk_terms = set(analyze(chunk["text"]))
+        total = sum(self.idf(term) for term in terms)
+        return sum(self.idf(term) for term in terms if term in chunk_terms) / total
+
+    def search(self, query, k=5):
+        """Возвращает до k пар (оценка BM25, фрагмент) по убыванию оценки"""
+        if not self.chunk_count:
+            return []
+        terms = [term for term in set(analyze(query)) if term in self.doc_freq]
+        scored = []
+        for segment in self.segments:
+            scores = {}
+            for term in terms:
+                postings = segment.postings.get(term)
+                if not postings:
+                    continue
+                idf = self.idf(term)
+                for local_id, tf in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * segment.doc_lengths[local_id] / self.avg_length)
+                    scores[local_id] = scores.get(local_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+            for local_id, score in scores.items():
+                scored.append((score, segment.chunks[local_id]))
+        return heapq.nlargest(k, scored, key=lambda item: item[0])
+
+
+def build_segment(filename, text):
+    """Строит сегмент индекса для одного файла"""
+    return Segment(filename, chunk_document(filename, text))
+
+
+def update_index(index, file_contents, changed=()):
+    """Новый индекс для file_contents: сегменты неизмененных файлов берутся из index"""
+    old_segments = {segment.filename: segment for segment in index.segments}
+    segments = []
+    for filename, text in file_contents.items():
+        if filename in old_segments and filename not in changed:
+            segments.append(old_segments[filename])
+        else:
+            segments.append(build_segment(filename, text))
+    return SearchIndex(segments)
+
+
+def build_index(file_contents):
+    """Строит индекс фрагментов по словарю {имя файла: текст}"""
+    return SearchIndex([build_segment(filename, text) for filename, text in file_contents.items()])
+
+
+def is_relevant(index, query, hits, min_score, min_coverage, min_similarity=None):
+    """Вопрос относится к документам, если среди найденных фрагментов есть
+    фрагмент с оценкой не ниже min_score, покрывающий не меньше min_coverage запроса.
+
+    hits - тройки (оценка, фрагмент, близость) из hybrid_merge или пары из search.
+    Фрагмент с близостью не ниже min_similarity проходит без проверки покрытия:
+    пересказ вопроса может не иметь общих слов с документом.
+    """
+    for score, chunk, *similarity in hits:
+        if min_similarity is not None and similarity and similarity[0] >= min_similarity:
+            return True
+        if score >= min_score and index.coverage(query, chunk) >= min_coverage:
+            return True
+    return False
+
+
+def build_context_message(chunks, max_chars=6000):
+    """Собирает системное сообщение с фрагментами документов для вопроса"""
+    if not chunks:
+        content = "Подходящих фрагментов в документах не найдено."
+    else:
+        parts = []
+        used = 0
+        for chunk in chunks:
+            block = f"[Источник: {format_source(chunk)}]\n{chunk['text']}"
+            if parts and used + len(block) > max_chars:
+                break
+            parts.append(block[:max_chars])
+            used += len(block)
+        content = "Фрагменты документов для ответа на следующий вопрос:\n\n" + "\n\n".join(parts)
+    return {"role": "system", "content": content}
+
+
+def hybrid_merge(keyword_hits, dense_hits, k, similarity_floor, similarity_threshold, score_threshold):
+    """Объединяет результаты BM25 и векторного поиска.
+
+    Близость переводится в шкалу BM25: similarity_threshold соответствует
+    score_threshold, близость не выше similarity_floor ничего не добавляет.
+    Оценки одного фрагмента из двух поисков складываются.
+    Возвращает до k троек (оценка, фрагмент, близость); у фрагментов,
+    найденных только BM25, близость 0.
+    """
+    scale = score_threshold / (similarity_threshold - similarity_floor)
+    merged = {}
+    for score, chunk in keyword_hits:
+        merged[chunk["id"]] = [score, chunk, 0.0]
+    for similarity, chunk in dense_hits:
+        bonus = max(0.0, similarity - similarity_floor) * scale
+        if chunk["id"] in merged:
+            merged[chunk["id"]][0] += bonus
+            merged[chunk["id"]][2] = similarity
+        else:
+            merged[chunk["id"]] = [bonus, chunk, similarity]
+    ranked = sorted(merged.values(), key=lambda item: item[0], reverse=True)
+    return [tuple(item) for item in ranked[:k]]
@@ -0,0 +1,98 @@
+"""Извлечение простого текста из RTF без сторонних библиотек"""
+import re
+
+# Управляющее слово, экранированный байт, управляющий символ, скобки группы, перевод строки или текст
+TOKEN_RE = re.compile(
+    r"\\([a-zA-Z]{1,32})(-?\d{1,10})? ?|\\'([0-9a-fA-F]{2})|\\(.)|([{}])|[\r\n]+|([^\\{}\r\n]+)",
+    re.DOTALL,
+)
+
+# Группы, содержимое которых не является текстом документа
+SKIP_DESTINATIONS = frozenset((
+    "fonttbl", "colortbl", "stylesheet", "info", "pict", "object", "header", "footer",
+    "headerl", "headerr", "headerf", "footerl", "footerr", "footerf", "listtable",
+    "listoverridetable", "revtbl", "rsidtbl", "generator", "xmlnstbl", "themedata",
+    "colorschememapping", "latentstyles", "datastore", "fldinst", "filetbl", "pgdsctbl",
+))
+
+CONTROL_TEXT = {
+    "par": "\n", "line": "\n", "sect": "\n", "page": "\n", "row": "\n", "cell": "\t",
+    "tab": "\t", "emdash": "—", "endash": "–", "bullet": "•", "lquote": "‘", "rquote": "’",
+    "ldblquote": "«", "rdblquote": "»", "emspace": " ", "enspace": " ",
+}
+CONTROL_SYMBOLS = {"~": " ", "_": "-", "-": "", "\\": "\\", "{": "{", "}": "}", "\n": "\n", "\r": "\n"}
+
+
+def rtf_to_text(rtf):
+    """Преобразует исходный текст RTF (str, байты как latin-1) в простой текст"""
+    encoding = "cp1251"
+    uc_skip = 1  # Сколько символов пропускать после \uN (управляется \ucN)
+    skip_chars = 0
+    stack = []
+    ignorable = False
+    pending_bytes = bytearray()
+    out = []
+
+    def flush_bytes():
+        if pending_bytes:
+            out.append(pending_bytes.decode(encoding, errors="replace"))
+            pending_bytes.clear()
+
+    for match in TOKEN_RE.finditer(rtf):
+        word, arg, hex_byte, symbol, brace, text = match.groups()
+
+        if hex_byte is not None:
+            if skip_chars:
+                skip_chars -= 1
+            elif not ignorable:
+                pending_bytes.append(int(hex_byte, 16))
+            continue
+        flush_bytes()
+
+        if brace == "{":
+            stack.append((ignorable, uc_skip))
+            skip_chars = 0
+        elif brace == "}":
+            if stack:
+                ignorable, uc_skip = stack.pop()
+            skip_chars = 0
+        elif symbol is not None:
+            if symbol == "*":
+                ignorable = True
+            elif skip_chars:
+                skip_chars -= 1
+            elif not ignorable:
+                out.append(CONTROL_SYMBOLS.get(symbol, ""))
+        elif word is not None:
+            if word in SKIP_DESTINATIONS:
+                ignorable = True
+            elif word == "ansicpg" and arg:
+                encoding = f"cp{arg}"
+            elif word == "uc" and arg:
+                uc_skip = int(arg)
+            elif word == "u" and arg:
+                if not ignorable:
+                    code = int(arg)
+                    out.append(chr(code + 65536 if code < 0 else code))
+                skip_chars = uc_skip
+            elif not ignorable and word in CONTROL_TEXT:
+                out.append(CONTROL_TEXT[word])
+        elif text is not None:
+            if skip_chars:
+                # Пропускаем замещающие символы после \uN
+                dropped = min(skip_chars, len(text))
+                skip_chars -= dropped
+                text = text[dropped:]
+            if not ignorable and text:
+                out.append(text)
+    flush_bytes()
+
+    # Убираем лишние пробелы в строках и пустые строки подряд
+    lines = (" ".join(line.split()) for line in "".join(out).split("\n"))
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def read_rtf(file_path):
+    """Читает RTF-файл и возвращает его текст"""
+    with open(file_path, "r", encoding="latin-1") as file:
+        return rtf_to_text(file.read())
@@ -0,0 +1,109 @@
+"""Стеммер для русского языка (алгоритм Snowball/Портера)"""
+from functools import lru_cache
+
+VOWELS = "аеиоуыэюя"
+
+# Окончания: (суффикс, требуется ли перед ним "а" или "я")
+PERFECTIVE_GERUND = [("вшись", True), ("вши", True), ("в", True),
+                     ("ившись", False), ("ывшись", False), ("ивши", False), ("ывши", False),
+                     ("ив", False), ("ыв", False)]
+REFLEXIVE = [("ся", False), ("сь", False)]
+ADJECTIVE = [(s, False) for s in (
+    "ими", "ыми", "его", "ого", "ему", "ому", "ее", "ие", "ые", "ое", "ей", "ий", "ый",
+    "ой", "ем", "им", "ым", "ом", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею")]
+PARTICIPLE = [("ем", True), ("нн", True), ("вш", True), ("ющ", True), ("щ", True),
+              ("ивш", False), ("ывш", False), ("ующ", False)]
+VERB = [(s, True) for s in ("ла", "на", "ете", "йте", "ли", "й", "л", "ем", "н", "ло", "но",
+                            "ет", "ют", "ны", "ть", "ешь", "нно")] + \
+       [(s, False) for s in ("ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ей",
+                             "уй", "ил", "ыл", "им", "ым", "ен", "ило", "ыло", "ено", "ят",
+                             "ует", "уют", "ит", "ыт", "ены", "ить", "ыть", "ишь", "ую", "ю")]
+NOUN = [(s, False) for s in (
+    "иями", "ями", "ами", "ией", "иям", "ием", "иях", "ев", "ов", "ие", "ье", "еи", "ии",
+    "ей", "ой", "ий", "ям", "ем", "ам", "ом", "ах", "ях", "ию", "ью", "ия", "ья",
+    "а", "е", "и", "й", "о", "у", "ы", "ь", "ю", "я")]
+SUPERLATIVE = ["ейше", "ейш"]
+DERIVATIONAL = ["ость", "ост"]
+
+
+def _sorted(group):
+    return sorted(group, key=lambda item: len(item[0]), reverse=True)
+
+
+PERFECTIVE_GERUND = _sorted(PERFECTIVE_GERUND)
+ADJECTIVE = _sorted(ADJECTIVE)
+PARTICIPLE = _sorted(PARTICIPLE)
+VERB = _sorted(VERB)
+NOUN = _sorted(NOUN)
+
+
+def _strip(rv, group):
+    """Удаляет самое длинное подходящее окончание группы, возвращает (rv, удалено ли)"""
+    for suffix, after_a in group:
+        if rv.endswith(suffix):
+            rest = rv[:-len(suffix)]
+            if after_a and not rest.endswith(("а", "я")):
+                return rv, False
+            return rest, True
+    return rv, False
+
+
+def _regions(word):
+    """Возвращает начала областей RV и R2"""
+    rv = len(word)
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in VOWELS and word[i - 1] in VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = next_region(0)
+    r2 = next_region(r1)
+    return rv, r2
+
+
+@lru_cache(maxsize=200000)
+def stem(word):
+    """Возвращает основу русского слова"""
+    word = word.lower().replace("ё", "е")
+    rv_start, r2_start = _regions(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1: деепричастия, иначе возвратность + прилагательные/глаголы/существительные
+    rv, removed = _strip(rv, PERFECTIVE_GERUND)
+    if not removed:
+        rv, _ = _strip(rv, REFLEXIVE)
+        rv, removed = _strip(rv, ADJECTIVE)
+        if removed:
+            rv, _ = _strip(rv, PARTICIPLE)
+        else:
+            rv, removed = _strip(rv, VERB)
+            if not removed:
+                rv, _ = _strip(rv, NOUN)
+
+    # Шаг 2: конечная "и"
+    if rv.endswith("и"):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательные суффиксы в области R2
+    for suffix in DERIVATIONAL:
+        if rv.endswith(suffix) and rv_start + len(rv) - len(suffix) >= r2_start:
+            rv = rv[:-len(suffix)]
+            break
+
+    # Шаг 4: превосходная степень, двойная "н" и мягкий знак
+    for suffix in SUPERLATIVE:
+        if rv.endswith(suffix):
+            rv = rv[:-len(suffix)]
+            break
+    if rv.endswith("нн"):
+        rv = rv[:-1]
+    elif rv.endswith("ь"):
+        rv = rv[:-1]
+
+    return prefix + rv
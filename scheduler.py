@@ -0,0 +1,147 @@
+"""Параллельная обработка обновлений с сохранением порядка внутри чата"""
+import collections
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import telebot
+
+import metrics
+
+
+class ChatScheduler:
+    """Выполняет задачи в пуле потоков: задачи одного чата - строго по очереди.
+
+    Нажатия кнопок (callback) идут в отдельный пул без очереди по чату,
+    поэтому меню и админ-панель не ждут окончания генерации ответа.
+    Если задача вернула Future (ответ генерируется в LLMGate), поток
+    освобождается сразу, а следующие задачи этого чата ждут завершения Future.
+    """
+
+    def __init__(self, workers=8, callback_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat")
+        self.callback_executor = ThreadPoolExecutor(max_workers=callback_workers, thread_name_prefix="callback")
+        self.lock = threading.Lock()
+        self.queues = {}  # chat_id -> deque задач, пока по чату идет обработка
+
+    def submit(self, chat_id, task, *args, **kwargs):
+        """Ставит задачу в очередь чата"""
+        with self.lock:
+            queue = self.queues.get(chat_id)
+            if queue is not None:
+                queue.append((task, args, kwargs))
+                return
+            self.queues[chat_id] = collections.deque([(task, args, kwargs)])
+        self.executor.submit(self._drain, chat_id)
+
+    def submit_callback(self, task, *args, **kwargs):
+        """Выполняет задачу без ожидания очереди чата"""
+        self.callback_executor.submit(self._run, task, args, kwargs, "callback")
+
+    def pending(self):
+        """Количество задач, ожидающих в очередях чатов"""
+        with self.lock:
+            return sum(len(queue) for queue in self.queues.values())
+
+    def _drain(self, chat_id):
+        while True:
+            with self.lock:
+                queue = self.queues[chat_id]
+                if not queue:
+                    del self.queues[chat_id]
+                    return
+                task, args, kwargs = queue.popleft()
+            result = self._run(task, args, kwargs, "message")
+            if isinstance(result, Future):
+                # Очередь чата продолжится в пуле после завершения генерации
+                result.add_done_callback(lambda _: self.executor.submit(self._drain, chat_id))
+                return
+
+    @staticmethod
+    def _run(task, args, kwargs, kind):
+        try:
+            with metrics.span(f"update_{kind}"):
+                return task(*args, **kwargs)
+        except Exception as e:
+            print(f"Ошибка в обработчике {getattr(task, '__name__', task)}: {e}")
+
+
+class LLMQueueFull(Exception):
+    """Очередь к модели переполнена"""
+
+
+class LLMGate:
+    """Выполняет запросы к модели в отдельном пуле из max_concurrent потоков.
+
+    Потоки обработки сообщений не ждут модель: submit() сразу возвращает
+    Future или отказывает с LLMQueueFull, если в очереди уже max_waiting запросов.
+    """
+
+    def __init__(self, max_concurrent=1, max_waiting=20):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="llm")
+        self.lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+
+    def depth(self):
+        """Количество запросов, ожидающих в очереди"""
+        with self.lock:
+            return self.waiting
+
+    def submit(self, task, on_queued=None):
+        """Ставит task() в очередь к модели; on_queued(позиция) вызывается, если модель занята"""
+        with self.lock:
+            busy = self.active + self.waiting >= self.max_concurrent
+            if busy and self.waiting >= self.max_waiting:
+                raise LLMQueueFull()
+            self.waiting += 1
+            position = self.waiting if busy else 0
+        if position and on_queued:
+            try:
+                on_queued(position)
+            except Exception as e:
+                print(f"Ошибка уведомления об очереди: {e}")
+        return self.executor.submit(self._run, task, time.perf_counter())
+
+    def _run(self, task, queued_at):
+        with self.lock:
+            self.waiting -= 1
+            self.active += 1
+        metrics.observe("llm_queue_wait", time.perf_counter() - queued_at)
+        try:
+            return task()
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class ScheduledTeleBot(telebot.TeleBot):
+    """TeleBot, передающий обработчики в ChatScheduler вместо общего пула потоков"""
+
+    def __init__(self, token, scheduler, **kwargs):
+        super().__init__(token, **kwargs)
+        self.scheduler = scheduler
+
+    # Время запросов к Telegram попадает в метрики
+    def send_message(self, *args, **kwargs):
+        with metrics.span("telegram_send_message"):
+            return super().send_message(*args, **kwargs)
+
+    def edit_message_text(self, *args, **kwargs):
+        with metrics.span("telegram_edit_message_text"):
+            return super().edit_message_text(*args, **kwargs)
+
+    def send_document(self, *args, **kwargs):
+        with metrics.span("telegram_send_document"):
+            return super().send_document(*args, **kwargs)
+
+    def _exec_task(self, task, *args, **kwargs):
+        update = args[0] if args else None
+        if isinstance(update, telebot.types.CallbackQuery):
+            self.scheduler.submit_callback(task, *args, **kwargs)
+        elif isinstance(update, telebot.types.Message):
+            self.scheduler.submit(update.chat.id, task, *args, **kwargs)
+        else:
+            super()._exec_task(task, *args, **kwargs)
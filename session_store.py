@@ -0,0 +1,195 @@
+"""Сессии чатов и авторизация в SQLite с отложенной пакетной записью"""
+import json
+import os
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (chat_id INTEGER PRIMARY KEY, record TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS flags (kind TEXT NOT NULL, chat_id INTEGER NOT NULL, value TEXT NOT NULL,
+                                  PRIMARY KEY (kind, chat_id));
+CREATE TABLE IF NOT EXISTS auth (chat_id TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+class SessionStore:
+    """Хранилище контекстов AI-чатов, состояний меню и авторизованных пользователей.
+
+    Обработчики только отмечают измененные записи в памяти; фоновый поток
+    раз в flush_interval секунд сериализует их и записывает одной
+    транзакцией. Файл базы открыт в режиме WAL, поэтому его могут читать
+    и писать несколько процессов (режим webhook).
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.pending = {}  # (таблица, ключ) -> значение или None для удаления
+        self.flushes = 0
+        self.written = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._flush_loop, name="session-store", daemon=True)
+        self.thread.start()
+
+    def _read(self, query, params=()):
+        with self.db_lock:
+            return self.db.execute(query, params).fetchall()
+
+    def _mark(self, table, key, value):
+        with self.lock:
+            self.pending[(table, key)] = value
+
+    def load_chats(self, owns=None):
+        """{chat_id: запись контекста}; owns(chat_id) отбирает чаты этого процесса"""
+        chats = {}
+        for chat_id, record in self._read("SELECT chat_id, record FROM chats"):
+            if owns is None or owns(chat_id):
+                chats[chat_id] = json.loads(record)
+        return chats
+
+    def save_chat(self, chat_id, record):
+        """Запоминает контекст чата (None - удаляет)"""
+        self._mark("chats", chat_id, record)
+
+    def load_flags(self, kind, owns=None):
+        """{chat_id: значение} для состояний вида kind ("upload", "admin_auth")"""
+        return {chat_id: json.loads(value)
+                for chat_id, value in self._read("SELECT chat_id, value FROM flags WHERE kind = ?", (kind,))
+                if owns is None or owns(chat_id)}
+
+    def save_flag(self, kind, chat_id, value):
+        self._mark("flags", (kind, chat_id), value)
+
+    def authorized_users(self):
+        """Авторизованные пользователи, включая еще не записанные изменения"""
+        users = {chat_id: json.loads(data) for chat_id, data in self._read("SELECT chat_id, data FROM auth")}
+        with self.lock:
+            pending = [(key, value) for (table, key), value in self.pending.items() if table == "auth"]
+        for chat_id, data in pending:
+            if data is None:
+                users.pop(chat_id, None)
+            else:
+                users[chat_id] = data
+        return users
+
+    def save_authorized(self, chat_id, data):
+        """Добавляет (data) или удаляет (None) авторизованного пользователя"""
+        self._mark("auth", chat_id, data)
+
+    def import_authorized(self, users):
+        """Переносит пользователей из старого JSON-файла один раз за жизнь базы.
+
+        Перенос отмечается в таблице meta в той же транзакции, поэтому после
+        выхода всех пользователей старый файл не авторизует их снова.
+        База, где пользователи уже есть, считается перенесенной.
+        """
+        with self.db_lock, self.db:
+            marked = self.db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('auth_imported', '1')")
+            if not marked.rowcount or self.db.execute("SELECT 1 FROM auth LIMIT 1").fetchone():
+                return False
+            self.db.executemany("INSERT INTO auth (chat_id, data) VALUES (?, ?)",
+                                [(chat_id, json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+                                 for chat_id, data in users.items()])
+        return True
+
+    def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        upserts = {"chats": [], "flags": [], "auth": []}
+        deletes = {"chats": [], "flags": [], "auth": []}
+        for (table, key), value in pending.items():
+            key = key if isinstance(key, tuple) else (key,)
+            if value is None:
+                deletes[table].append(key)
+            else:
+                upserts[table].append(key + (json.dumps(value, ensure_ascii=False, separators=(",", ":")),))
+        try:
+            with self.db_lock, self.db:
+                self.db.executemany("INSERT OR REPLACE INTO chats (chat_id, record) VALUES (?, ?)", upserts["chats"])
+                self.db.executemany("DELETE FROM chats WHERE chat_id = ?", deletes["chats"])
+                self.db.executemany("INSERT OR REPLACE INTO flags (kind, chat_id, value) VALUES (?, ?, ?)",
+                                    upserts["flags"])
+                self.db.executemany("DELETE FROM flags WHERE kind = ? AND chat_id = ?", deletes["flags"])
+                self.db.executemany("INSERT OR REPLACE INTO auth (chat_id, data) VALUES (?, ?)", upserts["auth"])
+                self.db.executemany("DELETE FROM auth WHERE chat_id = ?", deletes["auth"])
+        except sqlite3.Error as e:
+            print(f"Ошибка записи сессий в {self.path}: {e}")
+            # Возвращаем изменения, которые не были перезаписаны за время попытки
+            with self.lock:
+                for key, value in pending.items():
+                    self.pending.setdefault(key, value)
+            return 0
+        self.flushes += 1
+        self.written += len(pending)
+        return len(pending)
+
+    def _flush_loop(self):
+        while not self.stopping.wait(self.flush_interval):
+            self.flush()
+
+    def stats(self):
+        with self.lock:
+            pending = len(self.pending)
+        return {"pending": pending, "flushes": self.flushes, "written": self.written}
+
+    def close(self):
+        """Останавливает фоновую запись и сохраняет оставшиеся изменения"""
+        if self.stopping.is_set():
+            return
+        self.stopping.set()
+        self.thread.join(self.flush_interval + 1)
+        self.flush()
+        with self.db_lock:
+            self.db.close()
+
+
+class ChatFlags:
+    """Словарь состояний чатов (ожидание пароля, загрузка файла), сохраняемый в SessionStore"""
+
+    def __init__(self, store, kind):
+        self.store = store
+        self.kind = kind
+        self.values = {}
+
+    def restore(self, owns=None):
+        self.values.update(self.store.load_flags(self.kind, owns))
+
+    def __contains__(self, chat_id):
+        return chat_id in self.values
+
+    def __getitem__(self, chat_id):
+        return self.values[chat_id]
+
+    def __setitem__(self, chat_id, value):
+        self.values[chat_id] = value
+        self.store.save_flag(self.kind, chat_id, value)
+
+    def __delitem__(self, chat_id):
+        del self.values[chat_id]
+        self.store.save_flag(self.kind, chat_id, None)
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, chat_id, default=None):
+        return self.values.get(chat_id, default)
+
+    def pop(self, chat_id, default=None):
+        if chat_id not in self.values:
+            return default
+        value = self.values.pop(chat_id)
+        self.store.save_flag(self.kind, chat_id, None)
+        return value
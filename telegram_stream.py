@@ -0,0 +1,150 @@
+"""Потоковый вывод ответа модели в Telegram через редактирование сообщения"""
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+import metrics
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def _retry_after(error):
+    """Сколько секунд Telegram просит подождать после ошибки 429"""
+    try:
+        return float(error.result_json["parameters"]["retry_after"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return 1.0
+
+
+class StreamingReply:
+    """Накапливает токены ответа и периодически обновляет сообщение в чате.
+
+    Сообщение редактируется, когда пришло min_tokens новых токенов или
+    прошло interval секунд, но не чаще, чем раз в min_gap секунд (лимиты
+    Telegram на редактирование). Текст длиннее лимита Telegram
+    продолжается в следующем сообщении.
+    """
+
+    def __init__(self, bot, chat_id, reply_to_message_id=None, prefix="🤖 ",
+                 min_tokens=30, interval=1.5, min_gap=1.0, limit=TELEGRAM_MESSAGE_LIMIT):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.reply_to_message_id = reply_to_message_id
+        self.prefix = prefix
+        self.min_tokens = min_tokens
+        self.interval = interval
+        self.min_gap = min_gap
+        self.limit = limit
+        self.message_id = None
+        self.text = ""  # Текст текущего (последнего) сообщения
+        self.shown = ""  # Что сейчас отображается в текущем сообщении
+        self.sent_length = 0  # Длина текста, окончательно отправленного предыдущими сообщениями
+        self.pending_tokens = 0
+        self.last_edit = 0.0
+        self.blocked_until = 0.0
+        self.started = time.monotonic()
+        self.first_token_latency = None
+
+    def push(self, token):
+        """Добавляет очередной фрагмент ответа"""
+        if not token:
+            return
+        if self.first_token_latency is None:
+            self.first_token_latency = time.monotonic() - self.started
+        self.text += token
+        self.pending_tokens += 1
+        self._split_overflow()
+
+        now = time.monotonic()
+        if now < self.blocked_until or now - self.last_edit < self.min_gap:
+            return
+        # Первый токен показываем сразу, дальше - по количеству токенов или по времени
+        if self.message_id is None or self.pending_tokens >= self.min_tokens \
+                or now - self.last_edit >= self.interval:
+            self._show(self.text)
+
+    def finish(self, final_text=None):
+        """Выводит окончательный текст ответа (целиком, включая уже отправленные части)"""
+        if final_text is not None:
+            self.text = final_text[self.sent_length:]
+            self._split_overflow()
+        self._show(self.text, force=True)
+
+    def _split_overflow(self):
+        """Переносит текст, не помещающийся в одно сообщение, в новое сообщение"""
+        max_len = self.limit - len(self.prefix)
+        while len(self.text) > max_len:
+            cut = self.text.rfind("\n", 0, max_len)
+            if cut < max_len // 2:
+                cut = self.text.rfind(" ", 0, max_len)
+            if cut < max_len // 2:
+                cut = max_len
+            head, self.text = self.text[:cut], self.text[cut:]
+            self._show(head, force=True)
+            self.sent_length += len(head)
+            # Следующая часть пойдет новым сообщением
+            self.message_id = None
+            self.shown = ""
+
+    def _show(self, text, force=False):
+        """Отправляет или редактирует текущее сообщение; возвращает успех.
+
+        При force ждет окончания блокировки Telegram вместо пропуска обновления.
+        """
+        if not text.strip() or (self.message_id is not None and text == self.shown):
+            return True
+        while True:
+            delay = self.blocked_until - time.monotonic()
+            if delay > 0:
+                if not force:
+                    return False
+                time.sleep(delay)
+            try:
+                if self.message_id is None:
+                    message = self.bot.send_message(self.chat_id, self.prefix + text,
+                                                    reply_to_message_id=self.reply_to_message_id)
+                    self.message_id = message.message_id
+                    # Продолжения ответа отправляются без привязки к вопросу
+                    self.reply_to_message_id = None
+                else:
+                    self.bot.edit_message_text(self.prefix + text, self.chat_id, self.message_id)
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    metrics.inc("bot_telegram_rate_limited_total", "Ответы 429 от Telegram при выводе ответа")
+                    self.blocked_until = time.monotonic() + _retry_after(e)
+                    continue
+                if "message is not modified" not in str(e):
+                    raise
+            self.shown = text
+            self.last_edit = time.monotonic()
+            self.pending_tokens = 0
+            return True
+
+
+class ProgressMessage:
+    """Одно сообщение о ходе долгой операции (скачивание, распаковка, разбор файлов).
+
+    Промежуточные обновления отправляются не чаще раза в interval секунд,
+    остальные пропускаются; finish() всегда выводит итоговый текст.
+    """
+
+    def __init__(self, bot, chat_id, text, reply_to_message_id=None, interval=2.0):
+        self.reply = StreamingReply(bot, chat_id, reply_to_message_id=reply_to_message_id, prefix="",
+                                    min_gap=interval)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.finish(text)
+
+    def update(self, text):
+        with self.lock:
+            if time.monotonic() - self.reply.last_edit < self.interval:
+                return
+            self.reply.text = text
+            self.reply._show(text)
+
+    def finish(self, text):
+        with self.lock:
+            self.reply.text = text
+            self.reply._split_overflow()
+            self.reply._show(self.reply.text, force=True)
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+from clauses import answer_clause_question, build_clause_index, parse_clauses
+
+ORDER = """МИНИСТЕРСТВО ТРУДА И СОЦИАЛЬНОЙ ЗАЩИТЫ РОССИЙСКОЙ ФЕДЕРАЦИИ
+
+ПРИКАЗ
+от 15 декабря 2020 г. N 903н
+
+1. Утвердить Правила по охране труда при эксплуатации электроустановок.
+2. Признать утратившим силу приказ от 24 июля 2013 г. N 328н.
+3. Настоящий приказ вступает в силу с 1 января 2021 года.
+
+Министр
+А.О. КОТЯКОВ
+
+Приложение
+к приказу от 15 декабря 2020 г. N 903н
+
+ПРАВИЛА ПО ОХРАНЕ ТРУДА ПРИ ЭКСПЛУАТАЦИИ ЭЛЕКТРОУСТАНОВОК
+
+I. Общие положения
+
+1.1. Правила устанавливают требования охраны труда при эксплуатации электроустановок.
+1.2. Работодатель обеспечивает безопасное проведение работ.
+
+II. Требования к работникам
+
+2.1. Работники проходят обучение безопасным методам работы.
+"""
+
+
+def corpus():
+    file_contents = {"Приказ N 903н.txt": ORDER}
+    return SimpleNamespace(file_contents=file_contents, clause_index=build_clause_index(file_contents))
+
+
+def test_order_and_rules_are_separate_parts():
+    parts = parse_clauses(ORDER)
+    assert [sorted(part) for part in parts] == [["1", "2", "3"], ["1.1", "1.2", "2.1"]]
+
+
+def test_last_clause_of_part_stops_before_next_part():
+    answer = answer_clause_question("пункт 3 приказа 903н", corpus())
+    assert "вступает в силу с 1 января 2021 года" in answer
+    assert "Приложение" not in answer
+    assert "1.1." not in answer
+    assert "ПРАВИЛА ПО ОХРАНЕ ТРУДА" not in answer
+
+
+def test_last_clause_of_section_stops_at_next_heading():
+    answer = answer_clause_question("пункт 1.2 приказа 903н", corpus())
+    assert "безопасное проведение работ" in answer
+    assert "II. Требования к работникам" not in answer.split("\n\n", 1)[1]
@@ -0,0 +1,85 @@
+from clauses import answer_clause_question, build_clause_index
+from corpus import CorpusSnapshot
+import corpus_map
+from corpus_map import open_snapshot, write_snapshot
+from retrieval import build_index
+
+from test_clauses import ORDER
+from test_relevance import HEIGHT_RULES, LOADING_RULES
+
+QUESTIONS = ["кто допускается к работам на высоте", "ширина проходов на складе", "наряд-допуск", "привет как дела"]
+
+
+def make_corpus():
+    file_contents = {"высота.txt": HEIGHT_RULES, "погрузка.txt": LOADING_RULES, "Приказ N 903н.txt": ORDER}
+    return CorpusSnapshot(file_contents, build_index(file_contents),
+                          clause_index=build_clause_index(file_contents))
+
+
+def test_missing_snapshot(tmp_path):
+    assert open_snapshot(str(tmp_path)) is None
+
+
+def test_mapped_snapshot_matches_memory(tmp_path):
+    corpus = make_corpus()
+    write_snapshot(str(tmp_path), corpus)
+    mapped = open_snapshot(str(tmp_path))
+
+    assert mapped.version == corpus.version
+    assert mapped.total_chars == corpus.total_chars
+    assert dict(mapped.file_contents) == dict(corpus.file_contents)
+    assert [chunk["id"] for chunk in mapped.index.chunks] == [chunk["id"] for chunk in corpus.index.chunks]
+    for question in QUESTIONS:
+        expected = corpus.index.search(question, k=3)
+        found = mapped.index.search(question, k=3)
+        assert [(round(score, 9), dict(chunk)) for score, chunk in found] == \
+               [(round(score, 9), dict(chunk)) for score, chunk in expected]
+        for (_, chunk), (_, mapped_chunk) in zip(expected, found):
+            assert mapped.index.coverage(question, mapped_chunk) == corpus.index.coverage(question, chunk)
+
+
+def test_mapped_clauses_match_memory(tmp_path):
+    corpus = make_corpus()
+    write_snapshot(str(tmp_path), corpus)
+    mapped = open_snapshot(str(tmp_path))
+
+    for number in ("1", "3", "1.1", "1.2", "2.1", "7"):
+        question = f"пункт {number} приказа 903н"
+        assert answer_clause_question(question, mapped) == answer_clause_question(question, corpus)
+
+
+def test_new_snapshot_replaces_old(tmp_path):
+    corpus = make_corpus()
+    write_snapshot(str(tmp_path), corpus)
+    smaller = {"высота.txt": HEIGHT_RULES}
+    write_snapshot(str(tmp_path), CorpusSnapshot(smaller, build_index(smaller)))
+
+    mapped = open_snapshot(str(tmp_path))
+    assert list(mapped.file_contents) == ["высота.txt"]
+
+
+def map_files(directory):
+    return sorted(path.name for path in directory.iterdir() if path.suffix == ".map")
+
+
+def test_previous_snapshot_kept_until_next_swap(tmp_path):
+    versions = []
+    for files in ({"высота.txt": HEIGHT_RULES}, {"погрузка.txt": LOADING_RULES},
+                  {"высота.txt": HEIGHT_RULES, "погрузка.txt": LOADING_RULES}):
+        corpus = CorpusSnapshot(files, build_index(files))
+        write_snapshot(str(tmp_path), corpus)
+        versions.append(corpus.version)
+    # Обработчик, прочитавший предыдущий current, еще может открыть его файл
+    assert map_files(tmp_path) == sorted(f"{version}.map" for version in versions[1:])
+
+
+def test_open_rereads_current_when_file_is_gone(tmp_path, monkeypatch):
+    corpus = make_corpus()
+    write_snapshot(str(tmp_path), corpus)
+    # Первое чтение current возвращает версию, файл которой уже удален
+    answers = iter(["removed-version"])
+    read_current = corpus_map._read_current
+    monkeypatch.setattr(corpus_map, "_read_current", lambda directory: next(answers, None) or read_current(directory))
+
+    mapped = open_snapshot(str(tmp_path))
+    assert mapped is not None and mapped.version == corpus.version
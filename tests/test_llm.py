@@ -0,0 +1,57 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from llm import LLMClient, LLMTimeout
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """Сервер, который принимает запрос и долго не отвечает"""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(3)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b'{"message": {"role": "assistant", "content": ""}, "done": true}')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def slow_host():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_request_stops_at_deadline(slow_host):
+    # Таймаут попытки больше дедлайна: попытка должна оборваться по дедлайну
+    client = LLMClient("model", [slow_host], timeout=120, deadline=0.5, retries=2, backoff=0.01)
+    started = time.monotonic()
+    with pytest.raises(LLMTimeout):
+        client.chat([{"role": "user", "content": "вопрос"}])
+    assert time.monotonic() - started < 1.5
+
+
+def test_stream_stops_at_deadline(slow_host):
+    client = LLMClient("model", [slow_host], timeout=120, deadline=0.5, retries=2, backoff=0.01)
+    started = time.monotonic()
+    with pytest.raises(LLMTimeout):
+        list(client.stream_chat([{"role": "user", "content": "вопрос"}]))
+    assert time.monotonic() - started < 1.5
+
+
+def test_embed_uses_its_own_deadline(slow_host):
+    # Общий дедлайн клиента большой, у эмбеддинга вопроса - свой, без повторов
+    client = LLMClient("model", [slow_host], timeout=120, deadline=300, retries=2, backoff=0.01)
+    started = time.monotonic()
+    with pytest.raises(LLMTimeout):
+        client.embed("embed-model", "вопрос", deadline=0.5, retries=0)
+    assert time.monotonic() - started < 1.5
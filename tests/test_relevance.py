@@ -0,0 +1,95 @@
+import pytest
+
+from retrieval import build_index, hybrid_merge, is_relevant
+
+# В маленьком корпусе оценки BM25 ниже, чем в папке data, поэтому порог оценки снижен;
+# порог покрытия - как RELEVANCE_MIN_COVERAGE в main.py
+MIN_SCORE = 0.5
+MIN_COVERAGE = 0.5
+# Пороги близости - как EMBEDDING_SIM_FLOOR и EMBEDDING_MIN_SIMILARITY в main.py
+SIM_FLOOR = 0.4
+MIN_SIMILARITY = 0.6
+
+HEIGHT_RULES = """Правила по охране труда при работе на высоте
+
+I. Общие положения
+
+1. Правила устанавливают требования охраны труда при организации и проведении работ на высоте.
+2. К работам на высоте допускаются работники не моложе 18 лет, прошедшие обучение и проверку знаний.
+3. Работы на высоте выполняются по наряду-допуску. Наряд-допуск выдается ответственным руководителем.
+
+II. Средства защиты
+
+4. Работники обеспечиваются средствами индивидуальной защиты от падения с высоты: страховочными привязями и стропами.
+5. Запрещается работать на высоте при грозе, гололеде и скорости ветра более 15 м/с.
+6. Лестницы и стремянки перед применением осматриваются, неисправные лестницы к работе не допускаются.
+"""
+
+LOADING_RULES = """Правила по охране труда при погрузочно-разгрузочных работах
+
+1. Погрузочно-разгрузочные работы выполняются механизированным способом.
+2. Ширина проходов на складе между штабелями должна быть не менее 1 м.
+3. Дела о несчастных случаях хранятся в организации. Стоимость работ определяется договором.
+4. Программирование погрузчиков выполняет изготовитель. Погода учитывается при работе на открытой площадке.
+"""
+
+
+@pytest.fixture(scope="module")
+def index():
+    return build_index({"высота.txt": HEIGHT_RULES, "погрузка.txt": LOADING_RULES})
+
+
+def relevant(index, question):
+    return is_relevant(index, question, index.search(question, k=5), MIN_SCORE, MIN_COVERAGE)
+
+
+@pytest.mark.parametrize("question", [
+    "привет как дела",
+    "сколько стоит биткоин",
+    "лучший язык программирования",
+    "какая погода завтра",
+    "напиши о себе",
+    "расскажи о футболе",
+    "что такое любовь",
+])
+def test_off_topic_questions_are_rejected(index, question):
+    assert not relevant(index, question)
+
+
+@pytest.mark.parametrize("question", [
+    "кто допускается к работам на высоте",
+    "что такое наряд-допуск",
+    "средства индивидуальной защиты от падения",
+    "можно ли работать на высоте в грозу",
+    "какая ширина проходов на складе",
+    "что сказано о лестницах и стремянках",
+])
+def test_questions_about_documents_pass(index, question):
+    assert relevant(index, question)
+
+
+def test_single_shared_word_is_not_enough(index):
+    # "дела" есть в документах, но "привет" - нет: совпадение одного общего слова не в счет
+    question = "привет как дела"
+    score, chunk = index.search(question, k=1)[0]
+    assert score > 0
+    assert index.coverage(question, chunk) < MIN_COVERAGE
+
+
+def dense_relevant(index, question, similarity):
+    """Вопрос, для которого векторный поиск нашел только фрагмент о грозе"""
+    chunk = next(chunk for chunk in index.chunks if "грозе" in chunk["text"])
+    hits = hybrid_merge(index.search(question, k=5), [(similarity, chunk)], 5,
+                        SIM_FLOOR, MIN_SIMILARITY, MIN_SCORE)
+    return is_relevant(index, question, hits, MIN_SCORE, MIN_COVERAGE, MIN_SIMILARITY)
+
+
+def test_dense_paraphrase_passes(index):
+    # Пересказ без общих с документом основ слов: покрытие 0, решает близость
+    question = "разрешено ли трудиться наверху во время бури"
+    assert not relevant(index, question)
+    assert dense_relevant(index, question, 0.7)
+
+
+def test_weak_dense_match_still_needs_coverage(index):
+    assert not dense_relevant(index, "разрешено ли трудиться наверху во время бури", 0.5)
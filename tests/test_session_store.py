@@ -0,0 +1,38 @@
+from session_store import SessionStore
+
+LEGACY_USERS = {"1001": {"username": "admin"}, "1002": {"username": "editor"}}
+
+
+def open_store(tmp_path):
+    return SessionStore(str(tmp_path / "sessions.sqlite3"), flush_interval=60)
+
+
+def test_legacy_users_are_imported_once(tmp_path):
+    store = open_store(tmp_path)
+    assert store.import_authorized(LEGACY_USERS)
+    assert store.authorized_users() == LEGACY_USERS
+    assert not store.import_authorized(LEGACY_USERS)
+    store.close()
+
+
+def test_logout_survives_restart(tmp_path):
+    store = open_store(tmp_path)
+    store.import_authorized(LEGACY_USERS)
+    for chat_id in LEGACY_USERS:
+        store.save_authorized(chat_id, None)  # /logout
+    store.close()
+
+    # Перезапуск: старый файл все еще на месте, но пользователи не возвращаются
+    store = open_store(tmp_path)
+    assert not store.import_authorized(LEGACY_USERS)
+    assert store.authorized_users() == {}
+    store.close()
+
+
+def test_existing_users_are_not_overwritten(tmp_path):
+    store = open_store(tmp_path)
+    store.save_authorized("2001", {"username": "new"})
+    store.flush()
+    assert not store.import_authorized(LEGACY_USERS)
+    assert store.authorized_users() == {"2001": {"username": "new"}}
+    store.close()
@@ -0,0 +1,116 @@
+"""Загрузка файлов администратором: потоковое скачивание из Telegram и распаковка ZIP-архивов"""
+import os
+import re
+import zipfile
+
+import requests
+
+ALLOWED_EXTENSIONS = (".txt", ".pdf", ".docx", ".rtf")
+CHUNK_SIZE = 256 * 1024  # Файлы копируются кусками, целиком в памяти не держатся
+ZIP_UTF8_FLAG = 0x800
+
+_UNSAFE_CHARS_RE = re.compile(r'[\x00-\x1f<>:"|?*]')
+
+
+class UploadError(Exception):
+    """Файл не удалось скачать или сохранить"""
+
+
+def clean_filename(name):
+    """Имя файла без каталогов и недопустимых символов; None, если имя не годится"""
+    name = _UNSAFE_CHARS_RE.sub("", os.path.basename(name.replace("\\", "/"))).strip()
+    if not name or name.startswith("."):
+        return None
+    return name
+
+
+def is_allowed(filename):
+    return os.path.splitext(filename)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def _temp_path(dest_path):
+    # Скрытое имя: glob("*") при загрузке базы знаний не увидит недописанный файл
+    directory, name = os.path.split(dest_path)
+    return os.path.join(directory, f".{name}.{os.getpid()}.part")
+
+
+def copy_limited(source, dest_path, max_bytes):
+    """Копирует поток source в dest_path через временный файл и атомарно переименовывает.
+
+    Возвращает число байт; при превышении max_bytes файл не создается.
+    """
+    temp_path = _temp_path(dest_path)
+    size = 0
+    try:
+        with open(temp_path, 'wb') as f:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadError(f"размер больше {max_bytes // (1024 * 1024)} МБ")
+                f.write(chunk)
+        os.replace(temp_path, dest_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return size
+
+
+def download(url, dest_path, max_bytes, timeout=(15, 60), proxies=None):
+    """Скачивает url в dest_path кусками по CHUNK_SIZE"""
+    with requests.get(url, stream=True, timeout=timeout, proxies=proxies) as response:
+        if response.status_code != 200:
+            raise UploadError(f"Telegram вернул HTTP {response.status_code}")
+        response.raw.decode_content = True
+        return copy_limited(response.raw, dest_path, max_bytes)
+
+
+def telegram_file_url(token, file_path, file_url=None):
+    """Адрес файла на сервере Telegram (file_url - шаблон apihelper.FILE_URL, если задан)"""
+    return (file_url or "https://api.telegram.org/file/bot{0}/{1}").format(token, file_path)
+
+
+def _member_name(info):
+    """Имя файла в архиве: архивы из Windows хранят русские имена в cp866"""
+    if info.flag_bits & ZIP_UTF8_FLAG:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("cp866")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def extract_zip(archive_path, dest_dir, max_file_bytes, max_total_bytes, on_progress=None):
+    """Распаковывает документы поддерживаемых форматов из архива в dest_dir.
+
+    Каталоги внутри архива не сохраняются, каждый файл пишется потоком
+    через временный файл. Возвращает (сохраненные имена, [(имя, причина пропуска)]).
+    on_progress(обработано, всего) вызывается после каждого файла архива.
+    """
+    saved = []
+    skipped = []
+    total = 0
+    with zipfile.ZipFile(archive_path) as archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+        for position, info in enumerate(members, 1):
+            raw_name = _member_name(info)
+            name = clean_filename(raw_name)
+            if name is None:
+                skipped.append((raw_name, "недопустимое имя"))
+            elif not is_allowed(name):
+                skipped.append((name, "неподдерживаемый формат"))
+            elif name in saved:
+                skipped.append((name, "повтор имени в архиве"))
+            elif info.file_size > max_file_bytes or total + info.file_size > max_total_bytes:
+                skipped.append((name, "слишком большой"))
+            else:
+                try:
+                    with archive.open(info) as source:
+                        # Размер в заголовке может быть неверным - ограничение проверяется и при чтении
+                        total += copy_limited(source, os.path.join(dest_dir, name),
+                                              min(max_file_bytes, max_total_bytes - total))
+                    saved.append(name)
+                except (UploadError, RuntimeError, zipfile.BadZipFile, OSError) as e:
+                    skipped.append((name, str(e)))
+            if on_progress:
+                on_progress(position, len(members))
+    return saved, skipped
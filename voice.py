@@ -0,0 +1,43 @@
+"""Декодирование голосовых сообщений Telegram (OGG/Opus) в PCM прямо в памяти"""
+import importlib.util
+import io
+import subprocess
+
+SAMPLE_RATE = 16000  # Частота, с которой работают распознаватели речи
+SAMPLE_WIDTH = 2  # 16-битный PCM
+
+
+def has_av():
+    """Установлен ли PyAV (проверка без импорта самой библиотеки)"""
+    return importlib.util.find_spec("av") is not None
+
+
+def _decode_with_av(data, sample_rate):
+    import av  # PyAV: декодирование внутри процесса, без запуска ffmpeg; импорт при первом голосовом
+
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=sample_rate)
+    pcm = bytearray()
+    with av.open(io.BytesIO(data)) as container:
+        for frame in container.decode(audio=0):
+            for out in resampler.resample(frame):
+                pcm += bytes(out.planes[0])[:out.samples * SAMPLE_WIDTH]
+    for out in resampler.resample(None):
+        pcm += bytes(out.planes[0])[:out.samples * SAMPLE_WIDTH]
+    return bytes(pcm)
+
+
+def _decode_with_ffmpeg(data, sample_rate):
+    # Данные передаются через stdin/stdout, файлы на диске не создаются
+    result = subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-i", "pipe:0",
+         "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate), "pipe:1"],
+        input=data, capture_output=True, check=True,
+    )
+    return result.stdout
+
+
+def decode_voice(data, sample_rate=SAMPLE_RATE):
+    """Декодирует OGG/Opus в 16-битный моно PCM с частотой sample_rate"""
+    if has_av():
+        return _decode_with_av(data, sample_rate)
+    return _decode_with_ffmpeg(data, sample_rate)
@@ -0,0 +1,197 @@
+"""Режим webhook: HTTP-сервер принимает обновления Telegram и раздает их процессам-обработчикам.
+
+Обновления одного чата всегда попадают в один процесс (по хэшу chat_id),
+поэтому состояние чата (контекст диалога, AI-режим, сессии) живет в одном
+процессе. Ведущий процесс (этот сервер) разбирает файлы и пишет эмбеддинги,
+обработчики только читают общие кэши на диске.
+"""
+import json
+import multiprocessing
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import metrics
+
+# Поля обновления, в которых есть сообщение или событие чата
+CHAT_UPDATE_KEYS = ("message", "edited_message", "channel_post", "edited_channel_post",
+                    "my_chat_member", "chat_member", "chat_join_request")
+SUPERVISE_INTERVAL = 5  # Как часто проверять, что процессы-обработчики живы, секунд
+
+
+def update_chat_id(update):
+    """chat_id обновления Telegram (dict) или None"""
+    for key in CHAT_UPDATE_KEYS:
+        if key in update:
+            return update[key]["chat"]["id"]
+    callback = update.get("callback_query")
+    if callback:
+        message = callback.get("message")
+        return message["chat"]["id"] if message else callback["from"]["id"]
+    return None
+
+
+def worker_for(chat_id, workers):
+    """Номер процесса-обработчика для чата"""
+    if chat_id is None:
+        return 0
+    return zlib.crc32(str(chat_id).encode("ascii")) % workers
+
+
+class WebhookIngress:
+    """Процессы-обработчики и очереди обновлений к ним.
+
+    worker_target(номер, всего, очередь обновлений, очередь событий) - тело
+    процесса-обработчика. В очередь обновлений приходят байты JSON
+    обновления, кортеж ("corpus", имена файлов или None) после изменения базы
+    знаний, ("ready", None), когда ведущий процесс заполнил кэши, и None для завершения. Через очередь событий обработчик сообщает
+    (номер, имена файлов или None), что админ изменил файлы.
+    on_corpus_change(имена файлов или None) обновляет базу знаний в ведущем процессе.
+    """
+
+    def __init__(self, worker_target, workers, on_corpus_change):
+        self.context = multiprocessing.get_context("spawn")
+        self.worker_target = worker_target
+        self.on_corpus_change = on_corpus_change
+        self.queues = [self.context.Queue() for _ in range(workers)]
+        self.events = self.context.Queue()
+        self.processes = [None] * workers
+        self.stopping = threading.Event()
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+
+    def _start_worker(self, index):
+        process = self.context.Process(target=self.worker_target,
+                                       args=(index, len(self.queues), self.queues[index], self.events),
+                                       name=f"bot-worker-{index}", daemon=True)
+        process.start()
+        with self.lock:
+            self.processes[index] = process
+            if self.ready.is_set():
+                # Перезапущенный обработчик сразу загружает готовую базу знаний
+                self.queues[index].put(("ready", None))
+
+    def mark_ready(self):
+        """Кэши заполнены: обработчики могут загружать базу знаний"""
+        with self.lock:
+            self.ready.set()
+            for queue in self.queues:
+                queue.put(("ready", None))
+
+    def prepare(self, task):
+        """Выполняет task() (загрузку базы знаний ведущим процессом), затем отпускает обработчики"""
+        try:
+            task()
+        except Exception as e:
+            # Обработчики загрузят то, что есть в кэшах, остальное - при следующем изменении
+            print(f"Ошибка загрузки базы знаний в ведущем процессе: {e}")
+        self.mark_ready()
+
+    def start(self):
+        for index in range(len(self.queues)):
+            self._start_worker(index)
+        threading.Thread(target=self._relay_events, name="corpus-events", daemon=True).start()
+        threading.Thread(target=self._supervise, name="supervisor", daemon=True).start()
+        for index, _ in enumerate(self.queues):
+            metrics.gauge(f"bot_webhook_queue_depth_worker_{index}", f"Обновления в очереди процесса {index}",
+                          lambda queue=self.queues[index]: queue.qsize())
+
+    def dispatch(self, body):
+        """Передает обновление процессу его чата"""
+        update = json.loads(body)
+        index = worker_for(update_chat_id(update), len(self.queues))
+        self.queues[index].put(body)
+        metrics.inc("bot_webhook_updates_total", "Обновления, полученные через webhook", worker=index)
+
+    def _relay_events(self):
+        # Файл разбирает ведущий процесс, затем снимок обновляют все обработчики (из кэша)
+        while not self.stopping.is_set():
+            try:
+                origin, filenames = self.events.get(timeout=1)
+            except Exception:
+                continue
+            try:
+                self.on_corpus_change(filenames)
+            except Exception as e:
+                print(f"Ошибка обновления базы знаний ({', '.join(filenames or ['все файлы'])}): {e}")
+            for queue in self.queues:
+                queue.put(("corpus", filenames))
+
+    def _supervise(self):
+        while not self.stopping.wait(SUPERVISE_INTERVAL):
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    print(f"⚠️ Процесс-обработчик {index} завершился (код {process.exitcode}), перезапускаю")
+                    metrics.inc("bot_webhook_worker_restarts_total", "Перезапуски процессов-обработчиков",
+                                worker=index)
+                    self._start_worker(index)
+
+    def stop(self, timeout=10):
+        self.stopping.set()
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout)
+
+
+def make_server(ingress, listen, port, path, secret_token=None):
+    """HTTP-сервер, принимающий POST от Telegram на path"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != path:
+                self.send_error(404)
+                return
+            if secret_token and self.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret_token:
+                self.send_error(403)
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length)
+            try:
+                ingress.dispatch(body)
+            except Exception as e:
+                print(f"Ошибка разбора обновления webhook: {e}")
+                self.send_error(400)
+                return
+            # Telegram ждет только подтверждения, ответ формируют обработчики
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((listen, port), Handler)
+
+
+def run_webhook(bot, url, listen, port, workers, worker_target, on_corpus_change, secret_token=None,
+                prepare=None):
+    """Запускает обработчики, регистрирует webhook в Telegram и принимает обновления.
+
+    url - публичный HTTPS-адрес (обычно прокси, пересылающий запросы на listen:port).
+    prepare() - загрузка базы знаний ведущим процессом; идет в фоне, пока сервер
+    уже принимает обновления, после нее обработчики получают ("ready", None).
+    """
+    ingress = WebhookIngress(worker_target, workers, on_corpus_change)
+    ingress.start()
+    server = make_server(ingress, listen, port, urlparse(url).path or "/", secret_token)
+    threading.Thread(target=ingress.prepare, args=(prepare or (lambda: None),),
+                     name="leader-warm-up", daemon=True).start()
+    bot.set_webhook(url=url, secret_token=secret_token or None)
+    print(f"🌐 Webhook {url}: слушаю {listen}:{port}, процессов-обработчиков: {workers}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            bot.remove_webhook()
+        except Exception as e:
+            print(f"Ошибка удаления webhook: {e}")
+        ingress.stop()
+        # Даем обработчикам дописать кэши
+        time.sleep(0.5)